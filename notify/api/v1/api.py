@@ -13,91 +13,796 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import hashlib
+import collections
+from concurrent import futures
 import logging
+import threading
+import time
 
 import flask
 
+from notify import breaker
+from notify import codec
 from notify import config
+from notify import dedup
 from notify import driver
+from notify import executor
+from notify import jobs
+from notify import metrics
+from notify import ratelimit
+from notify import registry
+from notify import retry
+from notify import tracing
 
 
 LOG = logging.getLogger("api")
 LOG.setLevel(config.get_config().get("logging", {}).get("level", "INFO"))
+LOG.addFilter(tracing.RequestIdFilter())
 
 
 bp = flask.Blueprint("notify", __name__)
 
 
-CACHE = {}
+CACHE = registry.Registry(**config.get_config().get("driver_cache", {}))
 
+BREAKERS = {}
 
-def make_hash(dct):
-    """Generate MD5 hash of given dict.
+JOBS = None
+_LOCK = threading.Lock()
 
-    :param dct: dict to hash. There may be collisions
-                if it isn't flat (includes sub-dicts)
-    :returns: str MD5 hexdigest (32 chars)
+COALESCER = None
+
+RETRIES = None
+
+LIMITER = None
+
+CIRCUIT_OPEN = "Driver is failing, circuit breaker is open"
+
+TIMED_OUT = "Driver has timed out"
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def get_job_queue():
+    """Get job queue for asynchronous delivery.
+
+    :returns: jobs.JobQueue or None if it is not configured
+    """
+    global JOBS
+    if JOBS is None:
+        conf = config.get_config().get("jobs")
+        if conf:
+            with _LOCK:
+                if JOBS is None:
+                    queue = jobs.JobQueue(conf["path"], _deliver_later,
+                                          workers=conf.get("workers", 2))
+                    queue.start()
+                    JOBS = queue
+    return JOBS
+
+
+def get_retry_store():
+    """Get durable store of failed deliveries.
+
+    :returns: retry.RetryStore or None if retries are not configured
+    """
+    global RETRIES
+    if RETRIES is None:
+        conf = config.get_config().get("retry")
+        if conf:
+            with _LOCK:
+                if RETRIES is None:
+                    conf = dict(conf)
+                    store = retry.RetryStore(conf.pop("path"), _redeliver,
+                                             **conf)
+                    store.start()
+                    RETRIES = store
+    return RETRIES
+
+
+def get_coalescer():
+    """Get coalescer of repeated alerts.
+
+    :returns: dedup.Coalescer or None if deduplication is not configured
+    """
+    global COALESCER
+    if COALESCER is None:
+        window = config.get_config().get("dedup", {}).get("window")
+        if window:
+            with _LOCK:
+                if COALESCER is None:
+                    COALESCER = dedup.Coalescer(window, _deliver_later)
+    return COALESCER
+
+
+def get_limiter():
+    """Get rate limiter of backends and drivers.
+
+    :returns: ratelimit.Limiter or None if there are no rate limits
+    """
+    global LIMITER
+    if LIMITER is None:
+        conf = config.get_config()
+        limits = conf.get("rate_limits")
+        if limits:
+            with _LOCK:
+                if LIMITER is None:
+                    LIMITER = ratelimit.Limiter(
+                        limits, conf.get("rate_limit_store", {}).get("path"))
+    return LIMITER
+
+
+def _get_breaker(key):
+    """Get circuit breaker of cached driver instance.
+
+    :param key: driver CACHE key
+    :returns: breaker.CircuitBreaker or None if it is not configured
+    """
+    conf = config.get_config().get("circuit_breaker")
+    if not conf:
+        return None
+    if key not in BREAKERS:
+        with _LOCK:
+            if key not in BREAKERS:
+                BREAKERS[key] = breaker.CircuitBreaker(**conf)
+    return BREAKERS[key]
+
+
+def warm_up():
+    """Create instances of all configured drivers in advance."""
+    CACHE.warm_up(config.get_config()["notify_backends"])
+
+
+def _reload(old_conf, new_conf):
+    """Apply reloaded configuration.
+
+    Only drivers with changed configuration are recreated, instances of
+    unchanged ones keep their pooled connections and tokens.
     """
-    str_repr = "|".join(["%s:%s" % x for x in sorted(dct.items())])
-    return hashlib.md5(str_repr.encode("utf-8")).hexdigest()
+    global LIMITER
+    keep = CACHE.warm_up(new_conf["notify_backends"])
+    CACHE.prune(keep)
+    for key in set(BREAKERS) - set(keep):
+        BREAKERS.pop(key, None)
+    for section in ("rate_limits", "rate_limit_store"):
+        if old_conf.get(section) != new_conf.get(section):
+            LIMITER = None
+
+
+config.RELOAD_HOOKS.append(_reload)
+
+
+def _is_set(arg):
+    return flask.request.args.get(arg, "").lower() in ("1", "true", "yes")
+
+
+def _is_compact():
+    return _is_set("compact") or _is_minimal_preferred(
+        flask.request.headers.get("Prefer"))
+
+
+def _is_minimal_preferred(prefer):
+    """Check whether Prefer header asks for minimal response (RFC 7240)."""
+    return "return=minimal" in (prefer or "").replace(" ", "").lower()
+
+
+def _respond(body, code):
+    """Make JSON response, serialized by fast codec."""
+    return flask.Response(codec.dumps(body), code,
+                          mimetype="application/json")
 
 
 @bp.route("/notify/<backends>", methods=["POST"])
 def send_notification(backends):
-    global CACHE
+    try:
+        payload = codec.loads(flask.request.get_data())
+    except ValueError:
+        payload = None
+    notify_backends = config.get_config()["notify_backends"]
+    backends = set(backends.split(","))
+
+    response = _accept(backends, payload, notify_backends, _is_set("async"))
+    if not response:
+        response = deliver(backends, payload, notify_backends), 200
+    if _is_compact():
+        response = _compact(response[0]), response[1]
+    return _respond(*response)
+
+
+@bp.route("/notify/<backends>/batch", methods=["POST"])
+def send_batch_notification(backends):
+    notify_backends = config.get_config()["notify_backends"]
+    backends = set(backends.split(","))
+
+    error, items, valid = _accept_batch(
+        backends, flask.request.get_data(as_text=True), notify_backends)
+    if error:
+        return _respond({"error": error}, 400)
 
+    delivered = iter(valid and deliver_many(backends, valid, notify_backends))
+    return _respond(_batch_result(items, delivered, _is_compact()), 200)
+
+
+@bp.route("/notify/<backends>/stream", methods=["POST"])
+def send_stream_notification(backends):
+    notify_backends = config.get_config()["notify_backends"]
     backends = set(backends.split(","))
-    payload = flask.request.get_json(force=True, silent=True)
 
+    unexpected = backends - set(notify_backends)
+    if unexpected:
+        mesg = "Unexpected backends: {}".format(", ".join(unexpected))
+        return _respond({"error": mesg}, 400)
+
+    lines = _read_lines(flask.request.stream,
+                        executor.get_settings()["max_line_size"])
+    return flask.Response(
+        flask.stream_with_context(_stream(backends, lines, notify_backends,
+                                          _is_compact())),
+        mimetype=NDJSON_MIMETYPE)
+
+
+def _accept(backends, payload, notify_backends, async_mode=False):
+    """Validate notification request and handle it unless it is synchronous.
+
+    Shared by WSGI and ASGI applications.
+
+    :param backends: set of requested backend names
+    :param payload: parsed request body
+    :param notify_backends: backends configuration
+    :param async_mode: whether payload should be queued as a job
+    :returns: tuple (response, HTTP code), or None if payload has to be
+              delivered right now
+    """
     if not payload:
-        return flask.jsonify({"error": "Missed Payload"}), 400
+        return {"error": "Missed Payload"}, 400
 
     try:
-        driver.Driver.validate_payload(payload)
+        with tracing.span("validate_payload"):
+            driver.Driver.validate_payload(payload)
     except ValueError as e:
-        return flask.jsonify({"error": "Bad Payload: {}".format(e)}), 400
+        return {"error": "Bad Payload: {}".format(e)}, 400
 
-    notify_backends = config.get_config()["notify_backends"]
+    unexpected = backends - set(notify_backends)
+    if unexpected:
+        mesg = "Unexpected backends: {}".format(", ".join(unexpected))
+        return {"error": mesg}, 400
+
+    queue = None
+    if async_mode:
+        queue = get_job_queue()
+        if queue is None:
+            return {"error": "Async mode is disabled"}, 400
+
+    # Alert opens dedup window only if it is going to be delivered
+    coalescer = get_coalescer()
+    if coalescer:
+        repeats = coalescer.add(backends, payload)
+        if repeats:
+            result = _new_result()
+            result.update(payload=payload, deduplicated=repeats)
+            return result, 200
+
+    if queue is not None:
+        return {"job": queue.put(sorted(backends), payload)}, 202
+
+    return None
 
+
+def _accept_batch(backends, data, notify_backends):
+    """Parse and validate batch request.
+
+    :param backends: set of requested backend names
+    :param data: request body
+    :param notify_backends: backends configuration
+    :returns: tuple (error, items, valid), where error is message of
+              rejected request or None, items are error items of invalid
+              payloads or None placeholders and valid are payloads to send
+    """
     unexpected = backends - set(notify_backends)
     if unexpected:
         mesg = "Unexpected backends: {}".format(", ".join(unexpected))
-        return flask.jsonify({"error": mesg}), 400
+        return mesg, None, None
+
+    try:
+        payloads = _parse_batch(data)
+    except ValueError as e:
+        return "Bad Batch: {}".format(e), None, None
+
+    if not payloads:
+        return "Missed Payload", None, None
+
+    max_size = executor.get_settings()["batch_size"]
+    if len(payloads) > max_size:
+        mesg = "Batch is too large: {} > {}".format(len(payloads), max_size)
+        return mesg, None, None
+
+    items = []
+    valid = []
+    with tracing.span("validate_payload", count=len(payloads)):
+        for payload in payloads:
+            try:
+                driver.Driver.validate_payload(payload)
+            except ValueError as e:
+                items.append({"error": "Bad Payload: {}".format(e)})
+            else:
+                items.append(None)
+                valid.append(payload)
+    return None, items, valid
+
+
+def _batch_result(items, delivered, compact=False):
+    """Fill placeholders of batch items and sum up counters.
+
+    :param items: items returned by _accept_batch()
+    :param delivered: iterator over results of valid payloads
+    :param compact: whether to omit driver results of successful items
+    """
+    items = [item or next(delivered) for item in items]
+    if compact:
+        items = [_compact(item) for item in items]
+
+    result = _new_result()
+    del result["result"]
+    result["items"] = items
+    for item in items:
+        for counter in ("total", "passed", "failed", "errors", "throttled"):
+            result[counter] += item.get(counter, 0)
+    return result
+
+
+def _parse_batch(data):
+    """Parse JSON array or newline-delimited JSON objects.
+
+    :returns: list of payloads
+    :raises: ValueError
+    """
+    data = data.strip()
+    if data.startswith("["):
+        payloads = codec.loads(data)
+    else:
+        payloads = [codec.loads(line) for line in data.splitlines()
+                    if line.strip()]
+    if not isinstance(payloads, list):
+        raise ValueError("JSON array is expected")
+    return payloads
+
+
+def _read_lines(stream, max_size):
+    """Read lines of request body one by one.
+
+    :param stream: file-like request body
+    :param max_size: max size of line in bytes, without newline
+    :returns: iterator over lines, where lines longer than max_size are
+              skipped and replaced with None
+    """
+    while True:
+        line = stream.readline(max_size + 1)
+        if not line:
+            return
+        if line.endswith(b"\n") or len(line) <= max_size:
+            yield line
+            continue
+        while line and not line.endswith(b"\n"):
+            line = stream.readline(max_size + 1)
+        yield None
 
-    result = {"payload": payload, "result": {},
-              "total": 0, "passed": 0, "failed": 0, "errors": 0}
 
+def _stream(backends, lines, notify_backends, compact=False):
+    """Deliver payloads of streamed lines and generate results.
+
+    At most stream_in_flight payloads are delivered concurrently. Next
+    line is not read until result of the oldest one is sent, so slow
+    delivery slows down reading of request body.
+
+    :param backends: set of requested backend names
+    :param lines: iterator over lines returned by _read_lines()
+    :param notify_backends: backends configuration
+    :param compact: whether to omit driver results of successful lines
+    :returns: iterator over NDJSON lines of results
+    """
+    in_flight = executor.get_settings()["stream_in_flight"]
+    pool = executor.get_stream_executor()
+    pending = collections.deque()
+    summary = _new_stream_summary()
+
+    def pop():
+        number, item, future = pending.popleft()
+        if future is not None:
+            try:
+                item = future.result()
+            except Exception:
+                LOG.exception("Delivery of line {} has failed".format(number))
+                item = {"error": "Something has went wrong!"}
+        return _stream_item(summary, number, item, compact)
+
+    for number, line in enumerate(lines, 1):
+        summary["lines"] = number
+        if line is not None and not line.strip():
+            continue
+        item, payload = _accept_line(backends, line, notify_backends)
+        future = None
+        if item is None:
+            future = pool.submit(deliver, backends, payload, notify_backends)
+        pending.append((number, item, future))
+        while pending and (len(pending) >= in_flight or
+                           pending[0][2] is None or pending[0][2].done()):
+            yield pop()
+
+    while pending:
+        yield pop()
+    yield _dump_line(summary)
+
+
+def _accept_line(backends, line, notify_backends):
+    """Parse and validate streamed line.
+
+    Shared by WSGI and ASGI applications.
+
+    :param line: bytes or None if line is too long
+    :returns: tuple (item, payload), where item is result of rejected or
+              deduplicated payload or None if payload has to be delivered
+    """
+    if line is None:
+        return {"error": "Line is too long"}, None
+    try:
+        payload = codec.loads(line)
+    except ValueError as e:
+        return {"error": "Bad Payload: {}".format(e)}, None
+
+    response = _accept(backends, payload, notify_backends)
+    return response and response[0], payload
+
+
+def _new_stream_summary():
+    summary = _new_result()
+    del summary["result"]
+    summary.update(lines=0, rejected=0)
+    return summary
+
+
+def _stream_item(summary, number, item, compact=False):
+    """Make NDJSON line of result and add it to summary.
+
+    :param summary: dict returned by _new_stream_summary()
+    :param number: number of line in request body
+    :param item: result of deliver(), or error item of rejected line
+    :param compact: whether to omit driver results of successful item
+    :returns: bytes
+    """
+    item = dict(_compact(item) if compact else item, line=number)
+    item.pop("payload", None)
+    if "total" not in item:
+        summary["rejected"] += 1
+    for counter in ("total", "passed", "failed", "errors", "throttled"):
+        summary[counter] += item.get(counter, 0)
+    return _dump_line(item)
+
+
+def _dump_line(data):
+    return codec.dumps(data) + b"\n"
+
+
+def _compact(result):
+    """Strip echoed payload and driver results unless some driver failed.
+
+    :param result: result of deliver() or any other response body
+    :returns: dict
+    """
+    if any(result.get(counter) for counter in ("failed", "errors",
+                                               "throttled")):
+        return result
+    return dict((key, value) for key, value in result.items()
+                if key not in ("payload", "result"))
+
+
+@bp.route("/breakers", methods=["GET"])
+def get_breakers():
+    return flask.jsonify({"breakers": dict(
+        (key, circuit.to_dict()) for key, circuit in BREAKERS.items())}), 200
+
+
+@bp.route("/retries", methods=["GET"])
+def get_retries():
+    store = get_retry_store()
+    if not store:
+        return flask.jsonify({"error": "Retries are disabled"}), 404
+    result = store.stats()
+    result["dead_letters"] = store.get_dead_letters()
+    return flask.jsonify(result), 200
+
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    queue = get_job_queue()
+    job = queue and queue.get(job_id)
+    if not job:
+        return flask.jsonify({"error": "Job not found"}), 404
+    return flask.jsonify(job), 200
+
+
+def _deliver_later(backends, payload):
+    notify_backends = config.get_config()["notify_backends"]
+    unexpected = set(backends) - set(notify_backends)
+    if unexpected:
+        return {"error": "Unexpected backends: {}".format(
+            ", ".join(unexpected))}
+    return deliver(backends, payload, notify_backends)
+
+
+def deliver(backends, payload, notify_backends):
+    """Send payload with all drivers of given backends.
+
+    :param backends: iterable of backend names
+    :param payload: valid notification payload
+    :param notify_backends: backends configuration
+    :returns: dict with results of all drivers and counters
+    """
+    result = _new_result()
+    result["payload"] = payload
+
+    for backend, drv_name, drv_result in _dispatch(
+            backends, notify_backends, _notify, payload):
+        _merge_result(result, backend, drv_name,
+                      drv_result or {"error": TIMED_OUT})
+
+    return result
+
+
+def deliver_many(backends, payloads, notify_backends):
+    """Send several payloads with all drivers of given backends.
+
+    :param backends: iterable of backend names
+    :param payloads: list of valid notification payloads
+    :param notify_backends: backends configuration
+    :returns: list of results (without payloads) in order of payloads
+    """
+    results = [_new_result() for payload in payloads]
+
+    for backend, drv_name, drv_results in _dispatch(
+            backends, notify_backends, _notify_many, payloads):
+        drv_results = drv_results or [{"error": TIMED_OUT}
+                                      for payload in payloads]
+        for result, drv_result in zip(results, drv_results):
+            _merge_result(result, backend, drv_name, drv_result)
+
+    return results
+
+
+def _dispatch(backends, notify_backends, call, *args):
+    """Concurrently run call for each driver of given backends.
+
+    :param call: callable(backend, drv_name, driver_ins, circuit, *args),
+                 where circuit is driver's circuit breaker or None
+    :returns: list of tuples (backend, drv_name, call result), where
+              call result is None if driver has timed out
+    """
+    settings = executor.get_settings()
+    pool = executor.get_executor()
+    deadline = time.time() + settings["request_timeout"]
+
+    calls = []
     for backend in backends:
         for drv_name, drv_conf in notify_backends[backend].items():
+            with tracing.span("get_driver", backend=backend,
+                              driver=drv_name):
+                key, driver_ins = CACHE.get(drv_name, drv_conf)
+            circuit = _get_breaker(key)
+            future = pool.submit(tracing.wrap(call), backend, drv_name,
+                                 driver_ins, circuit, *args)
+            calls.append((backend, drv_name, future, time.time()))
 
-            key = "{}.{}".format(drv_name, make_hash(drv_conf))
-            if key not in CACHE:
-                CACHE[key] = driver.get_driver(drv_name, drv_conf)
-            driver_ins = CACHE[key]
+    results = []
+    for backend, drv_name, future, started_at in calls:
+        timeout = min(started_at + settings["driver_timeout"], deadline)
+        try:
+            value = future.result(max(timeout - time.time(), 0))
+        except futures.TimeoutError:
+            # Call is not cancelled even if it has not started yet, so it
+            # records its outcome and is retried like a running one
+            LOG.error("Backend '{}' driver '{}': timed out".format(
+                backend, drv_name))
+            value = None
+        results.append((backend, drv_name, value))
+    return results
 
-            result["total"] += 1
-            if backend not in result["result"]:
-                result["result"][backend] = {}
 
-            # TODO(maretskiy): run in parallel
+def _notify(backend, drv_name, driver_ins, circuit, payload):
+    """Call driver and convert its outcome into result item.
+
+    :returns: dict with either "status", "error" or "throttled" key
+    """
+    with tracing.span("notify", backend=backend, driver=drv_name) as span:
+        admitted, rejected = _admit(backend, drv_name, circuit, payload)
+        if rejected:
+            result = rejected
+        else:
+            started_at = time.time()
             try:
-                status = driver_ins.notify(payload)
-
-                result["passed"] += status
-                result["failed"] += not status
-                result["result"][backend][drv_name] = {"status": status}
-            except driver.ExplainedError as e:
-                result["result"][backend][drv_name] = {"error": str(e)}
-                result["errors"] += 1
+                status = driver_ins.notify(admitted)
             except Exception as e:
-                LOG.error("Backend '{}' driver '{}': {}: {}".format(
-                    backend, drv_name, type(e), e))
-                error = "Something has went wrong!"
-                result["result"][backend][drv_name] = {"error": error}
-                result["errors"] += 1
+                status = e
+            result = _complete(backend, drv_name, circuit, status,
+                               time.time() - started_at)
+        span.set(**result)
+    _retry_failed(backend, drv_name, admitted or payload, result)
+    return result
 
-    return flask.jsonify(result), 200
+
+def _admit(backend, drv_name, circuit, payload):
+    """Pass payload through rate limiter and circuit breaker.
+
+    :returns: tuple (payload, rejected), where payload may be altered by
+              rate limiter and rejected is result item if driver must not
+              be called at all
+    """
+    limiter = get_limiter()
+    if limiter:
+        payload = limiter.admit(backend, drv_name, payload)
+        if payload is None:
+            metrics.DELIVERIES.inc(backend=backend, driver=drv_name,
+                                   outcome="throttled")
+            return None, {"throttled": True}
+    if circuit and not circuit.allow():
+        metrics.DELIVERIES.inc(backend=backend, driver=drv_name,
+                               outcome="circuit_open")
+        return None, {"error": CIRCUIT_OPEN}
+    return payload, None
+
+
+def _complete(backend, drv_name, circuit, status, duration=None):
+    """Record driver outcome and convert it into result item.
+
+    :param duration: seconds spent in driver call, if it is known
+    """
+    if circuit:
+        circuit.record(_succeeded(status))
+    if duration is not None:
+        metrics.DELIVERY_DURATION.observe(duration, backend=backend,
+                                          driver=drv_name)
+    if isinstance(status, driver.ExplainedError):
+        outcome = "explained_error"
+    elif isinstance(status, Exception):
+        outcome = "error"
+    else:
+        outcome = "passed" if status else "failed"
+    metrics.DELIVERIES.inc(backend=backend, driver=drv_name, outcome=outcome)
+    if isinstance(status, Exception):
+        return _error_result(backend, drv_name, status)
+    if isinstance(status, driver.Status):
+        return status.to_dict()
+    return {"status": status}
+
+
+def _notify_many(backend, drv_name, driver_ins, circuit, payloads):
+    """Call driver for several payloads at once.
+
+    :returns: list of result items in order of payloads
+    """
+    limiter = get_limiter()
+    if limiter:
+        payloads = [limiter.admit(backend, drv_name, payload)
+                    for payload in payloads]
+    admitted = [payload for payload in payloads if payload is not None]
+    if len(admitted) < len(payloads):
+        metrics.DELIVERIES.inc(len(payloads) - len(admitted), backend=backend,
+                               driver=drv_name, outcome="throttled")
+    if admitted and circuit and not circuit.allow():
+        metrics.DELIVERIES.inc(len(admitted), backend=backend,
+                               driver=drv_name, outcome="circuit_open")
+        statuses = None
+    elif admitted:
+        started_at = time.time()
+        try:
+            with tracing.span("notify_many", backend=backend,
+                              driver=drv_name, count=len(admitted)):
+                statuses = iter(driver_ins.notify_many(admitted))
+        except Exception as e:
+            statuses = iter([e] * len(admitted))
+        metrics.DELIVERY_DURATION.observe(time.time() - started_at,
+                                          backend=backend, driver=drv_name)
+    results = []
+    for payload in payloads:
+        if payload is None:
+            result = {"throttled": True}
+        elif statuses is None:
+            result = {"error": CIRCUIT_OPEN}
+        else:
+            result = _complete(backend, drv_name, circuit, next(statuses))
+        _retry_failed(backend, drv_name, payload, result)
+        results.append(result)
+    return results
+
+
+def _retry_failed(backend, drv_name, payload, drv_result):
+    """Store failed delivery for later retry, if retries are configured.
+
+    Throttled deliveries are dropped intentionally and are not retried.
+    """
+    if _is_failed(drv_result):
+        store = get_retry_store()
+        if store:
+            store.add(backend, drv_name, payload, drv_result.get("error"))
+
+
+def _retry_later(backend, drv_name, payload, drv_result):
+    """Store failed delivery for retry in thread pool, without waiting."""
+    if _is_failed(drv_result):
+        executor.get_executor().submit(
+            _log_errors(_retry_failed), backend, drv_name, payload,
+            drv_result)
+
+
+def _log_errors(func):
+    def call(*args):
+        try:
+            return func(*args)
+        except Exception as e:
+            LOG.error("{} has failed: {}: {}".format(func.__name__, type(e),
+                                                     e))
+    return call
+
+
+def _is_failed(drv_result):
+    return "error" in drv_result or drv_result.get("status") is False
+
+
+def _redeliver(backend, drv_name, payload):
+    """Retry failed delivery, handler of retry.RetryStore.
+
+    :returns: bool whether delivery has succeeded
+    :raises: driver error or ExplainedError if delivery is not possible
+    """
+    drv_conf = config.get_config()["notify_backends"].get(
+        backend, {}).get(drv_name)
+    if drv_conf is None:
+        raise driver.ExplainedError("Backend '{}' driver '{}' is not "
+                                    "configured".format(backend, drv_name))
+    key, driver_ins = CACHE.get(drv_name, drv_conf)
+    circuit = _get_breaker(key)
+    admitted, rejected = _admit(backend, drv_name, circuit, payload)
+    if rejected:
+        raise driver.ExplainedError(rejected.get("error", "Throttled"))
+    started_at = time.time()
+    try:
+        status = driver_ins.notify(admitted)
+    except Exception as e:
+        status = e
+    result = _complete(backend, drv_name, circuit, status,
+                       time.time() - started_at)
+    if "error" in result:
+        raise driver.ExplainedError(result["error"])
+    return result["status"]
+
+
+def _succeeded(status):
+    return not isinstance(status, Exception) and bool(status)
+
+
+def _error_result(backend, drv_name, error):
+    if isinstance(error, driver.ExplainedError):
+        return {"error": str(error)}
+    LOG.error("Backend '{}' driver '{}': {}: {}".format(
+        backend, drv_name, type(error), error))
+    return {"error": "Something has went wrong!"}
+
+
+def _new_result():
+    return {"result": {}, "total": 0, "passed": 0, "failed": 0, "errors": 0,
+            "throttled": 0}
+
+
+def _merge_result(result, backend, drv_name, drv_result):
+    """Add driver result item to response and update counters."""
+    result["total"] += 1
+    result["result"].setdefault(backend, {})[drv_name] = drv_result
+    if "error" in drv_result:
+        result["errors"] += 1
+    elif "throttled" in drv_result:
+        result["throttled"] += 1
+    else:
+        status = drv_result["status"]
+        result["passed"] += status
+        result["failed"] += not status
 
 
 def get_blueprints():
@@ -0,0 +1,500 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""ASGI application which serves the same API as notify.main.
+
+Requires Python 3.5+ and any ASGI server, for example:
+
+    uvicorn --workers 1 notify.asgi:app
+
+Deliveries are awaited on the event loop via Driver.notify_async(), so
+in-flight requests only cost a coroutine each, while real concurrency of
+drivers is bounded by their thread pools and connection pools.
+
+Requests are traced only on Python 3.7+, where current span is kept in
+context variable of request's task.
+"""
+
+import asyncio
+import collections
+import functools
+import logging
+import time
+from urllib import parse
+
+from flask_helpers import routing
+from werkzeug import exceptions
+
+from notify.api.v1 import api
+from notify import codec
+from notify import config
+from notify import executor
+from notify import main
+from notify import metrics
+from notify import tracing
+
+
+LOG = logging.getLogger("asgi")
+LOG.setLevel(config.get_config().get("logging", {}).get("level", "INFO"))
+
+
+Request = collections.namedtuple("Request", ["method", "query", "body",
+                                             "prefer"])
+
+HANDLERS = {}
+
+STREAM_HANDLERS = {}
+
+
+def handler(endpoint):
+    """Register coroutine function as handler of Flask endpoint."""
+    def decorator(func):
+        HANDLERS[endpoint] = func
+        return func
+    return decorator
+
+
+def stream_handler(endpoint):
+    """Register coroutine function as streaming handler of Flask endpoint.
+
+    Streaming handler is called with request without body, receive and
+    send callables, and sends response itself.
+    """
+    def decorator(func):
+        STREAM_HANDLERS[endpoint] = func
+        return func
+    return decorator
+
+
+async def app(scope, receive, send):
+    """ASGI application callable."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    started_at = time.time()
+    method = scope["method"]
+    urls = main.app.url_map.bind("localhost")
+    try:
+        rule, args = urls.match(scope["path"], method, return_rule=True)
+    except exceptions.HTTPException as e:
+        await _respond(send, {"error": e.name}, e.code)
+        main.observe_request(None, e.code, started_at)
+        return
+
+    if method == "OPTIONS":
+        allow = ", ".join(sorted(urls.allowed_methods(scope["path"])))
+        await _respond(send, None, 200, [(b"allow", allow.encode())])
+        return
+
+    query = parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    prefer = _get_header(scope, b"prefer")
+    if rule.endpoint in STREAM_HANDLERS:
+        code = await STREAM_HANDLERS[rule.endpoint](
+            Request(method, query, None, prefer), receive, send, **args)
+        main.observe_request(rule.rule, code, started_at)
+        return
+
+    request = Request(method, query, await _read_body(receive), prefer)
+    inline = main.is_trace_requested(query.get("trace", [""])[0])
+    root = tracing.contextvars and tracing.start_trace(
+        "request", request_id=_get_header(scope, b"x-request-id"),
+        sampled=inline or None, method=method, path=scope["path"])
+    try:
+        response = await HANDLERS[rule.endpoint](request, **args)
+    except Exception:
+        LOG.exception("Request {} {} has failed".format(method,
+                                                        scope["path"]))
+        response = {"error": "Internal Server Error"}, 500
+    if method == "HEAD":
+        response = (None,) + tuple(response[1:])
+
+    spans = tracing.finish_trace(root or None, route=rule.rule,
+                                 code=response[1])
+    if root:
+        headers = list(response[2]) if len(response) > 2 else []
+        headers.append((b"x-request-id", root.trace.request_id.encode()))
+        body = response[0]
+        if spans and inline and isinstance(body, dict):
+            body = dict(body, trace=spans)
+        response = (body, response[1], headers)
+    await _respond(send, *response)
+    main.observe_request(rule.rule, response[1], started_at)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _get_header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def _respond(send, body, code, headers=()):
+    """Send response, body is JSON serialized unless it is str."""
+    headers = list(headers)
+    if isinstance(body, str):
+        data = body.encode("utf-8")
+    else:
+        data = b"" if body is None else codec.dumps(body)
+        headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(data)).encode()))
+    await send({"type": "http.response.start", "status": code,
+                "headers": headers})
+    await send({"type": "http.response.body", "body": data})
+
+
+class _LineReader(object):
+    """Read lines of request body as its chunks are received."""
+
+    def __init__(self, receive, max_size):
+        self._receive = receive
+        self._max_size = max_size
+        self._buffer = b""
+        self._more_body = True
+
+    async def readline(self):
+        """Read next line.
+
+        :returns: bytes, b"" at the end of body or None if line is longer
+                  than max_size (it is skipped)
+        """
+        too_long = False
+        while True:
+            end = self._buffer.find(b"\n")
+            if end >= 0:
+                line = self._buffer[:end + 1]
+                self._buffer = self._buffer[end + 1:]
+                return None if too_long or end > self._max_size else line
+            if not self._more_body:
+                line, self._buffer = self._buffer, b""
+                return None if too_long else line
+            if len(self._buffer) > self._max_size:
+                too_long = True
+                self._buffer = b""
+            message = await self._receive()
+            self._buffer += message.get("body", b"")
+            self._more_body = message.get("more_body", False)
+
+
+def _is_set(request, arg):
+    value = request.query.get(arg, [""])[0]
+    return value.lower() in ("1", "true", "yes")
+
+
+def _is_compact(request):
+    return _is_set(request, "compact") or api._is_minimal_preferred(
+        request.prefer)
+
+
+@handler("routing_map.routing_map_json")
+async def get_routing_map(request):
+    return [route for route in routing.get_routing_list(main.app)
+            if not route["endpoint"].startswith("routing_map.")], 200
+
+
+@handler("get_metrics")
+async def get_metrics(request):
+    loop = asyncio.get_event_loop()
+    text = await loop.run_in_executor(executor.get_executor(),
+                                      metrics.get_text, main.get_metrics_dir())
+    return text, 200, [(b"content-type", metrics.CONTENT_TYPE.encode())]
+
+
+@handler("notify.send_notification")
+async def send_notification(request, backends):
+    try:
+        payload = codec.loads(request.body)
+    except ValueError:
+        payload = None
+    notify_backends = config.get_config()["notify_backends"]
+    backends = set(backends.split(","))
+
+    if _is_set(request, "async"):
+        # Job is stored in SQLite queue
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(
+            executor.get_executor(), api._accept, backends, payload,
+            notify_backends, True)
+    else:
+        response = api._accept(backends, payload, notify_backends)
+    if not response:
+        response = await deliver(backends, payload, notify_backends), 200
+    if _is_compact(request):
+        response = api._compact(response[0]), response[1]
+    return response
+
+
+@handler("notify.send_batch_notification")
+async def send_batch_notification(request, backends):
+    notify_backends = config.get_config()["notify_backends"]
+    backends = set(backends.split(","))
+
+    try:
+        data = request.body.decode("utf-8")
+    except ValueError as e:
+        return {"error": "Bad Batch: {}".format(e)}, 400
+    error, items, valid = api._accept_batch(backends, data, notify_backends)
+    if error:
+        return {"error": error}, 400
+
+    delivered = valid and await deliver_many(backends, valid,
+                                             notify_backends)
+    return api._batch_result(items, iter(delivered),
+                             _is_compact(request)), 200
+
+
+@stream_handler("notify.send_stream_notification")
+async def send_stream_notification(request, receive, send, backends):
+    """Asynchronous counterpart of api.send_stream_notification()."""
+    notify_backends = config.get_config()["notify_backends"]
+    backends = set(backends.split(","))
+
+    unexpected = backends - set(notify_backends)
+    if unexpected:
+        mesg = "Unexpected backends: {}".format(", ".join(unexpected))
+        await _respond(send, {"error": mesg}, 400)
+        return 400
+
+    settings = executor.get_settings()
+    reader = _LineReader(receive, settings["max_line_size"])
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type",
+                             api.NDJSON_MIMETYPE.encode())]})
+    pending = collections.deque()
+    summary = api._new_stream_summary()
+    compact = _is_compact(request)
+
+    async def pop():
+        number, item, task = pending.popleft()
+        if task is not None:
+            try:
+                item = await task
+            except Exception:
+                LOG.exception("Delivery of line {} has failed".format(number))
+                item = {"error": "Something has went wrong!"}
+        await send({"type": "http.response.body", "more_body": True,
+                    "body": api._stream_item(summary, number, item,
+                                             compact)})
+
+    while True:
+        line = await reader.readline()
+        if line == b"":
+            break
+        summary["lines"] += 1
+        if line is not None and not line.strip():
+            continue
+        item, payload = api._accept_line(backends, line, notify_backends)
+        task = None
+        if item is None:
+            task = asyncio.ensure_future(
+                deliver(backends, payload, notify_backends))
+        pending.append((summary["lines"], item, task))
+        while pending and (len(pending) >= settings["stream_in_flight"] or
+                           pending[0][2] is None or pending[0][2].done()):
+            await pop()
+
+    while pending:
+        await pop()
+    await send({"type": "http.response.body",
+                "body": api._dump_line(summary)})
+    return 200
+
+
+@handler("notify.get_breakers")
+async def get_breakers(request):
+    return {"breakers": dict((key, circuit.to_dict())
+                             for key, circuit in api.BREAKERS.items())}, 200
+
+
+@handler("notify.get_retries")
+async def get_retries(request):
+    store = api.get_retry_store()
+    if not store:
+        return {"error": "Retries are disabled"}, 404
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(executor.get_executor(), store.stats)
+    result["dead_letters"] = await loop.run_in_executor(
+        executor.get_executor(), store.get_dead_letters)
+    return result, 200
+
+
+@handler("notify.get_job")
+async def get_job(request, job_id):
+    queue = api.get_job_queue()
+    loop = asyncio.get_event_loop()
+    job = queue and await loop.run_in_executor(executor.get_executor(),
+                                               queue.get, job_id)
+    if not job:
+        return {"error": "Job not found"}, 404
+    return job, 200
+
+
+async def deliver(backends, payload, notify_backends):
+    """Send payload with all drivers of given backends.
+
+    Asynchronous counterpart of api.deliver().
+    """
+    result = api._new_result()
+    result["payload"] = payload
+
+    for backend, drv_name, drv_result in await _dispatch(
+            backends, notify_backends, _notify, payload):
+        api._merge_result(result, backend, drv_name,
+                          drv_result or {"error": api.TIMED_OUT})
+
+    return result
+
+
+async def deliver_many(backends, payloads, notify_backends):
+    """Send several payloads with all drivers of given backends.
+
+    Asynchronous counterpart of api.deliver_many().
+    """
+    results = [api._new_result() for payload in payloads]
+
+    for backend, drv_name, drv_results in await _dispatch(
+            backends, notify_backends, _notify_many, payloads):
+        drv_results = drv_results or [{"error": api.TIMED_OUT}
+                                      for payload in payloads]
+        for result, drv_result in zip(results, drv_results):
+            api._merge_result(result, backend, drv_name, drv_result)
+
+    return results
+
+
+async def _dispatch(backends, notify_backends, call, *args):
+    """Concurrently await call for each driver of given backends.
+
+    :param call: callable(backend, drv_name, driver_ins, circuit, *args)
+                 returning awaitable
+    :returns: list of tuples (backend, drv_name, call result), where
+              call result is None if driver has timed out
+    """
+    settings = executor.get_settings()
+    timeout = min(settings["driver_timeout"], settings["request_timeout"])
+    loop = asyncio.get_event_loop()
+
+    calls = []
+    for backend in backends:
+        for drv_name, drv_conf in notify_backends[backend].items():
+            with tracing.span("get_driver", backend=backend,
+                              driver=drv_name):
+                key, driver_ins = api.CACHE.lookup(drv_name, drv_conf)
+                if driver_ins is None:
+                    # Driver is imported and created on cache miss
+                    key, driver_ins = await loop.run_in_executor(
+                        executor.get_executor(), tracing.wrap(api.CACHE.get),
+                        drv_name, drv_conf)
+            circuit = api._get_breaker(key)
+            calls.append((backend, drv_name, call(
+                backend, drv_name, driver_ins, circuit, *args)))
+
+    values = await asyncio.gather(*[
+        _wait(backend, drv_name, awaitable, timeout)
+        for backend, drv_name, awaitable in calls])
+    return [(backend, drv_name, value)
+            for (backend, drv_name, awaitable), value in zip(calls, values)]
+
+
+async def _wait(backend, drv_name, awaitable, timeout):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        LOG.error("Backend '{}' driver '{}': timed out".format(
+            backend, drv_name))
+        return None
+
+
+async def _notify(backend, drv_name, driver_ins, circuit, payload):
+    """Await driver and convert its outcome into result item."""
+    with tracing.span("notify", backend=backend, driver=drv_name) as span:
+        try:
+            if api.get_limiter():
+                # Rate limiter may block while waiting for tokens
+                loop = asyncio.get_event_loop()
+                admitted, rejected = await loop.run_in_executor(
+                    executor.get_executor(), api._admit,
+                    backend, drv_name, circuit, payload)
+            else:
+                admitted, rejected = api._admit(backend, drv_name, circuit,
+                                                payload)
+        except asyncio.CancelledError:
+            # Driver has not been called before timeout
+            api._retry_later(backend, drv_name, payload,
+                             {"error": api.TIMED_OUT})
+            raise
+        if rejected:
+            result = rejected
+        else:
+            started_at = time.time()
+            future = asyncio.ensure_future(driver_ins.notify_async(admitted))
+            try:
+                status = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # wait_for() gives up on driver which has timed out, but the
+                # call goes on, so its outcome is recorded when it is done
+                future.add_done_callback(functools.partial(
+                    _complete_later, backend, drv_name, circuit, admitted,
+                    started_at))
+                raise
+            except Exception as e:
+                status = e
+            result = api._complete(backend, drv_name, circuit, status,
+                                   time.time() - started_at)
+        span.set(**result)
+    if api._is_failed(result):
+        # Failed delivery is stored in SQLite retry store
+        await asyncio.get_event_loop().run_in_executor(
+            executor.get_executor(), api._retry_failed, backend, drv_name,
+            admitted or payload, result)
+    return result
+
+
+def _complete_later(backend, drv_name, circuit, payload, started_at, future):
+    """Record outcome of driver call which has outlived its request."""
+    if future.cancelled():
+        result = {"error": api.TIMED_OUT}
+    else:
+        status = future.exception() or future.result()
+        result = api._complete(backend, drv_name, circuit, status,
+                               time.time() - started_at)
+    api._retry_later(backend, drv_name, payload, result)
+
+
+def _notify_many(backend, drv_name, driver_ins, circuit, payloads):
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(driver_ins.get_async_executor(),
+                                tracing.wrap(api._notify_many), backend,
+                                drv_name, driver_ins, circuit, payloads)
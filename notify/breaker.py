@@ -0,0 +1,87 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of single driver instance.
+
+    Circuit opens after `threshold' consecutive failures, so driver
+    calls are rejected immediately. After `reset_timeout' seconds single
+    probe call is allowed (half-open state): circuit is closed if it
+    succeeds and opened again otherwise. Probe which is not recorded
+    within `reset_timeout' seconds, e.g. cancelled one, counts as failed.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check whether driver may be called now.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.time()
+            if (self.state == HALF_OPEN and
+                    now >= self.probe_at + self.reset_timeout):
+                self.failures += 1
+                self.state = OPEN
+                self.opened_at = self.probe_at + self.reset_timeout
+            if (self.state == OPEN and
+                    now >= self.opened_at + self.reset_timeout):
+                self.state = HALF_OPEN
+                self.probe_at = now
+                return True
+            return False
+
+    def record(self, success):
+        """Record result of driver call.
+
+        :param success: bool whether driver call succeeded
+        """
+        with self._lock:
+            if success:
+                self.state = CLOSED
+                self.failures = 0
+                self.opened_at = None
+                self.probe_at = None
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            result = {"state": self.state, "failures": self.failures}
+            if self.opened_at is not None:
+                result["retry_at"] = self.opened_at + self.reset_timeout
+            return result
@@ -0,0 +1,90 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""JSON codec of API requests and responses.
+
+Uses the fastest available library: orjson, ujson or standard json module.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _json_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _ujson_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    return ujson.loads(data)
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, escape_forward_slashes=False).encode("utf-8")
+
+
+CODECS = {"json": (_json_loads, _json_dumps)}
+if ujson:
+    CODECS["ujson"] = (_ujson_loads, _ujson_dumps)
+if orjson:
+    CODECS["orjson"] = (orjson.loads, orjson.dumps)
+
+NAME = next(name for name in ("orjson", "ujson", "json") if name in CODECS)
+
+_loads, _dumps = CODECS[NAME]
+
+
+def use(name):
+    """Select codec by name.
+
+    :param name: one of CODECS keys
+    :raises: KeyError if library of codec is not installed
+    """
+    global NAME, _loads, _dumps
+    _loads, _dumps = CODECS[name]
+    NAME = name
+
+
+def loads(data):
+    """Deserialize JSON document.
+
+    :param data: bytes (UTF-8) or str
+    :raises: ValueError if data is not valid JSON
+    """
+    return _loads(data)
+
+
+def dumps(obj):
+    """Serialize object to compact JSON.
+
+    :returns: UTF-8 encoded bytes
+    """
+    return _dumps(obj)
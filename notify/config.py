@@ -16,12 +16,19 @@
 import json
 import logging
 import os
+import signal
+import threading
+import time
 
 import jsonschema
 
+from notify import ratelimit
+
 
 CONF = None
 
+RELOAD_HOOKS = []
+
 DEFAULT_CONF = {
     "flask": {
         "HOST": "0.0.0.0",
@@ -78,6 +85,100 @@ CONF_SCHEMA = {
             "properties": {
                 "level": {"type": "string"}
             }
+        },
+        "dispatch": {
+            "type": "object",
+            "properties": {
+                "workers": {"type": "integer", "minimum": 1},
+                "driver_timeout": {"type": "number", "minimum": 0},
+                "request_timeout": {"type": "number", "minimum": 0},
+                "batch_size": {"type": "integer", "minimum": 1},
+                "stream_in_flight": {"type": "integer", "minimum": 1},
+                "max_line_size": {"type": "integer", "minimum": 1}
+            }
+        },
+        "jobs": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string"},
+                "workers": {"type": "integer", "minimum": 1}
+            },
+            "required": ["path"]
+        },
+        "retry": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string"},
+                "max_attempts": {"type": "integer", "minimum": 2},
+                "base_delay": {"type": "number", "minimum": 0},
+                "max_delay": {"type": "number", "minimum": 0},
+                "max_size": {"type": "integer", "minimum": 1},
+                "max_dead_letters": {"type": "integer", "minimum": 1},
+                "flush_interval": {"type": "number", "minimum": 0},
+                "flush_size": {"type": "integer", "minimum": 1},
+                "poll_interval": {"type": "number", "minimum": 0}
+            },
+            "required": ["path"],
+            "additionalProperties": False
+        },
+        "dedup": {
+            "type": "object",
+            "properties": {
+                "window": {"type": "number", "minimum": 0}
+            }
+        },
+        "driver_cache": {
+            "type": "object",
+            "properties": {
+                "max_size": {"type": "integer", "minimum": 1},
+                "ttl": {"type": "number", "minimum": 0},
+                "close_delay": {"type": "number", "minimum": 0}
+            },
+            "additionalProperties": False
+        },
+        "circuit_breaker": {
+            "type": "object",
+            "properties": {
+                "threshold": {"type": "integer", "minimum": 1},
+                "reset_timeout": {"type": "number", "minimum": 0}
+            },
+            "additionalProperties": False
+        },
+        "rate_limits": {
+            "type": "object",
+            "additionalProperties": ratelimit.LIMIT_SCHEMA
+        },
+        "rate_limit_store": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string"}
+            },
+            "required": ["path"],
+            "additionalProperties": False
+        },
+        "metrics": {
+            "type": "object",
+            "properties": {
+                "dir": {"type": "string"},
+                "interval": {"type": "number", "minimum": 0}
+            },
+            "additionalProperties": False
+        },
+        "tracing": {
+            "type": "object",
+            "properties": {
+                "sample_rate": {"type": "number", "minimum": 0,
+                                "maximum": 1},
+                "file": {"type": "string"},
+                "inline": {"type": "boolean"}
+            },
+            "additionalProperties": False
+        },
+        "reload": {
+            "type": "object",
+            "properties": {
+                "interval": {"type": "number", "minimum": 0}
+            }
         }
     },
     "required": ["flask", "notify_backends"]
@@ -102,3 +203,86 @@ def get_config():
             logging.warning("Failed to load config from '%s': %s" % (path, e))
             CONF = DEFAULT_CONF
     return CONF
+
+
+def get_config_path():
+    return os.environ.get("NOTIFY_CONF", "/etc/notify/config.json")
+
+
+def reload_config():
+    """Reload configuration if it is valid.
+
+    New configuration replaces the old one as a whole, so callers which
+    got the old one from get_config() keep working with it. Functions
+    registered in RELOAD_HOOKS are called as hook(old_conf, new_conf).
+
+    :returns: bool whether configuration is reloaded
+    """
+    global CONF
+    path = get_config_path()
+    try:
+        with open(path) as conf_file:
+            cfg = json.load(conf_file)
+        jsonschema.validate(cfg, CONF_SCHEMA)
+    except (IOError, ValueError, jsonschema.exceptions.ValidationError) as e:
+        logging.warning("Keep current config, failed to reload "
+                        "from '%s': %s" % (path, e))
+        return False
+
+    old, CONF = CONF, cfg
+    logging.info("Config is reloaded from '%s'" % path)
+    for hook in RELOAD_HOOKS:
+        try:
+            hook(old, cfg)
+        except Exception as e:
+            logging.error("Config reload hook %s has failed: %s" % (hook, e))
+    return True
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def watch(interval):
+    """Start thread which reloads configuration when its file changes.
+
+    :param interval: seconds between checks of file modification time
+    :rtype: threading.Thread
+    """
+    def run():
+        path = get_config_path()
+        last = _mtime(path)
+        while True:
+            time.sleep(interval)
+            current = _mtime(path)
+            if current != last:
+                last = current
+                reload_config()
+
+    thread = threading.Thread(target=run, name="notify-config-watch")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def handle_sighup():
+    """Reload configuration on SIGHUP.
+
+    Reload is done in separate thread, because signal handler may
+    interrupt code which holds locks required by reload hooks.
+
+    :returns: bool whether signal handler is installed
+    """
+    def handler(signum, frame):
+        threading.Thread(target=reload_config,
+                         name="notify-config-reload").start()
+
+    try:
+        signal.signal(signal.SIGHUP, handler)
+    except (ValueError, AttributeError) as e:
+        logging.warning("Can not handle SIGHUP: %s" % e)
+        return False
+    return True
@@ -0,0 +1,126 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+class Coalescer(object):
+    """Fold repeated alerts into single delivery per time window.
+
+    First alert is delivered immediately and opens a window. Repeats of
+    the same alert within the window are only counted, and when the
+    window is over they are delivered once, as the latest repeat with
+    merged affected_hosts and occurrences counter in description.
+    """
+
+    def __init__(self, window, deliver):
+        """Init coalescer.
+
+        :param window: window length in seconds
+        :param deliver: callable(backends, payload) to deliver folded alerts
+        """
+        self.window = window
+        self.deliver = deliver
+        self._entries = {}
+        self._expired = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def make_key(backends, payload):
+        return (tuple(sorted(backends)), payload["region"], payload["who"],
+                payload["what"], payload["severity"])
+
+    def add(self, backends, payload):
+        """Register alert.
+
+        :param backends: iterable of backend names
+        :param payload: valid notification payload
+        :returns: 0 if alert has to be delivered now, otherwise number of
+                  repeats folded within current window
+        """
+        key = self.make_key(backends, payload)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["until"] > now:
+                entry["count"] += 1
+                # Hosts may be any JSON values, including unhashable ones
+                for host in payload.get("affected_hosts") or []:
+                    if host not in entry["hosts"]:
+                        entry["hosts"].append(host)
+                entry["payload"] = payload
+                return entry["count"]
+            if entry is not None and entry["count"]:
+                # Window is over, but flusher has not handled it yet. It is
+                # left to flusher, so caller is not blocked by delivery
+                self._expired.append(entry)
+            self._entries[key] = {"backends": sorted(backends),
+                                  "until": now + self.window,
+                                  "count": 0, "hosts": [],
+                                  "payload": None}
+        self._start()
+        return 0
+
+    def flush_expired(self):
+        """Deliver folded alerts whose window is over."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items()
+                       if entry["until"] <= now]
+            entries = self._expired + [self._entries.pop(key)
+                                       for key in expired]
+            self._expired = []
+        for entry in entries:
+            self._flush(entry)
+
+    def _flush(self, entry):
+        if not entry or not entry["count"]:
+            return
+        payload = dict(entry["payload"])
+        if entry["hosts"]:
+            try:
+                payload["affected_hosts"] = sorted(entry["hosts"])
+            except TypeError:
+                # Values of different types are kept in order of arrival
+                payload["affected_hosts"] = entry["hosts"]
+        payload["description"] += (
+            "\n\nRepeated {} time(s) within {} seconds".format(
+                entry["count"], self.window))
+        try:
+            self.deliver(entry["backends"], payload)
+        except Exception as e:
+            LOG.error("Failed to deliver folded alert: {}: {}".format(
+                type(e), e))
+
+    def _run(self):
+        while True:
+            time.sleep(min(self.window, 1))
+            self.flush_expired()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run,
+                                                    name="notify-dedup")
+                    self._thread.daemon = True
+                    self._thread.start()
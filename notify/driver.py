@@ -15,12 +15,37 @@
 
 import importlib
 import logging
+import time
 
 import jsonschema
 
+from notify import executor
+from notify import tracing
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    importlib_metadata = None
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+ENTRY_POINT_GROUP = "notify.drivers"
+
+ENTRY_POINTS = None
 
 DRIVERS = {}
 
+VALIDATORS = {}
+
 
 def get_driver(name, conf):
     """Get driver by name.
@@ -32,13 +57,15 @@ def get_driver(name, conf):
     """
     global DRIVERS
     if name not in DRIVERS:
+        started_at = time.time()
         try:
-            module = importlib.import_module("notify.drivers." + name)
-            DRIVERS[name] = module.Driver
+            DRIVERS[name] = load_driver(name)
         except (ImportError, AttributeError):
             mesg = "Unexpected driver: '{}'".format(name)
             logging.error(mesg)
             raise RuntimeError(mesg)
+        logging.info("Driver '{}' is loaded in {:.3f}s".format(
+            name, time.time() - started_at))
 
     driver_cls = DRIVERS[name]
 
@@ -52,10 +79,98 @@ def get_driver(name, conf):
     return driver_cls(conf)
 
 
+def get_entry_points():
+    """Get driver entry points of installed distributions.
+
+    Installed distributions are scanned only once.
+
+    :returns: dict of entry points by driver name
+    """
+    global ENTRY_POINTS
+    if ENTRY_POINTS is None:
+        if importlib_metadata is None:
+            # pkg_resources is slow to import, so only as a fallback
+            import pkg_resources
+            entry_points = pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+        else:
+            entry_points = importlib_metadata.entry_points()
+            if hasattr(entry_points, "select"):
+                entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+            else:
+                entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+        ENTRY_POINTS = dict((ep.name, ep) for ep in entry_points)
+    return ENTRY_POINTS
+
+
+def load_driver(name):
+    """Import driver class.
+
+    Driver is looked up in entry points of group "notify.drivers", so
+    drivers of other distributions can be used, and then in package
+    notify.drivers, so built-in drivers work without installation.
+
+    :param name: driver name
+    :returns: Driver subclass
+    :raises: ImportError, AttributeError
+    """
+    entry_point = get_entry_points().get(name)
+    if entry_point is not None:
+        return entry_point.load()
+    return importlib.import_module("notify.drivers." + name).Driver
+
+
+def get_validator(schema):
+    """Get validator compiled for given schema.
+
+    Schema is checked and validator is built only once per schema object.
+
+    :param schema: JSON schema dict
+    :rtype: jsonschema validator instance
+    """
+    validator = VALIDATORS.get(id(schema))
+    if validator is None or validator.schema is not schema:
+        validator_cls = jsonschema.validators.validator_for(schema)
+        validator_cls.check_schema(schema)
+        validator = VALIDATORS[id(schema)] = validator_cls(schema)
+    return validator
+
+
+def validate(instance, schema):
+    """Validate instance with cached validator.
+
+    :raises: ValueError
+    """
+    error = jsonschema.exceptions.best_match(
+        get_validator(schema).iter_errors(instance))
+    if error is not None:
+        raise ValueError(str(error))
+
+
 class ExplainedError(Exception):
     """Error that should be delivered to end user."""
 
 
+class Status(object):
+    """Notification status with details added to driver result."""
+
+    def __init__(self, status, **details):
+        """Init status.
+
+        :param status: bool whether notification is successful
+        :param details: JSON serializable values
+        """
+        self.status = status
+        self.details = details
+
+    def __bool__(self):
+        return bool(self.status)
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        return dict(self.details, status=bool(self.status))
+
+
 class Driver(object):
     """Base for notification drivers."""
 
@@ -88,10 +203,10 @@ class Driver(object):
         :param payload: notification payload
         :raises: ValueError
         """
-        try:
-            jsonschema.validate(payload, cls.PAYLOAD_SCHEMA)
-        except jsonschema.exceptions.ValidationError as e:
-            raise ValueError(str(e))
+        if (cls.PAYLOAD_SCHEMA is Driver.PAYLOAD_SCHEMA and
+                _is_valid_payload(payload)):
+            return
+        validate(payload, cls.PAYLOAD_SCHEMA)
 
     @classmethod
     def validate_config(cls, conf):
@@ -100,10 +215,7 @@ class Driver(object):
         :param conf: driver configuration
         :raises: ValueError
         """
-        try:
-            jsonschema.validate(conf, cls.CONFIG_SCHEMA)
-        except jsonschema.exceptions.ValidationError as e:
-            raise ValueError(str(e))
+        validate(conf, cls.CONFIG_SCHEMA)
 
     def __init__(self, config):
         self.config = config
@@ -114,7 +226,90 @@ class Driver(object):
         This method must be overriden by specific driver implementation.
 
         :param payload: payload dict, valid for PAYLOAD_SCHEMA
-        :returns: status whether notification is successful
-        :rtype: bool
+        :returns: status whether notification is successful, or Status
+                  with details of partial failure
+        :rtype: bool or Status
         """
         raise NotImplementedError()
+
+    def notify_async(self, payload):
+        """Send notification payload without blocking event loop.
+
+        Must be called from a running event loop. By default notify() is
+        run in thread pool of get_async_executor(), driver may override
+        this with coroutine function which is native to asyncio.
+
+        :param payload: payload dict, valid for PAYLOAD_SCHEMA
+        :returns: awaitable resulting in notification status
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.get_async_executor(),
+                                    tracing.wrap(self.notify), payload)
+
+    def get_async_executor(self):
+        """Get thread pool which runs notify() for notify_async().
+
+        Driver may override this to have pool sized to its connections.
+
+        :rtype: concurrent.futures.Executor
+        """
+        return executor.get_executor()
+
+    def close(self):
+        """Release resources held by driver, like pooled connections.
+
+        Called when driver instance is evicted from cache.
+        """
+
+    def notify_many(self, payloads):
+        """Send several notification payloads.
+
+        Driver may override this if it is able to send payloads in bulk.
+
+        :param payloads: list of payload dicts, valid for PAYLOAD_SCHEMA
+        :returns: list of results in the same order as payloads, where
+                  each item is either notification status (bool) or
+                  exception raised for this payload
+        :rtype: list
+        """
+        results = []
+        for payload in payloads:
+            try:
+                results.append(self.notify(payload))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+_PAYLOAD_STRINGS = frozenset(["region", "description", "who", "what"])
+_PAYLOAD_REQUIRED = Driver.PAYLOAD_SCHEMA["required"]
+_SEVERITIES = frozenset(
+    Driver.PAYLOAD_SCHEMA["properties"]["severity"]["enum"])
+
+
+def _is_valid_payload(payload):
+    """Fast check of payload against Driver.PAYLOAD_SCHEMA.
+
+    This is hand-written equivalent of the schema, jsonschema is used
+    only to explain why payload is invalid.
+
+    :rtype: bool
+    """
+    if not isinstance(payload, dict):
+        return False
+    for key in _PAYLOAD_REQUIRED:
+        if key not in payload:
+            return False
+    for key, value in payload.items():
+        if key in _PAYLOAD_STRINGS:
+            if not isinstance(value, STRING_TYPES):
+                return False
+        elif key == "severity":
+            if not isinstance(value, STRING_TYPES) or value not in _SEVERITIES:
+                return False
+        elif key == "affected_hosts":
+            if not isinstance(value, list):
+                return False
+        else:
+            return False
+    return True
@@ -0,0 +1,78 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import time
+
+from notify import driver
+
+
+class Driver(driver.Driver):
+    """Sleep for a while to simulate latency of real driver.
+
+    Latency in seconds is drawn from given distribution:
+
+    * constant - always *latency*
+    * uniform - from *latency - jitter* to *latency + jitter*
+    * normal - mean *latency*, standard deviation *jitter*
+    * lognormal - median *latency*, *jitter* is sigma of underlying normal
+    * exponential - mean *latency*
+
+    and is limited by *max_latency*.
+    """
+
+    CONFIG_SCHEMA = {
+        "$schema": "http://json-schema.org/draft-04/schema",
+        "type": "object",
+        "properties": {
+            "distribution": {"enum": ["constant", "uniform", "normal",
+                                      "lognormal", "exponential"]},
+            "latency": {"type": "number", "minimum": 0},
+            "jitter": {"type": "number", "minimum": 0},
+            "max_latency": {"type": "number", "minimum": 0},
+            "probability": {"type": "number", "minimum": 0, "maximum": 1}
+        },
+        "additionalProperties": False
+    }
+
+    def __init__(self, config):
+        super(Driver, self).__init__(config)
+        self.distribution = config.get("distribution", "constant")
+        self.latency = config.get("latency", 0.1)
+        self.jitter = config.get("jitter", 0)
+        self.max_latency = config.get("max_latency", 60)
+        self.probability = config.get("probability", 1)
+
+    def get_latency(self):
+        """Draw latency of single call.
+
+        :returns: float seconds
+        """
+        if self.distribution == "uniform":
+            value = random.uniform(self.latency - self.jitter,
+                                   self.latency + self.jitter)
+        elif self.distribution == "normal":
+            value = random.gauss(self.latency, self.jitter)
+        elif self.distribution == "lognormal":
+            value = self.latency * random.lognormvariate(0, self.jitter)
+        elif self.distribution == "exponential":
+            value = self.latency and random.expovariate(1.0 / self.latency)
+        else:
+            value = self.latency
+        return min(max(value, 0), self.max_latency)
+
+    def notify(self, payload):
+        time.sleep(self.get_latency())
+        return random.random() < self.probability
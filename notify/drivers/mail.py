@@ -13,19 +13,370 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from concurrent import futures
 from email.mime import text as mime_text
 import logging
 import smtplib
+import socket
+import threading
+import time
 
 from notify import driver
+from notify import metrics
+from notify import tracing
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.INFO)
+LOG.addFilter(tracing.RequestIdFilter())
+
+
+def sendmail(smtp, sender, recipients, message, pipelining=True):
+    """Send message, pipelining commands if server supports it.
+
+    With PIPELINING (RFC 2920), MAIL, all RCPT and DATA commands are sent
+    at once and their replies are read afterwards, which saves a round
+    trip per recipient. Otherwise smtplib.SMTP.sendmail() is used.
+
+    :param smtp: connected smtplib.SMTP
+    :param message: str, ASCII message
+    :returns: dict of refused recipients, see smtplib.SMTP.sendmail
+    :raises: the same exceptions as smtplib.SMTP.sendmail
+    """
+    smtp.ehlo_or_helo_if_needed()
+    if not (pipelining and smtp.has_extn("pipelining")):
+        return smtp.sendmail(sender, recipients, message)
+
+    commands = ["mail FROM:{}".format(smtplib.quoteaddr(sender))]
+    commands.extend("rcpt TO:{}".format(smtplib.quoteaddr(recipient))
+                    for recipient in recipients)
+    commands.append("data")
+    smtp.send("".join(command + "\r\n" for command in commands))
+    replies = []
+    for command in commands:
+        replies.append(smtp.getreply())
+        if replies[-1][0] == 421:
+            # Server is closing connection, there are no more replies
+            break
+
+    closed = replies[-1][0] == 421
+    mail_reply = replies[0]
+    data_reply = replies[-1] if len(replies) == len(commands) else None
+    refused = {}
+    for recipient, reply in zip(recipients, replies[1:len(commands) - 1]):
+        if reply[0] not in (250, 251):
+            refused[recipient] = reply
+    error = None
+    if mail_reply[0] != 250:
+        error = smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1],
+                                          sender)
+    elif data_reply is None or len(refused) == len(recipients):
+        error = smtplib.SMTPRecipientsRefused(refused)
+    elif data_reply[0] != 354:
+        error = smtplib.SMTPDataError(*data_reply)
+    if error is not None:
+        if not closed and data_reply[0] == 354:
+            # Server waits for data of rejected transaction, abort it
+            smtp.send(".\r\n")
+            smtp.getreply()
+        _reset(smtp, closed)
+        raise error
+
+    data = smtplib.quotedata(message)
+    if not data.endswith("\r\n"):
+        data += "\r\n"
+    smtp.send((data + ".\r\n").encode("ascii"))
+    code, resp = smtp.getreply()
+    if code != 250:
+        _reset(smtp, code == 421)
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+def _reset(smtp, closed):
+    """Reset session after failed transaction, like smtplib does.
+
+    :param closed: whether server has closed connection
+    """
+    if closed:
+        smtp.close()
+        return
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+def _format_refusal(err):
+    """Format reason of refused recipient for driver result.
+
+    :param err: tuple (SMTP code, response) or exception
+    """
+    if isinstance(err, tuple):
+        code, resp = err
+        if isinstance(resp, bytes):
+            resp = resp.decode("utf-8", "replace")
+        return "{} {}".format(code, resp)
+    if isinstance(err, Exception):
+        return "{}: {}".format(type(err).__name__, err)
+    return str(err)
+
+
+class SMTPPool(object):
+    """Pool of long-lived SMTP connections.
+
+    Idle connections are reused in LIFO order. Connection is checked
+    with NOOP if it was idle for a while, closed if it was idle longer
+    than idle_timeout and recycled after max_messages messages.
+    """
+
+    NOOP_INTERVAL = 5
+
+    Connection = collections.namedtuple("Connection",
+                                        ["smtp", "messages", "last_used"])
+
+    def __init__(self, host, port=None, size=4, idle_timeout=60,
+                 max_messages=100, starttls=False, user=None,
+                 password=None, pipelining=True):
+        self.host = host
+        self.port = port
+        self.pipelining = pipelining
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.starttls = starttls
+        self.user = user
+        self.password = password
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        LOG.debug("Connecting to SMTP server {}:{}".format(self.host,
+                                                           self.port))
+        started_at = time.time()
+        with tracing.span("smtp.connect", host=self.host):
+            smtp = smtplib.SMTP(host=self.host, port=self.port)
+            try:
+                if self.starttls:
+                    smtp.starttls()
+                if self.user:
+                    smtp.login(self.user, self.password)
+            except Exception:
+                self._close(smtp)
+                raise
+        metrics.SMTP_CONNECT_DURATION.observe(time.time() - started_at,
+                                              host=self.host)
+        return self.Connection(smtp, 0, time.time())
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            smtp.close()
+
+    def _is_alive(self, conn):
+        try:
+            return conn.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()
+            idle_for = time.time() - conn.last_used
+            if idle_for > self.idle_timeout:
+                self._close(conn.smtp)
+            elif idle_for < self.NOOP_INTERVAL or self._is_alive(conn):
+                return conn
+            else:
+                conn.smtp.close()
+        return self._connect()
+
+    def _release(self, conn):
+        now = time.time()
+        if conn.messages >= self.max_messages:
+            self._close(conn.smtp)
+            return
+        expired = []
+        with self._lock:
+            self._idle.append(conn._replace(last_used=now))
+            while now - self._idle[0].last_used > self.idle_timeout:
+                expired.append(self._idle.popleft())
+        for conn in expired:
+            self._close(conn.smtp)
+
+    def sendmail(self, sender, recipients, message):
+        """Send message using pooled connection.
+
+        Connection dropped by server is transparently reopened once.
+
+        :returns: dict of refused recipients, see smtplib.SMTP.sendmail
+        """
+        result = self.send_many([(sender, recipients, message)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def send_many(self, messages):
+        """Send several messages over single pooled connection.
+
+        Failure of message does not prevent sending of the next ones.
+        Connection is recycled after max_messages messages, and reopened
+        if it is dropped or broken.
+
+        :param messages: list of tuples (sender, recipients, message)
+        :returns: list of results in order of messages, each is either
+                  dict of refused recipients or exception raised for
+                  the message
+        """
+        results = []
+        with self._slots, tracing.span(
+                "smtp.sendmail", messages=len(messages),
+                recipients=sum(len(item[1]) for item in messages)):
+            conn = None
+            for sender, recipients, message in messages:
+                try:
+                    if conn is None:
+                        conn = self._acquire()
+                    elif conn.messages >= self.max_messages:
+                        smtp, conn = conn.smtp, None
+                        self._close(smtp)
+                        conn = self._connect()
+                except Exception as e:
+                    # Server is not available, there is no point to wait
+                    # for connection timeout for each message
+                    results.extend([e] * (len(messages) - len(results)))
+                    break
+                try:
+                    try:
+                        fails = sendmail(conn.smtp, sender, recipients,
+                                         message, self.pipelining)
+                    except smtplib.SMTPServerDisconnected:
+                        LOG.debug("SMTP server has disconnected, "
+                                  "reconnecting")
+                        smtp, conn = conn.smtp, None
+                        smtp.close()
+                        conn = self._connect()
+                        fails = sendmail(conn.smtp, sender, recipients,
+                                         message, self.pipelining)
+                except (smtplib.SMTPRecipientsRefused,
+                        smtplib.SMTPSenderRefused,
+                        smtplib.SMTPDataError) as e:
+                    # Session has been reset, so connection is reusable
+                    results.append(e)
+                except Exception as e:
+                    if conn is not None:
+                        conn.smtp.close()
+                        conn = None
+                    results.append(e)
+                else:
+                    conn = conn._replace(messages=conn.messages + 1)
+                    results.append(fails)
+            if conn is not None:
+                self._release(conn)
+        return results
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.deque()
+        for conn in idle:
+            self._close(conn.smtp)
+
+
+class Digest(object):
+    """Buffer of alerts which are sent together as single message.
+
+    First alert opens a window. Alerts are buffered until the window is
+    over or max_items alerts are buffered, and then all of them are sent
+    at once.
+    """
+
+    def __init__(self, window, max_items, send):
+        """Init digest.
+
+        :param window: window length in seconds
+        :param max_items: max number of buffered alerts
+        :param send: callable(payloads) which sends digest message
+        """
+        self.window = window
+        self.max_items = max_items
+        self.send = send
+        self._items = []
+        self._until = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, payload):
+        """Buffer alert, and send digest if it is full.
+
+        :param payload: valid notification payload
+        """
+        with self._lock:
+            if not self._items:
+                self._until = time.time() + self.window
+            self._items.append(payload)
+            items = None
+            if len(self._items) >= self.max_items:
+                items = self._take()
+        self._start()
+        if items:
+            self._send(items)
+
+    def flush(self, force=False):
+        """Send buffered alerts if window is over.
+
+        :param force: send them even if window is not over yet
+        """
+        with self._lock:
+            if not self._items or not force and self._until > time.time():
+                return
+            items = self._take()
+        self._send(items)
+
+    def close(self):
+        """Stop flusher and send buffered alerts."""
+        self._stopped.set()
+        self.flush(force=True)
+
+    def _take(self):
+        items, self._items = self._items, []
+        return items
+
+    def _send(self, items):
+        try:
+            self.send(items)
+        except Exception as e:
+            LOG.error("Failed to send digest of {} alert(s): {}: {}".format(
+                len(items), type(e), e))
+            metrics.MAIL_DIGEST_ITEMS.inc(len(items), result="failed")
+        else:
+            metrics.MAIL_DIGEST_ITEMS.inc(len(items), result="sent")
+
+    def _run(self):
+        while not self._stopped.wait(min(self.window, 1)):
+            self.flush()
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="notify-mail-digest")
+                    self._thread.daemon = True
+                    self._thread.start()
 
 
 class Driver(driver.Driver):
     """Mail notification driver."""
 
+    SEVERITIES = driver.Driver.PAYLOAD_SCHEMA["properties"]["severity"][
+        "enum"]
+
     CONFIG_SCHEMA = {
         "$schema": "http://json-schema.org/draft-04/schema",
         "type": "object",
@@ -34,7 +385,28 @@ class Driver(driver.Driver):
             "recipients": {"type": "array", "minItems": 1},
             "smtp_host": {"type": "string"},
             "smtp_port": {"type": "integer"},
+            "smtp_starttls": {"type": "boolean"},
+            "smtp_user": {"type": "string"},
+            "smtp_password": {"type": "string"},
+            "smtp_pipelining": {"type": "boolean"},
+            "recipients_chunk_size": {"type": "integer", "minimum": 1},
             "mimetype": {"enum": ["plain", "html"]},
+            "pool_size": {"type": "integer", "minimum": 1},
+            "pool_idle_timeout": {"type": "number", "minimum": 0},
+            "pool_max_messages": {"type": "integer", "minimum": 1},
+            "digest": {
+                "type": "object",
+                "properties": {
+                    "window": {"type": "number", "exclusiveMinimum": True,
+                               "minimum": 0},
+                    "max_items": {"type": "integer", "minimum": 1},
+                    "bypass_severities": {
+                        "type": "array",
+                        "items": {"enum": SEVERITIES}
+                    }
+                },
+                "additionalProperties": False
+            }
         },
         "required": ["sender_domain"],
         "additionalProperties": False
@@ -47,6 +419,48 @@ class Driver(driver.Driver):
         self._smtp_host = self.config.get("smtp_host", "localhost")
         self._smtp_port = self.config.get("smtp_port")
         self._mime = self.config.get("mimetype", "plain")
+        self._pool = SMTPPool(
+            self._smtp_host, self._smtp_port,
+            size=self.config.get("pool_size", 4),
+            idle_timeout=self.config.get("pool_idle_timeout", 60),
+            max_messages=self.config.get("pool_max_messages", 100),
+            starttls=self.config.get("smtp_starttls", False),
+            user=self.config.get("smtp_user"),
+            password=self.config.get("smtp_password"),
+            pipelining=self.config.get("smtp_pipelining", True))
+        # Async deliveries wait for free thread rather than for pooled
+        # connection, so they never hold threads of shared executor
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=self.config.get("pool_size", 4))
+        chunk_size = self.config.get("recipients_chunk_size",
+                                     len(self._recipients))
+        self._chunks = [self._recipients[i:i + chunk_size]
+                        for i in range(0, len(self._recipients), chunk_size)]
+        # Chunks are sent by callers of notify(), which may be threads of
+        # the executor above, so they need threads of their own
+        self._chunk_executor = None
+        if len(self._chunks) > 1:
+            self._chunk_executor = futures.ThreadPoolExecutor(
+                max_workers=self.config.get("pool_size", 4))
+        self._digest = None
+        if "digest" in self.config:
+            digest_conf = self.config["digest"]
+            self._digest = Digest(digest_conf.get("window", 60),
+                                  digest_conf.get("max_items", 100),
+                                  self.send_digest)
+            self._bypass_severities = set(digest_conf.get(
+                "bypass_severities", ["CRITICAL", "DOWN"]))
+
+    def get_async_executor(self):
+        return self._executor
+
+    def close(self):
+        if self._digest:
+            self._digest.close()
+        self._executor.shutdown(wait=False)
+        if self._chunk_executor:
+            self._chunk_executor.shutdown(wait=False)
+        self._pool.close()
 
     def _sanitize_name(self, name):
         sanitized_name = ""
@@ -55,27 +469,140 @@ class Driver(driver.Driver):
                 sanitized_name += c
         return sanitized_name
 
-    def notify(self, payload):
+    def _format_subject(self, payload):
         subject = "{}: {}".format(payload["who"], payload["what"])
         if payload.get("affected_hosts"):
             subject += " ({})".format(",".join(payload["affected_hosts"]))
+        return subject
+
+    def send_digest(self, payloads):
+        """Send alerts as single message, grouped by region and severity.
+
+        Groups are ordered by region and then by severity, most severe
+        first. Alerts of single region are sent from address of region.
+
+        :param payloads: list of valid notification payloads
+        """
+        groups = collections.OrderedDict()
+        for payload in sorted(payloads, key=lambda p: (
+                p["region"], -self.SEVERITIES.index(p["severity"]))):
+            groups.setdefault((payload["region"], payload["severity"]),
+                              []).append(payload)
+
+        sections = []
+        for (region, severity), group in groups.items():
+            lines = ["{} / {} ({})".format(region, severity, len(group))]
+            for payload in group:
+                lines.append("* " + self._format_subject(payload))
+                lines.extend("    " + line for line in
+                             payload["description"].splitlines())
+            sections.append("\n".join(lines))
+
+        counts = collections.Counter(p["severity"] for p in payloads)
+        subject = "Digest of {} alert(s): {}".format(
+            len(payloads), ", ".join(
+                "{} {}".format(counts[severity], severity)
+                for severity in reversed(self.SEVERITIES)
+                if counts[severity]))
+        regions = set(region for region, severity in groups)
+        status = self._deliver([self._make_message(
+            regions.pop() if len(regions) == 1 else "digest",
+            subject, "\n\n".join(sections), "plain")])[0]
+        if isinstance(status, Exception):
+            raise status
+
+    def _is_digested(self, payload):
+        return self._digest and (
+            payload["severity"] not in self._bypass_severities)
+
+    def notify(self, payload):
+        status = self.notify_many([payload])[0]
+        if isinstance(status, Exception):
+            raise status
+        return status
 
-        sender = "{}@{}".format(self._sanitize_name(payload["region"]),
+    def notify_many(self, payloads):
+        """Send payloads over single SMTP session per recipients chunk."""
+        statuses = [None] * len(payloads)
+        messages = []
+        for i, payload in enumerate(payloads):
+            if self._is_digested(payload):
+                self._digest.add(payload)
+                # Alert is not sent yet and is lost if digest fails
+                statuses[i] = driver.Status(True, queued="digest")
+            else:
+                messages.append((i, self._make_message(
+                    payload["region"], self._format_subject(payload),
+                    payload["description"], self._mime)))
+        delivered = self._deliver([message for i, message in messages])
+        for (i, message), status in zip(messages, delivered):
+            statuses[i] = status
+        return statuses
+
+    def _make_message(self, sender_name, subject, body, mime):
+        """Make message to all recipients.
+
+        :param sender_name: local part of sender address, sanitized
+        :param mime: MIME subtype of body, plain or html
+        :returns: tuple (sender, message text)
+        """
+        sender = "{}@{}".format(self._sanitize_name(sender_name),
                                 self._sender_domain)
 
-        msg = mime_text.MIMEText(payload["description"], self._mime)
+        msg = mime_text.MIMEText(body, mime)
         msg["Subject"] = subject
         msg["From"] = sender
         msg["To"] = self._recipients[0]
-        smtp = smtplib.SMTP(host=self._smtp_host, port=self._smtp_port)
-        try:
-            fails = smtp.sendmail(sender, self._recipients, msg.as_string())
-            for recipient, err in fails.items():
-                LOG.error("Fail to notify {} via email: {}", recipient, err)
-            # NOTE(maretskiy): True is returned in case of non-empty `fails',
-            #     because smtp.sendmail returns if there is at least one
-            #     recipient successfully got a messag.
-            #     But in case of total failure it raises some exception.
-        finally:
-            smtp.quit()
-        return True
+        return sender, msg.as_string()
+
+    def _deliver(self, messages):
+        """Send messages to all chunks of recipients.
+
+        Messages to each chunk are sent over single pooled connection,
+        chunks are sent concurrently.
+
+        :param messages: list of tuples (sender, message text)
+        :returns: list of statuses in order of messages, each is True,
+                  Status with refused recipients or exception if message
+                  has been refused for all recipients
+        """
+        if not messages:
+            return []
+        if self._chunk_executor:
+            chunk_results = list(self._chunk_executor.map(
+                lambda chunk: self._pool.send_many(
+                    [(sender, chunk, text) for sender, text in messages]),
+                self._chunks))
+        else:
+            chunk_results = [self._pool.send_many(
+                [(sender, self._chunks[0], text)
+                 for sender, text in messages])]
+
+        statuses = []
+        for results in zip(*chunk_results):
+            refused = {}
+            errors = []
+            for chunk, result in zip(self._chunks, results):
+                if isinstance(result, smtplib.SMTPRecipientsRefused):
+                    errors.append(result)
+                    refused.update(result.recipients)
+                elif isinstance(result, Exception):
+                    errors.append(result)
+                    refused.update((recipient, result)
+                                   for recipient in chunk)
+                else:
+                    refused.update(result)
+            for recipient, err in refused.items():
+                LOG.error("Fail to notify {} via email: {}".format(
+                    recipient, err))
+            if set(self._recipients) <= set(refused):
+                statuses.append(errors[0] if errors else
+                                smtplib.SMTPRecipientsRefused(refused))
+            elif refused:
+                # Message is delivered if at least one recipient got it
+                statuses.append(driver.Status(True, refused=dict(
+                    (recipient, _format_refusal(err))
+                    for recipient, err in refused.items())))
+            else:
+                statuses.append(True)
+        return statuses
@@ -13,20 +13,56 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from concurrent import futures
+import contextlib
+import fcntl
+import hashlib
 import json
 import logging
-from xml.dom import minidom
+import os
+import threading
+import time
 
 import requests
+from requests import adapters
+from requests import utils as requests_utils
 from requests.packages.urllib3 import exceptions as urllib_exc
+from requests.packages.urllib3.util import retry
 
 from notify import driver
+from notify import metrics
+from notify import tracing
 
 requests.packages.urllib3.disable_warnings(urllib_exc.InsecureRequestWarning)
 
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.INFO)
+LOG.addFilter(tracing.RequestIdFilter())
+
+
+def make_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """Create HTTP session with pool of keep-alive connections.
+
+    Idempotent requests are retried with exponential backoff on
+    connection errors and 5xx responses.
+
+    :param pool_size: max number of connections kept per host
+    :param retries: max number of retries
+    :param backoff_factor: backoff factor, see urllib3 Retry
+    :rtype: requests.Session
+    """
+    session = requests.Session()
+    adapter = adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=retry.Retry(total=retries,
+                                backoff_factor=backoff_factor,
+                                status_forcelist=(500, 502, 503, 504),
+                                raise_on_status=False))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 class OAuth2(object):
@@ -37,15 +73,22 @@ class OAuth2(object):
                  username,
                  password,
                  auth_url=None,
-                 organizationId=None):
+                 organizationId=None,
+                 session=None,
+                 timeout=None):
         self.auth_url = auth_url or "https://login.salesforce.com"
         self.client_id = client_id
         self.client_secret = client_secret
         self.username = username
         self.password = password
         self.organization = organizationId
+        self.session = session or requests.Session()
+        self.timeout = timeout
 
     def authenticate_soap(self):
+        # SOAP login is rarely used, so XML parser is imported on demand
+        from xml.dom import minidom
+
         LOG.debug("Making SFDC SOAP auth for {}".format(self.username))
         doc = minidom.Document()
         env = doc.appendChild(doc.createElement("soapenv:Envelope"))
@@ -73,7 +116,8 @@ class OAuth2(object):
                    "SOAPAction": "login",
                    "Content-Type": "text/xml"}
 
-        resp = requests.post(url, envelope, verify=None, headers=headers)
+        resp = self.session.post(url, envelope, verify=None, headers=headers,
+                                 timeout=self.timeout)
 
         LOG.debug(("SFDC OAuth2 SOAP Response "
                    "({}): {}").format(resp.status_code, resp.text))
@@ -94,7 +138,8 @@ class OAuth2(object):
                 "password": self.password}
         url = "{}/services/oauth2/token".format(self.auth_url)
 
-        resp = requests.post(url, data=data, verify=None)
+        resp = self.session.post(url, data=data, verify=None,
+                                 timeout=self.timeout)
 
         LOG.debug(("SFDC OAuth2 REST Response "
                    "({}): {}").format(resp.status_code, resp.text))
@@ -107,27 +152,221 @@ class OAuth2(object):
         return self.authenticate_rest()
 
 
+class TokenCache(object):
+    """Access token cache shared by processes via file.
+
+    Cache file is protected by lock file, so only one process at a time
+    performs authentication while others wait for its result.
+    """
+
+    def __init__(self, directory, key, ttl=3600):
+        """Init cache.
+
+        :param directory: directory for cache files
+        :param key: str which identifies SFDC credentials
+        :param ttl: seconds to consider cached token valid
+        """
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Other process may have created it meanwhile
+                if not os.path.isdir(directory):
+                    raise
+        name = "sfdc-{}".format(hashlib.md5(key.encode("utf-8")).hexdigest())
+        self.path = os.path.join(directory, name + ".json")
+        self.lock_path = os.path.join(directory, name + ".lock")
+        self.ttl = ttl
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self):
+        """Get cached token.
+
+        :returns: dict with access_token and instance_url or None if
+                  there is no token or it has expired
+        """
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get("expires_at", 0) < time.time():
+            return None
+        return data
+
+    def set(self, auth):
+        """Store token.
+
+        :param auth: dict with access_token and instance_url
+        """
+        data = {"access_token": auth["access_token"],
+                "instance_url": auth["instance_url"],
+                "expires_at": time.time() + self.ttl}
+        tmp_path = "{}.{}".format(self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(data, cache_file)
+        os.rename(tmp_path, self.path)
+
+
+class CaseCache(object):
+    """LRU cache of Case ids and their last known Status and Subject.
+
+    Entries expire `ttl' seconds after they are stored, which bounds
+    staleness of Status reported in feed items. Cache can be persisted
+    to file, so it is warm after restart.
+    """
+
+    SAVE_INTERVAL = 30
+
+    Entry = collections.namedtuple(
+        "Entry", ["case_id", "status", "subject", "expires_at"])
+
+    def __init__(self, max_size=10000, ttl=600, path=None):
+        """Init cache.
+
+        :param max_size: max number of cached Cases
+        :param ttl: seconds to consider cached Case valid
+        :param path: file to load cache from and save it to, or None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._saved_at = time.time()
+        self._dirty = False
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, payload_id):
+        """Get cached Case.
+
+        :returns: tuple (case id, status, subject) or None
+        """
+        with self._lock:
+            entry = self._entries.pop(payload_id, None)
+            if entry is None or entry.expires_at < time.time():
+                metrics.SFDC_CASE_CACHE.inc(result="miss")
+                return None
+            self._entries[payload_id] = entry
+        metrics.SFDC_CASE_CACHE.inc(result="hit")
+        return entry[:3]
+
+    def set(self, payload_id, case_id, status, subject):
+        with self._lock:
+            self._entries.pop(payload_id, None)
+            self._entries[payload_id] = self.Entry(
+                case_id, status, subject, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        if self.path and time.time() - self._saved_at > self.SAVE_INTERVAL:
+            self.save()
+
+    def invalidate(self, payload_id):
+        """Drop Case which is not found anymore."""
+        metrics.SFDC_CASE_CACHE.inc(result="stale")
+        with self._lock:
+            self._entries.pop(payload_id, None)
+            self._dirty = True
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, OSError, ValueError) as e:
+            LOG.info("SFDC Case cache is not loaded: {}".format(e))
+            return
+        now = time.time()
+        with self._lock:
+            for item in data.get("entries", [])[-self.max_size:]:
+                entry = self.Entry(*item[1:])
+                if entry.expires_at >= now:
+                    self._entries[item[0]] = entry
+
+    def save(self):
+        """Write cache to file unless it is unchanged."""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = [[key] + list(entry)
+                       for key, entry in self._entries.items()]
+            self._dirty = False
+            self._saved_at = time.time()
+        tmp_path = "{}.{}".format(self.path, os.getpid())
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump({"entries": entries}, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            LOG.error("Failed to save SFDC Case cache: {}".format(e))
+
+
 class Client(object):
 
-    def __init__(self, oauth2, base_path="/services/data/v36.0"):
+    def __init__(self, oauth2, base_path="/services/data/v36.0",
+                 session=None, timeout=None, token_cache=None):
         self.oauth2 = oauth2
         self.base_path = base_path
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.token_cache = token_cache
 
         self.path = "{}/sobjects".format(base_path)
         self.access_token = None
         self.instance_url = None
-
-    def authenticate(self):
-        result = self.oauth2.authenticate()
-        self.access_token = result["access_token"]
-        self.instance_url = result["instance_url"]
+        self._auth_lock = threading.Lock()
+
+    def authenticate(self, stale_token=None):
+        """Obtain new access token unless it is already refreshed.
+
+        Concurrent calls with the same stale token result in a single
+        authentication, both within process and (if token cache is used)
+        across processes.
+
+        :param stale_token: token which has been rejected by SFDC
+        """
+        with self._auth_lock:
+            if self.access_token != stale_token:
+                return
+            reason = "expired" if stale_token else "initial"
+            if self.token_cache:
+                with self.token_cache.lock():
+                    result = self.token_cache.get()
+                    if not result or result["access_token"] == stale_token:
+                        metrics.SFDC_AUTH.inc(reason=reason)
+                        with tracing.span("sfdc.authenticate",
+                                          reason=reason):
+                            result = self.oauth2.authenticate()
+                        self.token_cache.set(result)
+            else:
+                metrics.SFDC_AUTH.inc(reason=reason)
+                with tracing.span("sfdc.authenticate", reason=reason):
+                    result = self.oauth2.authenticate()
+            self.access_token = result["access_token"]
+            self.instance_url = result["instance_url"]
 
     def _request(self, method, url, headers=None, repeat=True, **kwargs):
         if not self.access_token:
             self.authenticate()
 
+        token = self.access_token
         headers = headers or {}
-        headers["Authorization"] = "Bearer {}".format(self.access_token)
+        headers["Authorization"] = "Bearer {}".format(token)
         if method in ("POST", "PUT", "PATCH"):
             headers["Content-Type"] = "application/json"
 
@@ -136,8 +375,12 @@ class Client(object):
         LOG.debug("SFDC {} Request: {} {} {}".format(method, url, headers,
                                                      kwargs))
         try:
-            resp = requests.request(
-                method, request_url, headers=headers, verify=None, **kwargs)
+            with tracing.span("sfdc.request", method=method,
+                              path=url) as span:
+                resp = self.session.request(
+                    method, request_url, headers=headers, verify=None,
+                    timeout=self.timeout, **kwargs)
+                span.set(status=resp.status_code)
         except Exception as e:
             LOG.error("SFDC Request has failed: {}: {}".format(type(e), e))
             return None, None, None
@@ -162,12 +405,16 @@ class Client(object):
 
         if repeat and sfdc_error and sfdc_error[0] == "INVALID_SESSION_ID":
             LOG.debug("SFDC token has expired, authenticating...")
-            self.authenticate()
+            self.authenticate(stale_token=token)
             return self._request(method, url, headers=headers, repeat=False,
                                  **kwargs)
 
         return resp.status_code, data, sfdc_error
 
+    def close(self):
+        """Close pooled HTTP connections."""
+        self.session.close()
+
     def create_feeditem(self, data):
         url = "{}/FeedItem".format(self.path)
         return self._request("POST", url, data=json.dumps(data))
@@ -183,6 +430,17 @@ class Client(object):
     def get_case(self, id_):
         return self._request("GET", "{}/Case/{}".format(self.path, id_))
 
+    def composite_graph(self, graphs):
+        """Send graphs of dependent subrequests in one request.
+
+        Each graph is processed as a transaction, see Composite Graph
+        API (requires API version 50.0 or later).
+
+        :param graphs: list of dicts with graphId and compositeRequest
+        """
+        url = "{}/composite/graph".format(self.base_path)
+        return self._request("POST", url, data=json.dumps({"graphs": graphs}))
+
 
 class Driver(driver.Driver):
     """SalesForce notification driver."""
@@ -197,6 +455,19 @@ class Driver(driver.Driver):
             "client_secret": {"type": "string"},
             "auth_url": {"type": "string"},
             "organization_id": {"type": "string"},
+            "pool_size": {"type": "integer", "minimum": 1},
+            "connect_timeout": {"type": "number", "minimum": 0},
+            "read_timeout": {"type": "number", "minimum": 0},
+            "retries": {"type": "integer", "minimum": 0},
+            "token_cache_dir": {"type": "string"},
+            "token_ttl": {"type": "number", "minimum": 0},
+            "api_version": {"type": "string", "pattern": "^[0-9]+\\.0$"},
+            "composite": {"type": "boolean"},
+            "composite_batch_size": {"type": "integer", "minimum": 1,
+                                     "maximum": 250},
+            "case_cache_size": {"type": "integer", "minimum": 0},
+            "case_cache_ttl": {"type": "number", "minimum": 0},
+            "case_cache_file": {"type": "string"},
         },
         "required": ["username", "password", "client_id", "client_secret"],
         "additionalProperties": False
@@ -212,15 +483,61 @@ class Driver(driver.Driver):
 
     def __init__(self, config):
         super(Driver, self).__init__(config)
+        session = make_session(pool_size=config.get("pool_size", 10),
+                               retries=config.get("retries", 3))
+        timeout = (config.get("connect_timeout", 10),
+                   config.get("read_timeout", 30))
         oauth2 = OAuth2(username=config["username"],
                         password=config["password"],
                         client_id=config["client_id"],
                         client_secret=config["client_secret"],
                         auth_url=config.get("auth_url"),
-                        organizationId=config.get("organization_id"))
-        self.client = Client(oauth2)
-
-    def notify(self, payload):
+                        organizationId=config.get("organization_id"),
+                        session=session,
+                        timeout=timeout)
+        if config.get("token_cache_dir"):
+            key = "|".join([oauth2.auth_url, config["username"],
+                            config["client_id"],
+                            config.get("organization_id", "")])
+            token_cache = TokenCache(config["token_cache_dir"], key,
+                                     ttl=config.get("token_ttl", 3600))
+        else:
+            token_cache = None
+        # Composite mode upserts Case, so it never looks up Case id
+        if config.get("case_cache_size") and not config.get("composite"):
+            self.case_cache = CaseCache(
+                max_size=config["case_cache_size"],
+                ttl=config.get("case_cache_ttl", 600),
+                path=config.get("case_cache_file"))
+        else:
+            self.case_cache = None
+        self.composite = config.get("composite", False)
+        self.composite_batch_size = config.get("composite_batch_size", 25)
+        api_version = config.get("api_version",
+                                 "50.0" if self.composite else "36.0")
+        self.client = Client(oauth2,
+                             base_path="/services/data/v" + api_version,
+                             session=session, timeout=timeout,
+                             token_cache=token_cache)
+        # Sized to HTTP connection pool, so that async deliveries do not
+        # hold threads of shared executor while waiting for connection
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=config.get("pool_size", 10))
+
+    def get_async_executor(self):
+        return self._executor
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.client.close()
+        if self.case_cache is not None and self.case_cache.path:
+            self.case_cache.save()
+
+    def _make_case(self, payload):
+        """Make Case and FeedItem body of payload.
+
+        :returns: tuple (payload id, case dict, feed item dict)
+        """
         region = payload["region"]
         priority = self.SEVERITY[payload["severity"]]
         payload_id = "|".join([region, payload["what"], payload["who"]])
@@ -243,7 +560,41 @@ class Driver(driver.Driver):
                 "Cloud_ID": region,
                 "Alert_Priority": priority,
                 "Status": "New"}
+        return payload_id, case, item
+
+    def notify(self, payload):
+        if self.composite:
+            return self._notify_composite([payload])[0]
+
+        payload_id, case, item = self._make_case(payload)
+        cached = (self.case_cache is not None and
+                  self.case_cache.get(payload_id))
+        if cached:
+            case_id, item["Status"], subject = cached
+            code, resp, error = self.client.update_case(
+                case_id, data=dict(case, Subject=subject))
+            if code == 404:
+                LOG.info("SFDC: Cached Case {} is not found".format(case_id))
+                self.case_cache.invalidate(payload_id)
+                item["Status"] = "New"
+                cached = None
+            elif code not in (200, 201, 202, 204):
+                return False
+        if not cached:
+            case_id = self._create_case(payload_id, case, item)
+            if not case_id:
+                return False
 
+        body = json.dumps(item, sort_keys=True, indent=2)
+        code, resp, error = self.client.create_feeditem(
+            {"ParentId": case_id, "Visibility": "AllUsers", "Body": body})
+        return code in (200, 201)
+
+    def _create_case(self, payload_id, case, item):
+        """Create Case or update existing one with the same Alert_ID__c.
+
+        :returns: Case id or None if it has failed
+        """
         code, resp, sfdc_error = self.client.create_case(case)
 
         if resp and code in (200, 201):
@@ -257,18 +608,68 @@ class Driver(driver.Driver):
 
             code, resp, error = self.client.get_case(case_id)
             if code not in (200, 201, 202, 204):
-                return False
+                return None
             item["Status"] = resp["Status"]
             case["Subject"] = resp["Subject"]
 
             code, resp, error = self.client.update_case(case_id, data=case)
             if code not in (200, 201, 202, 204):
-                return False
+                return None
         else:
             LOG.error("SFDC ({}) Unexpected Case: {}".format(code, resp))
-            return False
-
-        body = json.dumps(item, sort_keys=True, indent=2)
-        code, resp, error = self.client.create_feeditem(
-            {"ParentId": case_id, "Visibility": "AllUsers", "Body": body})
-        return code in (200, 201)
+            return None
+
+        if self.case_cache is not None:
+            self.case_cache.set(payload_id, case_id, item["Status"],
+                                case["Subject"])
+        return case_id
+
+    def notify_many(self, payloads):
+        if not self.composite:
+            return super(Driver, self).notify_many(payloads)
+        return self._notify_composite(payloads)
+
+    def _make_graph(self, graph_id, payload):
+        """Make graph which upserts Case and creates its FeedItem.
+
+        Unlike notify() without composite mode, Subject of existing Case
+        is updated and FeedItem body has no Status of Case.
+        """
+        payload_id, case, item = self._make_case(payload)
+        del case["Alert_ID__c"]
+        del item["Status"]
+        case_url = "{}/Case/Alert_ID__c/{}".format(
+            self.client.path, requests_utils.quote(payload_id, safe=""))
+        return {"graphId": graph_id, "compositeRequest": [
+            {"method": "PATCH", "url": case_url, "referenceId": "case",
+             "body": case},
+            {"method": "POST", "referenceId": "item",
+             "url": "{}/FeedItem".format(self.client.path),
+             "body": {"ParentId": "@{case.id}", "Visibility": "AllUsers",
+                      "Body": json.dumps(item, sort_keys=True, indent=2)}}]}
+
+    def _notify_composite(self, payloads):
+        """Deliver payloads with one Composite Graph request per batch.
+
+        :returns: list of statuses in order of payloads
+        """
+        statuses = []
+        size = self.composite_batch_size
+        for start in range(0, len(payloads), size):
+            graphs = [self._make_graph(str(i), payload) for i, payload
+                      in enumerate(payloads[start:start + size])]
+            code, resp, error = self.client.composite_graph(graphs)
+            if code != 200 or not isinstance(resp, dict):
+                LOG.error("SFDC ({}) Unexpected composite response: "
+                          "{}".format(code, resp))
+                statuses.extend([False] * len(graphs))
+                continue
+            results = dict((graph.get("graphId"), graph)
+                           for graph in resp.get("graphs", []))
+            for graph in graphs:
+                result = results.get(graph["graphId"], {})
+                if not result.get("isSuccessful"):
+                    LOG.error("SFDC Composite graph has failed: {}".format(
+                        result.get("graphResponse")))
+                statuses.append(bool(result.get("isSuccessful")))
+        return statuses
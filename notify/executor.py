@@ -0,0 +1,84 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import threading
+
+from notify import config
+
+
+DEFAULT_WORKERS = 16
+DEFAULT_DRIVER_TIMEOUT = 30
+DEFAULT_REQUEST_TIMEOUT = 60
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_STREAM_IN_FLIGHT = 32
+DEFAULT_MAX_LINE_SIZE = 1024 * 1024
+
+EXECUTOR = None
+STREAM_EXECUTOR = None
+_LOCK = threading.Lock()
+
+
+def get_settings():
+    """Get dispatching settings with defaults applied.
+
+    :returns: dict with keys workers, driver_timeout, request_timeout,
+              batch_size, stream_in_flight and max_line_size
+    """
+    conf = config.get_config().get("dispatch", {})
+    return {"workers": conf.get("workers", DEFAULT_WORKERS),
+            "driver_timeout": conf.get("driver_timeout",
+                                       DEFAULT_DRIVER_TIMEOUT),
+            "request_timeout": conf.get("request_timeout",
+                                        DEFAULT_REQUEST_TIMEOUT),
+            "batch_size": conf.get("batch_size", DEFAULT_BATCH_SIZE),
+            "stream_in_flight": conf.get("stream_in_flight",
+                                         DEFAULT_STREAM_IN_FLIGHT),
+            "max_line_size": conf.get("max_line_size",
+                                      DEFAULT_MAX_LINE_SIZE)}
+
+
+def get_executor():
+    """Get process-wide bounded thread pool.
+
+    Pool is created lazily, so each gunicorn worker gets its own one
+    after fork.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global EXECUTOR
+    if EXECUTOR is None:
+        with _LOCK:
+            if EXECUTOR is None:
+                EXECUTOR = futures.ThreadPoolExecutor(
+                    max_workers=get_settings()["workers"])
+    return EXECUTOR
+
+
+def get_stream_executor():
+    """Get process-wide thread pool which delivers streamed payloads.
+
+    Deliveries wait for driver calls in the pool of get_executor(), so
+    they must not run in that pool themselves.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global STREAM_EXECUTOR
+    if STREAM_EXECUTOR is None:
+        with _LOCK:
+            if STREAM_EXECUTOR is None:
+                STREAM_EXECUTOR = futures.ThreadPoolExecutor(
+                    max_workers=get_settings()["workers"])
+    return STREAM_EXECUTOR
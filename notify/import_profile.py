@@ -0,0 +1,163 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Report import cost of notification drivers.
+
+Each driver is imported in a fresh interpreter, so it is charged for all
+modules it pulls in, like in a cold service worker. The last row is the
+cost of all reported drivers imported together.
+
+    $ NOTIFY_CONF=config.json notify-import-profile
+    $ notify-import-profile --all --budget 0.5
+"""
+
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+from notify import driver
+
+
+# Runs in child interpreter, prints JSON result of loading drivers
+CHILD_SCRIPT = """
+import json, sys, time
+from notify import driver
+timer = getattr(time, "perf_counter", time.time)
+modules = set(sys.modules)
+started_at = timer()
+try:
+    for name in sys.argv[1:]:
+        driver.load_driver(name)
+except Exception as e:
+    result = {"error": "{}: {}".format(type(e).__name__, e)}
+else:
+    result = {"seconds": timer() - started_at,
+              "modules": len(set(sys.modules) - modules)}
+print(json.dumps(result))
+"""
+
+
+def get_configured_drivers():
+    """Get names of drivers of all configured backends."""
+    from notify import config
+
+    return sorted(set(name for drivers in
+                      config.get_config()["notify_backends"].values()
+                      for name in drivers))
+
+
+def get_all_drivers():
+    """Get names of installed and built-in drivers."""
+    from notify import drivers
+
+    names = set(driver.get_entry_points())
+    names.update(name for _, name, is_pkg in
+                 pkgutil.iter_modules(drivers.__path__) if not is_pkg)
+    return sorted(names)
+
+
+def get_source(name):
+    """Get where driver is loaded from: entry point or built-in module."""
+    entry_point = driver.get_entry_points().get(name)
+    if entry_point is not None:
+        return getattr(entry_point, "value", None) or str(entry_point)
+    return "notify.drivers." + name
+
+
+def profile(names):
+    """Import drivers in child interpreter.
+
+    :param names: list of driver names
+    :returns: dict with keys seconds and modules, or error
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(driver.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    proc = subprocess.Popen([sys.executable, "-c", CHILD_SCRIPT] + names,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env)
+    out, err = proc.communicate()
+    if proc.returncode:
+        lines = err.decode("utf-8", "replace").strip().splitlines()
+        return {"error": lines[-1] if lines else
+                "exit code {}".format(proc.returncode)}
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report import cost of notification drivers.")
+    parser.add_argument("drivers", nargs="*",
+                        help="driver names, configured drivers by default")
+    parser.add_argument("--all", action="store_true",
+                        help="report all installed and built-in drivers")
+    parser.add_argument("--budget", type=float,
+                        help="max import time of single driver in seconds, "
+                             "exit code is 1 if it is exceeded")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.drivers:
+        names = sorted(set(args.drivers))
+    elif args.all:
+        names = get_all_drivers()
+    else:
+        names = get_configured_drivers()
+
+    results = []
+    for name in names:
+        result = profile([name])
+        result.update(driver=name, source=get_source(name))
+        results.append(result)
+    results.sort(key=lambda r: r.get("seconds", float("inf")), reverse=True)
+    if len(names) > 1:
+        total = profile(names)
+        total.update(driver="total", source="")
+        results.append(total)
+
+    over_budget = [r for r in results[:len(names)] if "error" in r or (
+        args.budget is not None and r["seconds"] > args.budget)]
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("{:<24} {:>9} {:>8}  {}".format("DRIVER", "SECONDS",
+                                              "MODULES", "SOURCE"))
+        for r in results:
+            if "error" in r:
+                print("{:<24} {:>9} {:>8}  {}".format(
+                    r["driver"], "-", "-", r["error"]))
+            else:
+                print("{:<24} {:>9.3f} {:>8}  {}".format(
+                    r["driver"], r["seconds"], r["modules"], r["source"]))
+
+    for r in over_budget:
+        sys.stderr.write("Driver '{}' {}\n".format(
+            r["driver"], "has failed to load: {}".format(r["error"])
+            if "error" in r else "is over budget: {:.3f}s > {}s".format(
+                r["seconds"], args.budget)))
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
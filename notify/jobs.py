@@ -0,0 +1,192 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+class JobQueue(object):
+    """Durable queue of notification jobs backed by SQLite.
+
+    The database file can be shared by several processes (for example
+    gunicorn workers): each job is claimed by exactly one worker thread.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            backends TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+    """
+
+    def __init__(self, path, handler, workers=2, poll_interval=1.0,
+                 stale_after=600, retention=86400):
+        """Init queue.
+
+        :param path: SQLite database file path
+        :param handler: callable(backends, payload) returning job result
+        :param workers: number of worker threads in this process
+        :param poll_interval: seconds between checks of empty queue
+        :param stale_after: seconds after which running job is considered
+                            lost (its worker has died) and is requeued
+        :param retention: seconds to keep finished jobs
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.retention = retention
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return contextlib.closing(conn)
+
+    def put(self, backends, payload):
+        """Put new job into queue.
+
+        :param backends: list of backend names
+        :param payload: valid notification payload
+        :returns: str job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, backends, payload, "
+                "created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(backends), json.dumps(payload), now, now))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Get job by id.
+
+        :returns: dict with job id, status and result (if job is done)
+                  or None if there is no such job
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, result FROM jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+        if not row:
+            return None
+        job = {"id": job_id, "status": row[0]}
+        if row[1] is not None:
+            job["result"] = json.loads(row[1])
+        return job
+
+    def claim(self):
+        """Take the oldest queued job and mark it as running.
+
+        :returns: tuple (job_id, backends, payload) or None if queue is empty
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued' "
+                    "WHERE status = 'running' AND updated_at < ?",
+                    (now - self.stale_after,))
+                row = conn.execute(
+                    "SELECT id, backends, payload FROM jobs "
+                    "WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE jobs SET status = 'running', "
+                                 "updated_at = ? WHERE id = ?", (now, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def complete(self, job_id, result):
+        """Store job result and remove expired jobs."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', result = ?, "
+                         "updated_at = ? WHERE id = ?",
+                         (json.dumps(result), now, job_id))
+            conn.execute("DELETE FROM jobs WHERE status = 'done' "
+                         "AND updated_at < ?", (now - self.retention,))
+
+    def process_one(self):
+        """Process single job if there is any.
+
+        :returns: bool whether a job was processed
+        """
+        job = self.claim()
+        if not job:
+            return False
+        job_id, backends, payload = job
+        try:
+            result = self.handler(backends, payload)
+        except Exception as e:
+            LOG.error("Job {} has failed: {}: {}".format(job_id, type(e), e))
+            result = {"error": "Something has went wrong!"}
+        self.complete(job_id, result)
+        return True
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                if self.process_one():
+                    continue
+            except Exception as e:
+                LOG.error("Job queue error: {}: {}".format(type(e), e))
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start worker threads which drain the queue."""
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work,
+                                      name="notify-jobs-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop worker threads and wait for them to finish current jobs."""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped.clear()
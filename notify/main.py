@@ -13,11 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 import flask
 from flask_helpers import routing
 
 from notify.api.v1 import api
+from notify import codec
 from notify import config
+from notify import metrics
+from notify import tracing
 
 
 app = flask.Flask(__name__, static_folder=None)
@@ -29,12 +34,82 @@ def not_found(error):
     return flask.jsonify({"error": "Not Found"}), 404
 
 
+@app.before_request
+def start_timer():
+    flask.g.started_at = time.time()
+    flask.g.trace_inline = is_trace_requested(flask.request.args.get("trace"))
+    flask.g.trace = tracing.start_trace(
+        "request", request_id=flask.request.headers.get("X-Request-Id"),
+        sampled=flask.g.trace_inline or None,
+        method=flask.request.method, path=flask.request.path)
+
+
+@app.after_request
+def observe_response(response):
+    rule = flask.request.url_rule
+    observe_request(rule and rule.rule, response.status_code,
+                    flask.g.started_at)
+
+    root = flask.g.trace
+    spans = tracing.finish_trace(root, route=rule and rule.rule,
+                                 code=response.status_code)
+    response.headers["X-Request-Id"] = root.trace.request_id
+    is_json = response.mimetype == "application/json"
+    if spans and flask.g.trace_inline and is_json:
+        body = codec.loads(response.get_data())
+        if isinstance(body, dict):
+            body["trace"] = spans
+            response.set_data(codec.dumps(body))
+    return response
+
+
+def is_trace_requested(value):
+    """Check trace query argument, if inline traces are enabled."""
+    return (value or "").lower() in ("1", "true", "yes") and (
+        tracing.get_settings()["inline"])
+
+
+def observe_request(route, code, started_at):
+    """Count API request and its latency.
+
+    :param route: URL rule or None if request has not matched any
+    """
+    route = route or "unmatched"
+    metrics.REQUESTS.inc(route=route, code=code)
+    metrics.REQUEST_DURATION.observe(time.time() - started_at, route=route)
+
+
+def get_metrics_dir():
+    return config.get_config().get("metrics", {}).get("dir")
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return flask.Response(metrics.get_text(get_metrics_dir()),
+                          content_type=metrics.CONTENT_TYPE)
+
+
 for url_prefix, blueprint in api.get_blueprints():
     app.register_blueprint(blueprint, url_prefix="/api/v1%s" % url_prefix)
 
 
 app = routing.add_routing_map(app, html_uri=None, json_uri="/")
 
+api.warm_up()
+
+if get_metrics_dir():
+    metrics.start(get_metrics_dir(),
+                  config.get_config()["metrics"].get("interval", 5))
+
+config.handle_sighup()
+reload_interval = config.get_config().get("reload", {}).get("interval")
+if reload_interval:
+    config.watch(reload_interval)
+
+# Start draining jobs and retries which were queued before (re)start
+api.get_job_queue()
+api.get_retry_store()
+
 
 def main():
     app.run(host=app.config.get("HOST", "0.0.0.0"),
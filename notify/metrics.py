@@ -0,0 +1,272 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Counters and histograms exposed in Prometheus text format.
+
+Each process keeps its own values in memory. When multiprocess directory
+is configured, every process periodically dumps its values into its own
+file there, and metrics are rendered as a sum over all files, so any
+gunicorn worker serves values of the whole service.
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+METRICS = []
+
+
+class Metric(object):
+    """Base of metrics, registers them in METRICS."""
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """Monotonic counter with labels."""
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        """Get current values.
+
+        :returns: dict {labels tuple: value}
+        """
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram(Metric):
+    """Histogram of observed values with labels."""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def collect(self):
+        """Get current values.
+
+        :returns: dict {labels tuple: [bucket counts, sum]}, where the
+                  last bucket count is the number of values above all
+                  buckets
+        """
+        with self._lock:
+            return dict((key, [list(counts), total])
+                        for key, (counts, total) in self._values.items())
+
+    @staticmethod
+    def merge(value, other):
+        return [[a + b for a, b in zip(value[0], other[0])],
+                value[1] + other[1]]
+
+    def samples(self, labels, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield (self.name + "_bucket", labels + (("le", repr(bound)),),
+                   cumulative)
+        cumulative += counts[-1]
+        yield self.name + "_bucket", labels + (("le", "+Inf"),), cumulative
+        yield self.name + "_sum", labels, total
+        yield self.name + "_count", labels, cumulative
+
+
+REQUESTS = Counter(
+    "notify_requests_total", "Number of API requests.", ["route", "code"])
+REQUEST_DURATION = Histogram(
+    "notify_request_duration_seconds", "API request latency.", ["route"])
+DELIVERIES = Counter(
+    "notify_deliveries_total", "Number of driver calls by outcome: passed, "
+    "failed, error, explained_error, throttled or circuit_open.",
+    ["backend", "driver", "outcome"])
+DELIVERY_DURATION = Histogram(
+    "notify_delivery_duration_seconds", "Driver call latency.",
+    ["backend", "driver"])
+DRIVER_CACHE = Counter(
+    "notify_driver_cache_total", "Driver cache lookups by result: "
+    "hit or miss.", ["result"])
+SMTP_CONNECT_DURATION = Histogram(
+    "notify_smtp_connect_duration_seconds",
+    "Time to open SMTP connection, including STARTTLS and login.",
+    ["host"])
+SFDC_AUTH = Counter(
+    "notify_sfdc_auth_total", "Number of SFDC authentications by reason: "
+    "initial or expired.", ["reason"])
+SFDC_CASE_CACHE = Counter(
+    "notify_sfdc_case_cache_total", "SFDC Case cache lookups by result: "
+    "hit or miss, and invalidations of not found Cases (stale).",
+    ["result"])
+MAIL_DIGEST_ITEMS = Counter(
+    "notify_mail_digest_items_total", "Number of alerts sent in mail "
+    "digests by result: sent or failed.", ["result"])
+
+
+def collect():
+    """Get values of all metrics of this process.
+
+    :returns: dict {metric name: {labels JSON: value}}
+    """
+    return dict((metric.name, dict((json.dumps(key), value)
+                                   for key, value in metric.collect().items()))
+                for metric in METRICS)
+
+
+def dump(directory):
+    """Write values of this process into multiprocess directory."""
+    path = os.path.join(directory, "metrics-{}.json".format(os.getpid()))
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as metrics_file:
+        json.dump(collect(), metrics_file)
+    os.rename(tmp_path, path)
+
+
+def aggregate(directory):
+    """Sum values dumped by all processes.
+
+    Files of exited processes are kept, so counters never go back.
+
+    :returns: dict {metric name: {labels JSON: value}}
+    """
+    merge = dict((metric.name, metric.merge) for metric in METRICS)
+    result = dict((name, {}) for name in merge)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as metrics_file:
+                values = json.load(metrics_file)
+        except (IOError, OSError, ValueError) as e:
+            LOG.warning("Skipping metrics file {}: {}".format(path, e))
+            continue
+        for name, samples in values.items():
+            if name not in result:
+                continue
+            for key, value in samples.items():
+                if key in result[name]:
+                    value = merge[name](result[name][key], value)
+                result[name][key] = value
+    return result
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        "\"", "\\\"")
+
+
+def render(values):
+    """Render values in Prometheus text exposition format.
+
+    :param values: dict returned by collect() or aggregate()
+    :rtype: str
+    """
+    lines = []
+    for metric in METRICS:
+        lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+        lines.append("# TYPE {} {}".format(metric.name, metric.TYPE))
+        for key in sorted(values.get(metric.name, {})):
+            labels = tuple(zip(metric.labelnames, json.loads(key)))
+            for name, sample_labels, value in metric.samples(
+                    labels, values[metric.name][key]):
+                if sample_labels:
+                    name += "{{{}}}".format(",".join(
+                        "{}=\"{}\"".format(label, _escape(label_value))
+                        for label, label_value in sample_labels))
+                lines.append("{} {}".format(name, value))
+    return "\n".join(lines) + "\n"
+
+
+def get_text(directory=None):
+    """Get metrics of the whole service.
+
+    :param directory: multiprocess directory or None to get metrics of
+                      this process only
+    :rtype: str
+    """
+    if not directory:
+        return render(collect())
+    dump(directory)
+    return render(aggregate(directory))
+
+
+def start(directory, interval=5):
+    """Start daemon thread which dumps metrics of this process.
+
+    :param directory: multiprocess directory, created if needed
+    :param interval: seconds between dumps
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                dump(directory)
+            except Exception as e:
+                LOG.error("Failed to dump metrics: {}: {}".format(type(e), e))
+
+    thread = threading.Thread(target=run, name="notify-metrics")
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,240 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+SEVERITIES = ["OK", "INFO", "UNKNOWN", "WARNING", "CRITICAL", "DOWN"]
+
+LIMIT_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema",
+    "type": "object",
+    "properties": {
+        "rate": {"type": "number", "exclusiveMinimum": True, "minimum": 0},
+        "burst": {"type": "integer", "minimum": 1},
+        "policy": {"enum": ["queue", "drop", "summarize"]},
+        "max_wait": {"type": "number", "minimum": 0},
+        "min_severity": {"enum": SEVERITIES}
+    },
+    "required": ["rate"],
+    "additionalProperties": False
+}
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket."""
+
+    def __init__(self, rate, burst=1):
+        """Init bucket.
+
+        :param rate: tokens added per second
+        :param burst: bucket capacity
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Take token if available.
+
+        :returns: 0 if token is taken, otherwise seconds to wait for it
+        """
+        with self._lock:
+            self._tokens, self._updated, wait = self._spend(self._tokens,
+                                                            self._updated)
+            return wait
+
+    def _spend(self, tokens, updated):
+        """Refill tokens since last update and take one if available.
+
+        :returns: tuple (tokens, updated, seconds to wait for token)
+        """
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def acquire(self, timeout=0):
+        """Take token, waiting for it no longer than timeout.
+
+        :returns: bool whether token is taken
+        """
+        deadline = time.time() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket shared by processes via SQLite database.
+
+    Buckets with the same key in the same database file have common
+    tokens, so the rate applies to all API workers together.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, key, rate, burst=1):
+        """Init bucket.
+
+        :param path: SQLite database file path
+        :param key: name of bucket in database
+        :param rate: tokens added per second
+        :param burst: bucket capacity
+        """
+        super(SharedTokenBucket, self).__init__(rate, burst)
+        self.path = path
+        self.key = key
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return contextlib.closing(conn)
+
+    def _take(self):
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        "SELECT tokens, updated FROM buckets WHERE key = ?",
+                        (self.key,)).fetchone()
+                    tokens, updated, wait = self._spend(
+                        *(row or (self.burst, time.time())))
+                    conn.execute("INSERT OR REPLACE INTO buckets (key, "
+                                 "tokens, updated) VALUES (?, ?, ?)",
+                                 (self.key, tokens, updated))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            # Limit is not enforced rather than alerts are lost
+            LOG.error("Failed to take token of '{}': {}".format(self.key, e))
+            return 0
+        return wait
+
+
+class Limit(object):
+    """Rate limit with overflow policy.
+
+    Overflow policies:
+      queue - wait for token up to max_wait seconds, then throttle
+      drop - throttle alerts with severity lower than min_severity,
+             deliver the rest regardless of rate
+      summarize - throttle alerts, but mention them in description of
+                  next delivered alert
+    """
+
+    def __init__(self, rate, burst=1, policy="queue", max_wait=5,
+                 min_severity="CRITICAL", bucket=None):
+        """Init limit.
+
+        :param bucket: TokenBucket to use instead of own one
+        """
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.policy = policy
+        self.max_wait = max_wait
+        self.min_severity = SEVERITIES.index(min_severity)
+        self._throttled = collections.Counter()
+        self._lock = threading.Lock()
+
+    def admit(self, payload):
+        """Apply limit to payload.
+
+        :returns: payload to deliver or None if it is throttled
+        """
+        if self.policy == "queue":
+            return payload if self.bucket.acquire(self.max_wait) else None
+
+        if self.bucket.acquire():
+            if self.policy == "summarize":
+                return self._summarize(payload)
+            return payload
+
+        if self.policy == "drop":
+            severity = SEVERITIES.index(payload["severity"])
+            return payload if severity >= self.min_severity else None
+
+        with self._lock:
+            self._throttled[payload["severity"]] += 1
+        return None
+
+    def _summarize(self, payload):
+        with self._lock:
+            throttled, self._throttled = (self._throttled,
+                                          collections.Counter())
+        if not throttled:
+            return payload
+        details = ", ".join("{} {}".format(throttled[s], s)
+                            for s in SEVERITIES if throttled[s])
+        payload = dict(payload)
+        payload["description"] += (
+            "\n\n{} alert(s) have been throttled by rate limit: {}".format(
+                sum(throttled.values()), details))
+        return payload
+
+
+class Limiter(object):
+    """Rate limits of backends and drivers."""
+
+    def __init__(self, limits, path=None):
+        """Init limiter.
+
+        :param limits: dict {key: limit config}, where key is either
+                       backend name or "<backend>.<driver>"
+        :param path: SQLite database file path to share tokens between
+                     processes, otherwise tokens are kept per process
+        """
+        self.limits = {}
+        for key, conf in limits.items():
+            bucket = path and SharedTokenBucket(path, key, conf["rate"],
+                                                conf.get("burst", 1))
+            self.limits[key] = Limit(bucket=bucket, **conf)
+
+    def admit(self, backend, drv_name, payload):
+        """Apply limits of backend and its driver to payload.
+
+        :returns: payload to deliver or None if it is throttled
+        """
+        for key in ("{}.{}".format(backend, drv_name), backend):
+            limit = self.limits.get(key)
+            if limit and payload:
+                payload = limit.admit(payload)
+        return payload
@@ -0,0 +1,177 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from notify import driver
+from notify import metrics
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+DEFAULT_CLOSE_DELAY = 60
+
+
+def make_key(name, conf):
+    """Make cache key of driver instance.
+
+    :param name: driver name
+    :param conf: driver configuration, may include nested structures
+    :returns: str "<name>.<MD5 hexdigest of canonical conf JSON>"
+    """
+    canonical = json.dumps(conf, sort_keys=True, separators=(",", ":"))
+    return "{}.{}".format(name,
+                          hashlib.md5(canonical.encode("utf-8")).hexdigest())
+
+
+class Registry(object):
+    """Cache of driver instances.
+
+    Instances are evicted when they are least recently used and registry
+    is full, or when they have not been used for `ttl' seconds. Evicted
+    instances are closed after `close_delay' seconds, so requests which
+    are still in flight finish with them, and then their pooled
+    connections are released.
+    """
+
+    def __init__(self, max_size=128, ttl=None,
+                 close_delay=DEFAULT_CLOSE_DELAY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.close_delay = close_delay
+        self._drivers = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._drivers
+
+    def __len__(self):
+        return len(self._drivers)
+
+    def keys(self):
+        return list(self._drivers)
+
+    def lookup(self, name, conf):
+        """Get cached driver instance, but do not create it.
+
+        :param name: driver name
+        :param conf: driver configuration
+        :returns: tuple (key, driver instance or None)
+        """
+        key = make_key(name, conf)
+        with self._lock:
+            entry = self._drivers.pop(key, None)
+            if entry is None:
+                return key, None
+            self._drivers[key] = (entry[0], time.time())
+        metrics.DRIVER_CACHE.inc(result="hit")
+        return key, entry[0]
+
+    def get(self, name, conf):
+        """Get driver instance, create it if it is not cached yet.
+
+        :param name: driver name
+        :param conf: driver configuration
+        :returns: tuple (key, driver instance)
+        :raises: RuntimeError
+        """
+        key, driver_ins = self.lookup(name, conf)
+        if driver_ins is not None:
+            return key, driver_ins
+
+        metrics.DRIVER_CACHE.inc(result="miss")
+        now = time.time()
+        driver_ins = driver.get_driver(name, conf)
+
+        with self._lock:
+            entry = self._drivers.pop(key, None)
+            duplicate = None
+            if entry is not None:
+                # Instance has been created concurrently by another thread
+                duplicate = driver_ins
+                driver_ins = entry[0]
+            self._drivers[key] = (driver_ins, now)
+            evicted = self._pop_evicted(now)
+        if duplicate is not None:
+            self._close_now([duplicate])
+        self._close(evicted)
+        return key, driver_ins
+
+    def _pop_evicted(self, now):
+        evicted = []
+        while len(self._drivers) > self.max_size:
+            evicted.append(self._drivers.popitem(last=False)[1][0])
+        if self.ttl is not None:
+            while self._drivers:
+                key, (driver_ins, used_at) = next(iter(self._drivers.items()))
+                if now - used_at <= self.ttl:
+                    break
+                del self._drivers[key]
+                evicted.append(driver_ins)
+        return evicted
+
+    def _close(self, drivers):
+        if drivers and self.close_delay:
+            timer = threading.Timer(self.close_delay, self._close_now,
+                                    [drivers])
+            timer.daemon = True
+            timer.start()
+        else:
+            self._close_now(drivers)
+
+    def _close_now(self, drivers):
+        for driver_ins in drivers:
+            try:
+                driver_ins.close()
+            except Exception as e:
+                LOG.error("Failed to close driver {}: {}: {}".format(
+                    driver_ins, type(e), e))
+
+    def prune(self, keep):
+        """Evict all instances except given ones.
+
+        :param keep: iterable of keys to keep
+        """
+        keep = set(keep)
+        with self._lock:
+            evicted = [self._drivers.pop(key)[0]
+                       for key in list(self._drivers) if key not in keep]
+        self._close(evicted)
+
+    def clear(self):
+        """Evict all instances."""
+        self.prune([])
+
+    def warm_up(self, notify_backends):
+        """Create instances of all configured drivers.
+
+        :param notify_backends: backends configuration
+        :returns: list of keys of configured drivers
+        """
+        keys = []
+        for backend, drivers in notify_backends.items():
+            for name, conf in drivers.items():
+                try:
+                    keys.append(self.get(name, conf)[0])
+                except Exception as e:
+                    LOG.error("Backend '{}' driver '{}': {}: {}".format(
+                        backend, name, type(e), e))
+        return keys
@@ -0,0 +1,305 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+import schedule
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+
+def get_delay(attempts, base_delay, max_delay):
+    """Get randomized delay before next attempt.
+
+    Delay grows exponentially with number of failed attempts and is
+    jittered over its whole range, so that deliveries which failed at
+    the same time are not retried all at once.
+
+    :param attempts: number of failed attempts so far (1 or more)
+    :param base_delay: seconds, upper bound of delay after first failure
+    :param max_delay: seconds, upper bound of any delay
+    :returns: float seconds
+    """
+    ceiling = min(max_delay, base_delay * 2 ** min(attempts - 1, 32))
+    return random.uniform(0, ceiling)
+
+
+class RetryStore(object):
+    """Durable store of failed deliveries backed by SQLite.
+
+    Failed deliveries are buffered in memory and written in one
+    transaction per flush, with synchronous=NORMAL in WAL mode, so disk
+    is synced at checkpoints rather than on every failure. Deliveries
+    buffered since the last flush are lost if the process is killed.
+
+    The database file can be shared by several processes: each due
+    delivery is leased by one process before it is retried.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS retries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backend TEXT NOT NULL,
+            driver TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            next_at REAL NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS retries_next_at ON retries (next_at);
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backend TEXT NOT NULL,
+            driver TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            failed_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path, handler, max_attempts=5, base_delay=10,
+                 max_delay=3600, max_size=100000, max_dead_letters=10000,
+                 flush_interval=1.0, flush_size=100, poll_interval=5.0,
+                 batch_size=50, lease=600):
+        """Init store.
+
+        :param path: SQLite database file path
+        :param handler: callable(backend, drv_name, payload) returning
+                        bool whether delivery has succeeded
+        :param max_attempts: number of failed attempts (including the
+                             original delivery) after which delivery is
+                             moved to dead letters
+        :param base_delay: seconds, max delay after first failure
+        :param max_delay: seconds, max delay between attempts
+        :param max_size: max number of pending deliveries, the oldest
+                         ones are dropped when it is exceeded
+        :param max_dead_letters: max number of kept dead letters
+        :param flush_interval: seconds between writes of buffered failures
+        :param flush_size: number of buffered failures which is written
+                           immediately
+        :param poll_interval: seconds between checks of due deliveries
+        :param batch_size: max number of deliveries leased at once
+        :param lease: seconds after which leased delivery is retried by
+                      any process (its process has died)
+        """
+        self.path = path
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.max_dead_letters = max_dead_letters
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease = lease
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return contextlib.closing(conn)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def add(self, backend, drv_name, payload, error=None):
+        """Schedule retry of failed delivery.
+
+        :param backend: backend name
+        :param drv_name: driver name
+        :param payload: notification payload
+        :param error: str description of failure
+        """
+        now = time.time()
+        row = (backend, drv_name, json.dumps(payload), 1, error,
+               now + get_delay(1, self.base_delay, self.max_delay), now)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write buffered failures and drop deliveries over the limit."""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO retries (backend, driver, payload, attempts, "
+                "error, next_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            dropped = conn.execute(
+                "DELETE FROM retries WHERE id <= (SELECT MAX(id) FROM "
+                "retries) - ?", (self.max_size,)).rowcount
+        if dropped > 0:
+            LOG.warning("Retry store is full, {} oldest deliveries have "
+                        "been dropped".format(dropped))
+
+    def lease_due(self):
+        """Lease deliveries which are due for retry.
+
+        :returns: list of tuples (id, backend, drv_name, payload, attempts)
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, backend, driver, payload, attempts FROM retries "
+                "WHERE next_at <= ? ORDER BY next_at LIMIT ?",
+                (now, self.batch_size)).fetchall()
+            conn.executemany("UPDATE retries SET next_at = ? WHERE id = ?",
+                             [(now + self.lease, row[0]) for row in rows])
+        return [(row[0], row[1], row[2], json.loads(row[3]), row[4])
+                for row in rows]
+
+    def process_due(self):
+        """Retry due deliveries and record outcomes in one transaction.
+
+        :returns: number of retried deliveries
+        """
+        deliveries = self.lease_due()
+        done, failed, dead = [], [], []
+        for row_id, backend, drv_name, payload, attempts in deliveries:
+            try:
+                succeeded = bool(self.handler(backend, drv_name, payload))
+                error = "Delivery has failed"
+            except Exception as e:
+                succeeded, error = False, "{}: {}".format(type(e).__name__, e)
+            attempts += 1
+            if succeeded:
+                done.append((row_id,))
+            elif attempts >= self.max_attempts:
+                LOG.error("Backend '{}' driver '{}': giving up after {} "
+                          "attempts: {}".format(backend, drv_name, attempts,
+                                                error))
+                dead.append((attempts, error, time.time(), row_id))
+            else:
+                next_at = time.time() + get_delay(
+                    attempts, self.base_delay, self.max_delay)
+                failed.append((attempts, error, next_at, row_id))
+
+        if deliveries:
+            with self._transaction() as conn:
+                conn.executemany("DELETE FROM retries WHERE id = ?", done)
+                conn.executemany("UPDATE retries SET attempts = ?, "
+                                 "error = ?, next_at = ? WHERE id = ?",
+                                 failed)
+                for attempts, error, failed_at, row_id in dead:
+                    conn.execute(
+                        "INSERT INTO dead_letters (backend, driver, payload, "
+                        "attempts, error, created_at, failed_at) "
+                        "SELECT backend, driver, payload, ?, ?, created_at, "
+                        "? FROM retries WHERE id = ?",
+                        (attempts, error, failed_at, row_id))
+                    conn.execute("DELETE FROM retries WHERE id = ?",
+                                 (row_id,))
+                if dead:
+                    conn.execute(
+                        "DELETE FROM dead_letters WHERE id <= (SELECT MAX(id) "
+                        "FROM dead_letters) - ?", (self.max_dead_letters,))
+        return len(deliveries)
+
+    def get_dead_letters(self, limit=100):
+        """Get the most recent deliveries which could not be retried.
+
+        :returns: list of dicts
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT backend, driver, payload, attempts, error, "
+                "created_at, failed_at FROM dead_letters "
+                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [{"backend": row[0], "driver": row[1],
+                 "payload": json.loads(row[2]), "attempts": row[3],
+                 "error": row[4], "created_at": row[5], "failed_at": row[6]}
+                for row in rows]
+
+    def stats(self):
+        """Get numbers of pending (including buffered) and dead deliveries.
+
+        :returns: dict with keys pending and dead
+        """
+        with self._connect() as conn:
+            pending = conn.execute("SELECT COUNT(*) FROM retries").fetchone()
+            dead = conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()
+        return {"pending": pending[0] + len(self._buffer), "dead": dead[0]}
+
+    def _safe(self, func):
+        def call():
+            try:
+                func()
+            except Exception as e:
+                LOG.error("Retry store error: {}: {}".format(type(e), e))
+        return call
+
+    def _drain(self):
+        while (self.process_due() == self.batch_size and
+               not self._stopped.is_set()):
+            pass
+
+    def _run(self, scheduler):
+        while not self._stopped.is_set():
+            scheduler.run_pending()
+            self._stopped.wait(max(min(scheduler.idle_seconds, 1), 0))
+
+    def start(self):
+        """Start background thread which flushes and retries deliveries."""
+        if self._thread:
+            return
+        scheduler = schedule.Scheduler()
+        scheduler.every(self.flush_interval).seconds.do(self._safe(self.flush))
+        scheduler.every(self.poll_interval).seconds.do(
+            self._safe(self._drain))
+        self._thread = threading.Thread(target=self._run, args=(scheduler,),
+                                        name="notify-retry")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop background thread and flush buffered failures."""
+        if self._thread:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._stopped.clear()
+        self.flush()
@@ -0,0 +1,270 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Lightweight tracing of API requests.
+
+Every request gets a request id, which is added to log records of
+loggers with RequestIdFilter. Sampled requests also get a trace: a tree
+of timed spans (validation, driver lookup, driver calls, SFDC and SMTP
+calls), which is appended as JSON line to the configured file and can be
+returned in response body.
+
+Current span is kept in context variable (thread-local before Python
+3.7), so it has to be passed explicitly to executor threads with wrap().
+Spans of requests which are not sampled are not created at all.
+"""
+
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+from notify import config
+
+
+LOG = logging.getLogger(__name__)
+LOG.setLevel(logging.INFO)
+
+REQUEST_ID_RE = re.compile(r"^[\w.-]{1,64}$")
+
+_WRITE_LOCK = threading.Lock()
+
+
+class _ThreadLocalVar(object):
+    """Subset of contextvars.ContextVar for Python < 3.7."""
+
+    def __init__(self, name, default=None):
+        self._local = threading.local()
+        self._default = default
+
+    def get(self):
+        return getattr(self._local, "value", self._default)
+
+    def set(self, value):
+        self._local.value = value
+
+
+if contextvars:
+    _CURRENT = contextvars.ContextVar("notify_span", default=None)
+else:
+    _CURRENT = _ThreadLocalVar("notify_span")
+
+
+class Trace(object):
+    """Spans of single request."""
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans = []
+        self._ids = itertools.count(1)
+
+    def next_id(self):
+        return next(self._ids)
+
+
+class Span(object):
+    """Timed operation within trace, context manager which makes it
+    current span while it is active.
+    """
+
+    def __init__(self, trace, name, parent_id=None, **attrs):
+        self.trace = trace
+        self.name = name
+        self.id = trace.next_id()
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.error = None
+        self.started_at = time.time()
+        self.duration = None
+        self._previous = None
+
+    def set(self, **attrs):
+        """Add attributes to span."""
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.duration = time.time() - self.started_at
+        self.trace.spans.append(self)
+
+    def __enter__(self):
+        self._previous = _CURRENT.get()
+        _CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_value is not None:
+            self.error = "{}: {}".format(exc_type.__name__, exc_value)
+        self.finish()
+        _CURRENT.set(self._previous)
+
+    def to_dict(self):
+        result = {"id": self.id, "parent_id": self.parent_id,
+                  "name": self.name, "start": self.started_at,
+                  "duration": self.duration}
+        if self.attrs:
+            result["attrs"] = self.attrs
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+class _NoopSpan(object):
+    """Span of not sampled request, which records nothing."""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def get_settings():
+    """Get tracing settings with defaults applied.
+
+    :returns: dict with keys sample_rate, file and inline
+    """
+    conf = config.get_config().get("tracing", {})
+    return {"sample_rate": conf.get("sample_rate", 0),
+            "file": conf.get("file"),
+            "inline": conf.get("inline", False)}
+
+
+def start_trace(name, request_id=None, sampled=None, **attrs):
+    """Start trace of request and make its root span current.
+
+    :param name: name of root span
+    :param request_id: id received from client, new one is generated if
+                       it is missing or malformed
+    :param sampled: whether to record spans, by default it is decided
+                    by configured sample rate
+    :returns: root Span
+    """
+    if not request_id or not REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex
+    if sampled is None:
+        sample_rate = get_settings()["sample_rate"]
+        sampled = sample_rate > 0 and random.random() < sample_rate
+    root = Span(Trace(request_id, sampled), name, **attrs)
+    _CURRENT.set(root)
+    return root
+
+
+def finish_trace(root, **attrs):
+    """Finish trace of request and export it if it is sampled.
+
+    :param root: Span returned by start_trace() or None
+    :param attrs: attributes added to root span
+    :returns: list of span dicts ordered by start time, or None if trace
+              is not sampled
+    """
+    if root is None:
+        return None
+    _CURRENT.set(None)
+    if not root.trace.sampled:
+        return None
+    root.set(**attrs)
+    root.finish()
+    spans = [span.to_dict() for span in
+             sorted(root.trace.spans, key=lambda span: span.started_at)]
+    path = get_settings()["file"]
+    if path:
+        try:
+            _write(path, {"request_id": root.trace.request_id,
+                          "spans": spans})
+        except (IOError, OSError) as e:
+            LOG.error("Failed to write trace: {}".format(e))
+    return spans
+
+
+def _write(path, record):
+    line = json.dumps(record, sort_keys=True) + "\n"
+    with _WRITE_LOCK:
+        with open(path, "a") as trace_file:
+            trace_file.write(line)
+
+
+def span(name, **attrs):
+    """Get child span of current span.
+
+    Use it as context manager:
+
+        with tracing.span("smtp.sendmail", host=host) as sp:
+            ...
+            sp.set(recipients=len(recipients))
+
+    :returns: Span or NOOP_SPAN if request is not sampled
+    """
+    parent = _CURRENT.get()
+    if parent is None or not parent.trace.sampled:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.id, **attrs)
+
+
+def get_request_id():
+    """Get id of current request or None."""
+    current = _CURRENT.get()
+    return current and current.trace.request_id
+
+
+def wrap(func):
+    """Bind callable to current span, so that it can run in other thread.
+
+    :returns: callable which makes current span of caller current while
+              it runs
+    """
+    parent = _CURRENT.get()
+    if parent is None:
+        return func
+
+    def call(*args, **kwargs):
+        previous = _CURRENT.get()
+        _CURRENT.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _CURRENT.set(previous)
+    return call
+
+
+class RequestIdFilter(logging.Filter):
+    """Prefix log messages with id of current request.
+
+    Id is also set as request_id attribute of log records, so it can be
+    used in log formats.
+    """
+
+    def filter(self, record):
+        request_id = get_request_id()
+        record.request_id = request_id or "-"
+        if request_id and not getattr(record, "_request_id_added", False):
+            record.msg = "[req-{}] {}".format(request_id, record.msg)
+            record._request_id_added = True
+        return True
@@ -12,6 +12,18 @@ setup(name="notify",
       packages=find_packages(exclude=["tests*"]),
       entry_points={
           "console_scripts": [
-              "notify-api = notify.main:main"
+              "notify-api = notify.main:main",
+              "notify-import-profile = notify.import_profile:main"
+          ],
+          "notify.drivers": [
+              "dummy_err = notify.drivers.dummy_err:Driver",
+              "dummy_err_explained = "
+              "notify.drivers.dummy_err_explained:Driver",
+              "dummy_fail = notify.drivers.dummy_fail:Driver",
+              "dummy_pass = notify.drivers.dummy_pass:Driver",
+              "dummy_random = notify.drivers.dummy_random:Driver",
+              "dummy_sleep = notify.drivers.dummy_sleep:Driver",
+              "mail = notify.drivers.mail:Driver",
+              "sfdc = notify.drivers.sfdc:Driver"
           ],
       })
@@ -0,0 +1,269 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import smtplib
+import threading
+
+from notify.drivers import mail
+from notify.drivers import sfdc
+from notify import tracing
+from tests.tools import fake_servers
+from tests.unit import test
+
+
+class MailDriverTestCase(test.TestCase):
+
+    def start_server(self, **behavior):
+        server = fake_servers.FakeSMTPServer(
+            behavior=fake_servers.Behavior(**behavior)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def make_driver(self, server, **config):
+        config.setdefault("recipients", ["ops@example.com"])
+        drv = mail.Driver(dict(config, sender_domain="example.com",
+                               smtp_host="127.0.0.1",
+                               smtp_port=server.port))
+        self.addCleanup(drv.close)
+        return drv
+
+    def test_notify(self):
+        server = self.start_server()
+        drv = self.make_driver(server, smtp_user="user",
+                               smtp_password="secret")
+
+        for i in range(5):
+            self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(1, server.stats["connections"])
+        self.assertEqual(5, server.stats["messages"])
+        recipients, data = server.messages[-1]
+        self.assertEqual(["ops@example.com"], recipients)
+        self.assertIn("Subject: John Doe: Hooray!", data)
+        self.assertIn("From: farfaraway@example.com", data)
+
+    def test_notify_concurrently(self):
+        server = self.start_server(latency=0.02)
+        drv = self.make_driver(server, pool_size=2)
+
+        threads = [threading.Thread(target=drv.notify, args=(self.payload,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, server.stats["messages"])
+        self.assertLessEqual(server.stats["connections"], 2)
+
+    def test_notify_rejected_recipient(self):
+        server = self.start_server()
+        drv = self.make_driver(
+            server, recipients=["ops@example.com", "reject@example.com"])
+
+        status = drv.notify(self.payload)
+        self.assertTrue(status)
+        self.assertEqual(["reject@example.com"],
+                         list(status.details["refused"]))
+        self.assertEqual(1, server.stats["rejected_recipients"])
+        self.assertEqual([["ops@example.com"]],
+                         [rcpts for rcpts, data in server.messages])
+
+    def test_notify_many(self):
+        server = self.start_server()
+        drv = self.make_driver(server)
+
+        payloads = [dict(self.payload, what="Alert {}".format(i))
+                    for i in range(10)]
+        self.assertEqual([True] * 10, drv.notify_many(payloads))
+        self.assertEqual(1, server.stats["connections"])
+        self.assertEqual(10, server.stats["messages"])
+
+        drv = self.make_driver(server, smtp_pipelining=False)
+        self.assertEqual([True] * 10, drv.notify_many(payloads))
+        self.assertEqual(2, server.stats["connections"])
+        self.assertEqual(20, server.stats["messages"])
+
+    def test_notify_recipients_chunks(self):
+        server = self.start_server(latency=0.02)
+        recipients = ["ops{}@example.com".format(i) for i in range(8)]
+        drv = self.make_driver(
+            server, recipients=recipients + ["reject@example.com"],
+            recipients_chunk_size=3, pool_size=3)
+
+        statuses = drv.notify_many([self.payload] * 2)
+        self.assertEqual(
+            [{"status": True, "refused": {
+                "reject@example.com": "550 5.1.1 User unknown"}}] * 2,
+            [status.to_dict() for status in statuses])
+        self.assertEqual(3, server.stats["connections"])
+        self.assertEqual(6, server.stats["messages"])
+        self.assertEqual(sorted(recipients * 2),
+                         sorted(rcpt for rcpts, data in server.messages
+                                for rcpt in rcpts))
+
+    def test_notify_digest(self):
+        server = self.start_server()
+        drv = self.make_driver(server, digest={"window": 60,
+                                               "max_items": 100})
+
+        for i in range(250):
+            self.assertTrue(drv.notify(dict(self.payload,
+                                            what="Alert {}".format(i))))
+        self.assertTrue(drv.notify(dict(self.payload, severity="DOWN")))
+        self.assertEqual(3, server.stats["messages"])
+        drv.close()
+        self.assertEqual(4, server.stats["messages"])
+        subjects = [data.split("Subject: ")[1].split("\n")[0]
+                    for rcpts, data in server.messages]
+        self.assertEqual(["Digest of 100 alert(s): 100 INFO"] * 2 +
+                         ["John Doe: Hooray!",
+                          "Digest of 50 alert(s): 50 INFO"], subjects)
+
+    def test_notify_failed(self):
+        server = self.start_server(error_rate=1)
+        drv = self.make_driver(server)
+
+        self.assertRaises(smtplib.SMTPDataError, drv.notify, self.payload)
+        self.assertEqual(1, server.stats["failed"])
+
+    def test_notify_rate_limited(self):
+        server = self.start_server(rate_limit=1)
+        drv = self.make_driver(server)
+
+        self.assertTrue(drv.notify(self.payload))
+        self.assertRaises(smtplib.SMTPSenderRefused, drv.notify,
+                          self.payload)
+        self.assertEqual(1, server.stats["throttled"])
+
+
+class SFDCDriverTestCase(test.TestCase):
+
+    def start_server(self, token_ttl=None, **behavior):
+        server = fake_servers.FakeSFDCServer(
+            behavior=fake_servers.Behavior(**behavior), token_ttl=token_ttl,
+            credentials={"username": "user", "password": "secret"}).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def make_driver(self, server, **config):
+        drv = sfdc.Driver(dict(config, username="user", password="secret",
+                               client_id="id", client_secret="key",
+                               auth_url=server.url, retries=0))
+        self.addCleanup(drv.close)
+        return drv
+
+    def test_notify(self):
+        server = self.start_server()
+        drv = self.make_driver(server)
+
+        self.assertTrue(drv.notify(self.payload))
+        case, = server.cases.values()
+        item, = server.feeditems.values()
+        self.assertEqual("farfaraway|Hooray!|John Doe", case["Alert_ID__c"])
+        self.assertEqual(case["Id"], item["ParentId"])
+        self.assertEqual(1, server.stats["auths"])
+
+    def test_notify_duplicate(self):
+        server = self.start_server()
+        drv = self.make_driver(server)
+
+        self.assertTrue(drv.notify(self.payload))
+        self.payload["description"] = "Updated"
+        self.assertTrue(drv.notify(self.payload))
+        case, = server.cases.values()
+        self.assertEqual("Updated", case["Description"])
+        self.assertEqual(1, server.stats["cases"])
+        self.assertEqual(2, server.stats["feeditems"])
+        # Requests are sent over single keep-alive connection
+        self.assertEqual(1, server.stats["connections"])
+
+    def test_notify_cached_case(self):
+        server = self.start_server()
+        drv = self.make_driver(server, case_cache_size=10)
+
+        self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(3, server.stats["requests"])
+        self.assertTrue(drv.notify(self.payload))
+        # Case is updated right away, without failed creation and lookup
+        self.assertEqual(5, server.stats["requests"])
+
+        server.delete_case(next(iter(server.cases)))
+        self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(2, server.stats["cases"])
+        self.assertEqual(3, server.stats["feeditems"])
+
+    def test_notify_traced(self):
+        server = self.start_server()
+        drv = self.make_driver(server)
+
+        root = tracing.start_trace("request", sampled=True)
+        self.assertTrue(drv.notify(self.payload))
+        spans = tracing.finish_trace(root)
+        self.assertEqual(["request", "sfdc.authenticate", "sfdc.request",
+                          "sfdc.request"],
+                         [span["name"] for span in spans])
+        self.assertEqual([None, None, 201, 201],
+                         [span.get("attrs", {}).get("status")
+                          for span in spans])
+
+    def test_notify_composite(self):
+        server = self.start_server()
+        drv = self.make_driver(server, composite=True,
+                               composite_batch_size=3)
+
+        self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(2, server.stats["requests"])
+        other = dict(self.payload, who="Jane Roe")
+        self.assertEqual([True] * 4, drv.notify_many(
+            [self.payload, other, self.payload, other]))
+
+        self.assertEqual(4, server.stats["requests"])
+        self.assertEqual(2, server.stats["cases"])
+        self.assertEqual(5, server.stats["feeditems"])
+        alert_ids = sorted(case["Alert_ID__c"]
+                           for case in server.cases.values())
+        self.assertEqual(["farfaraway|Hooray!|Jane Roe",
+                          "farfaraway|Hooray!|John Doe"], alert_ids)
+
+    def test_notify_soap_auth(self):
+        server = self.start_server()
+        drv = self.make_driver(server, organization_id="00D")
+
+        self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(1, server.stats["auths"])
+
+    def test_notify_invalid_credentials(self):
+        server = self.start_server()
+        drv = self.make_driver(server)
+        drv.client.oauth2.password = "wrong"
+
+        self.assertRaises(Exception, drv.notify, self.payload)
+        self.assertEqual({}, server.cases)
+
+    def test_notify_expired_token(self):
+        server = self.start_server(token_ttl=3600)
+        drv = self.make_driver(server)
+
+        self.assertTrue(drv.notify(self.payload))
+        server.expire_tokens()
+        self.assertTrue(drv.notify(self.payload))
+        self.assertEqual(1, server.stats["invalid_sessions"])
+        self.assertEqual(2, server.stats["auths"])
+
+    def test_notify_failed(self):
+        server = self.start_server(error_rate=1)
+        drv = self.make_driver(server)
+
+        self.assertRaises(Exception, drv.notify, self.payload)
+        self.assertEqual(1, server.stats["failed"])
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of notification API.
+
+Replays payload corpus (one JSON payload per line) against the service,
+either in-process through Flask test client or over HTTP, and reports
+throughput, latency percentiles and (in-process) memory allocations.
+
+Requests fan out to --fanout backends, each with single dummy_sleep
+driver which simulates driver latency, or with real mail or sfdc driver
+(--driver) talking to fake server from fake_servers.py, which simulates
+server latency, failures (--error-rate) and rate limit (--rate-limit).
+
+In-process, 3 backends with lognormal driver latency:
+
+  $ python tests/tools/bench.py --requests 2000 --concurrency 32 \\
+        --fanout 3 --distribution lognormal --latency 0.02 --jitter 0.5 \\
+        --output results.json
+
+Over HTTP against gunicorn, started with generated configuration:
+
+  $ python tests/tools/bench.py --fanout 3 --print-config > bench.json
+  $ NOTIFY_CONF=bench.json gunicorn -w 4 -b 127.0.0.1:5000 notify.main:app
+  $ python tests/tools/bench.py --fanout 3 --url http://127.0.0.1:5000
+
+Real sfdc driver against fake SalesForce server started in-process:
+
+  $ python tests/tools/bench.py --driver sfdc --latency 0.05 \\
+        --concurrency 64 --pool-size 16
+
+Check for regressions against saved results (exit code is 1 if p95
+latency or throughput is worse by more than tolerance):
+
+  $ python tests/tools/bench.py --requests 2000 --compare results.json
+"""
+
+import argparse
+from concurrent import futures
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+DEFAULT_CORPUS = os.path.join(ROOT, "tests", "tools", "payloads.jsonl")
+
+timer = getattr(time, "perf_counter", time.time)
+
+
+def make_driver_config(args, server=None):
+    """Make configuration of benchmarked driver.
+
+    :param server: (host, port) of fake server for mail and sfdc drivers
+    :returns: dict
+    """
+    if args.driver == "mail":
+        conf = {"sender_domain": "example.com",
+                "recipients": ["ops@example.com"],
+                "smtp_host": server[0], "smtp_port": server[1]}
+    elif args.driver == "sfdc":
+        conf = {"username": "bench", "password": "bench",
+                "client_id": "bench", "client_secret": "bench",
+                "auth_url": "http://{}:{}".format(*server)}
+    else:
+        return {"distribution": args.distribution, "latency": args.latency,
+                "jitter": args.jitter, "probability": args.probability}
+    if args.pool_size:
+        conf["pool_size"] = args.pool_size
+    return conf
+
+
+def start_server(args):
+    """Start fake server for benchmarked driver in this process.
+
+    :returns: fake_servers.FakeSMTPServer or FakeSFDCServer
+    """
+    sys.path.insert(0, ROOT)
+    from tests.tools import fake_servers
+
+    behavior = fake_servers.Behavior(
+        latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit=args.rate_limit)
+    if args.driver == "mail":
+        server = fake_servers.FakeSMTPServer(behavior=behavior)
+    else:
+        server = fake_servers.FakeSFDCServer(behavior=behavior)
+    return server.start()
+
+
+def make_config(args, server=None):
+    """Make service configuration for benchmark.
+
+    :param server: (host, port) of fake server for mail and sfdc drivers
+    :returns: dict, valid for notify.config.CONF_SCHEMA
+    """
+    drv_conf = make_driver_config(args, server)
+    conf = {"flask": {},
+            "notify_backends": dict(
+                ("bench{}".format(i), {args.driver: drv_conf})
+                for i in range(args.fanout))}
+    if args.workers:
+        conf["dispatch"] = {"workers": args.workers}
+    return conf
+
+
+def load_corpus(path):
+    """Load payloads, one JSON object per line."""
+    with open(path) as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def percentile(values, q):
+    """Get percentile of sorted values by nearest-rank method."""
+    if not values:
+        return None
+    rank = int(round(q / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def make_inproc_sender(conf, json_codec=None):
+    """Make sender which calls Flask app in this process.
+
+    Service configuration is loaded on import of notify modules, so this
+    must be called before they are imported.
+
+    :param json_codec: name of notify.codec codec, fastest one if not set
+    """
+    conf_file = tempfile.NamedTemporaryFile("w", suffix=".json",
+                                            delete=False)
+    with conf_file:
+        json.dump(conf, conf_file)
+    os.environ["NOTIFY_CONF"] = conf_file.name
+    sys.path.insert(0, ROOT)
+    from notify import codec
+    from notify import main
+
+    if json_codec:
+        codec.use(json_codec)
+    local = threading.local()
+
+    def send(path, body):
+        if not hasattr(local, "client"):
+            local.client = main.app.test_client()
+        rv = local.client.post(path, data=body,
+                               content_type="application/json")
+        return rv.status_code
+
+    return send
+
+
+def make_http_sender(url):
+    """Make sender which calls service over HTTP."""
+    local = threading.local()
+
+    def send(path, body):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        resp = local.session.post(
+            url.rstrip("/") + path, data=body,
+            headers={"Content-Type": "application/json"})
+        return resp.status_code
+
+    return send
+
+
+def run(send, path, payloads, total, concurrency):
+    """Send total requests, cycling over payloads.
+
+    :returns: tuple (sorted latencies of successful requests, number of
+              failed requests, duration in seconds)
+    """
+    bodies = [json.dumps(payload) for payload in payloads]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def call(i):
+        started_at = timer()
+        try:
+            ok = send(path, bodies[i % len(bodies)]) == 200
+        except Exception:
+            ok = False
+        latency = timer() - started_at
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors[0] += 1
+
+    started_at = timer()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(total)))
+    return sorted(latencies), errors[0], timer() - started_at
+
+
+def summarize(latencies, errors, duration):
+    total = len(latencies) + errors
+    return {"requests": total,
+            "errors": errors,
+            "duration": duration,
+            "throughput": total / duration if duration else None,
+            "latency": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None}}
+
+
+def compare(result, baseline, tolerance):
+    """Find regressions against baseline results.
+
+    :returns: list of str descriptions of regressions
+    """
+    regressions = []
+    checks = [("p95 latency", result["latency"]["p95"],
+               baseline["latency"]["p95"], 1),
+              ("throughput", result["throughput"],
+               baseline["throughput"], -1)]
+    for name, value, base, sign in checks:
+        if value is None or not base:
+            continue
+        change = (value - base) / base * sign
+        if change > tolerance:
+            regressions.append("{} is worse by {:.1%}: {:.4f} vs {:.4f}"
+                               .format(name, change, value, base))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark of notification API.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                        help="file with JSON payload per line")
+    parser.add_argument("--url", help="service URL, in-process Flask "
+                                      "test client is used if not set")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="number of requests sent before measurement")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--fanout", type=int, default=1,
+                        help="number of backends per request")
+    parser.add_argument("--workers", type=int,
+                        help="dispatch workers of in-process service")
+    parser.add_argument("--driver", default="dummy_sleep",
+                        choices=["dummy_sleep", "mail", "sfdc"])
+    parser.add_argument("--server",
+                        help="host:port of running fake server for mail or "
+                             "sfdc driver, started in-process if not set")
+    parser.add_argument("--pool-size", type=int,
+                        help="connection pool size of mail or sfdc driver")
+    parser.add_argument("--distribution", default="constant",
+                        choices=["constant", "uniform", "normal",
+                                 "lognormal", "exponential"],
+                        help="distribution of dummy_sleep driver latency")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="mean (median for lognormal) driver or fake "
+                             "server latency")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--probability", type=float, default=1.0,
+                        help="probability of successful delivery")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of fake server failure")
+    parser.add_argument("--rate-limit", type=float,
+                        help="max messages or requests per second of fake "
+                             "server")
+    parser.add_argument("--compact", action="store_true",
+                        help="request compact responses")
+    parser.add_argument("--json-codec", choices=["json", "ujson", "orjson"],
+                        help="JSON codec of in-process service")
+    parser.add_argument("--trace-malloc", action="store_true",
+                        help="trace memory allocations (in-process only)")
+    parser.add_argument("--output", help="file to save JSON results to")
+    parser.add_argument("--compare", help="file with baseline results")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--print-config", action="store_true",
+                        help="print service configuration and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    if args.driver == "dummy_sleep":
+        address = None
+    elif args.server:
+        host, _, port = args.server.rpartition(":")
+        address = (host, int(port))
+    elif args.print_config or args.url:
+        sys.stderr.write("--server is required for service out of "
+                         "process\n")
+        return 2
+    else:
+        server = start_server(args)
+        address = server.server_address[:2]
+    conf = make_config(args, address)
+    if args.print_config:
+        print(json.dumps(conf, indent=2))
+        return 0
+
+    if args.url:
+        send = make_http_sender(args.url)
+    else:
+        send = make_inproc_sender(conf, args.json_codec)
+    path = "/api/v1/notify/{}".format(",".join(sorted(conf["notify_backends"])))
+    if args.compact:
+        path += "?compact=1"
+    payloads = load_corpus(args.corpus)
+
+    if args.warmup:
+        run(send, path, payloads, args.warmup, args.concurrency)
+
+    trace = args.trace_malloc and not args.url and tracemalloc
+    if trace:
+        tracemalloc.start()
+    latencies, errors, duration = run(send, path, payloads, args.requests,
+                                      args.concurrency)
+    result = summarize(latencies, errors, duration)
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+        tracemalloc.stop()
+        result["memory"] = {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"where": str(stat.traceback), "bytes": stat.size,
+                     "count": stat.count} for stat in top]}
+
+    if server:
+        server.stop()
+        result["server"] = server.stats
+
+    result.update(timestamp=datetime.datetime.utcnow().isoformat(),
+                  mode="http" if args.url else "inproc",
+                  params=dict((key, value) for key, value in vars(args).items()
+                              if key not in ("output", "compare",
+                                             "print_config")))
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(result, json.load(baseline),
+                                  args.tolerance)
+        for regression in regressions:
+            sys.stderr.write("REGRESSION: {}\n".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
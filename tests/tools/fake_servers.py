@@ -0,0 +1,713 @@
+#!/usr/bin/env python
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Fake SMTP and SalesForce servers for offline load testing of drivers.
+
+Both servers are threaded, keep connections alive, and simulate latency,
+random failures and rate limits, so that connection pooling, timeouts and
+concurrency of real mail and sfdc drivers can be measured.
+
+SMTP server accepts any sender, rejects recipients whose local part
+contains "reject", and supports AUTH PLAIN/LOGIN and PIPELINING:
+
+  $ python tests/tools/fake_servers.py smtp --port 2525 --latency 0.05
+
+SalesForce server implements REST and SOAP authentication, Case and
+FeedItem sObjects with unique Alert_ID__c (DUPLICATE_VALUE error), and
+expiration of access tokens (INVALID_SESSION_ID error):
+
+  $ python tests/tools/fake_servers.py sfdc --port 8443 --token-ttl 60
+
+Use http://127.0.0.1:8443 as auth_url of sfdc driver and any credentials
+unless they are set with --username, --password, etc.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from xml.dom import minidom
+from xml.sax import saxutils
+
+try:
+    import socketserver
+    from http import server as http_server
+    from urllib import parse
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+    import urlparse as parse
+
+
+class Behavior(object):
+    """Latency, random failures and rate limit of fake server."""
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, rate_limit=None):
+        """Init behavior.
+
+        :param latency: mean seconds of simulated processing
+        :param jitter: latency is uniform within latency +- jitter
+        :param error_rate: probability of simulated failure
+        :param rate_limit: max number of operations per second (with
+                           burst of the same size) or None for no limit
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        latency = random.uniform(self.latency - self.jitter,
+                                 self.latency + self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def fail(self):
+        return random.random() < self.error_rate
+
+    def throttle(self):
+        """Take one operation from rate limit.
+
+        :returns: True if operation is over the limit
+        """
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.rate_limit,
+                self._tokens + (now - self._updated_at) * self.rate_limit)
+            self._updated_at = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+
+class _Server(object):
+    """Mixin which runs server in background thread and counts stats."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def _init_stats(self, behavior):
+        self.behavior = behavior or Behavior()
+        self.stats = dict((key, 0) for key in self.STATS)
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        """Start serving in daemon thread.
+
+        :returns: self
+        """
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={"poll_interval": 0.05},
+                                        name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal ESMTP session, see RFC 5321."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    def readline(self):
+        line = self.rfile.readline(65536)
+        if not line:
+            raise EOFError()
+        return line.decode("utf-8", "replace").rstrip("\r\n")
+
+    def handle(self):
+        server = self.server
+        server.count("connections")
+        server.behavior.delay()
+        self.reply("220 fake.smtp ESMTP ready")
+        self.sender = None
+        self.recipients = []
+        try:
+            while True:
+                line = self.readline()
+                verb, _, arg = line.partition(" ")
+                method = getattr(self, "smtp_" + verb.upper(), None)
+                if not method:
+                    self.reply("500 5.5.2 Command not recognized")
+                elif method(arg) is False:
+                    return
+        except (EOFError, IOError, OSError):
+            return
+
+    def smtp_EHLO(self, arg):
+        self.reply("250-fake.smtp")
+        self.reply("250-PIPELINING")
+        self.reply("250-8BITMIME")
+        self.reply("250 AUTH PLAIN LOGIN")
+
+    def smtp_HELO(self, arg):
+        self.reply("250 fake.smtp")
+
+    def smtp_AUTH(self, arg):
+        mechanism, _, initial = arg.partition(" ")
+        if mechanism.upper() == "PLAIN":
+            if not initial:
+                self.reply("334 ")
+                initial = self.readline()
+            _, user, password = (
+                base64.b64decode(initial).decode("utf-8").split("\0"))
+        elif mechanism.upper() == "LOGIN":
+            self.reply("334 VXNlcm5hbWU6")
+            user = base64.b64decode(self.readline()).decode("utf-8")
+            self.reply("334 UGFzc3dvcmQ6")
+            password = base64.b64decode(self.readline()).decode("utf-8")
+        else:
+            self.reply("504 5.5.4 Unrecognized authentication type")
+            return
+        if self.server.user and (user, password) != (self.server.user,
+                                                     self.server.password):
+            self.reply("535 5.7.8 Authentication credentials invalid")
+        else:
+            self.reply("235 2.7.0 Authentication successful")
+
+    def smtp_MAIL(self, arg):
+        if self.server.behavior.throttle():
+            self.server.count("throttled")
+            self.reply("421 4.7.0 Too many messages, closing connection")
+            return False
+        self.sender = arg
+        self.recipients = []
+        self.reply("250 2.1.0 OK")
+
+    def smtp_RCPT(self, arg):
+        if self.sender is None:
+            self.reply("503 5.5.1 Need MAIL command")
+        elif "reject" in arg.split("@")[0].lower():
+            self.server.count("rejected_recipients")
+            self.reply("550 5.1.1 User unknown")
+        else:
+            self.recipients.append(arg.split(":", 1)[-1].strip().strip("<>"))
+            self.reply("250 2.1.5 OK")
+
+    def smtp_DATA(self, arg):
+        if not self.recipients:
+            self.reply("503 5.5.1 Need RCPT command")
+            return
+        self.reply("354 End data with <CR><LF>.<CR><LF>")
+        lines = []
+        while True:
+            line = self.readline()
+            if line == ".":
+                break
+            lines.append(line[1:] if line.startswith(".") else line)
+
+        self.server.behavior.delay()
+        if self.server.behavior.fail():
+            self.server.count("failed")
+            self.reply("451 4.3.0 Simulated failure")
+        else:
+            self.server.add_message(self.recipients, "\n".join(lines))
+            self.reply("250 2.0.0 OK queued")
+        self.sender = None
+        self.recipients = []
+
+    def smtp_RSET(self, arg):
+        self.sender = None
+        self.recipients = []
+        self.reply("250 2.0.0 OK")
+
+    def smtp_NOOP(self, arg):
+        self.reply("250 2.0.0 OK")
+
+    def smtp_QUIT(self, arg):
+        self.reply("221 2.0.0 Bye")
+        return False
+
+
+class FakeSMTPServer(_Server, socketserver.ThreadingTCPServer):
+    """Threaded SMTP server which keeps received messages in memory."""
+
+    STATS = ("connections", "messages", "failed", "throttled",
+             "rejected_recipients")
+
+    def __init__(self, host="127.0.0.1", port=0, behavior=None, user=None,
+                 password=None, keep=1000):
+        """Init server.
+
+        :param behavior: Behavior, its latency is applied on connection
+                         and on each message, error rate and rate limit
+                         apply to messages
+        :param user: if set, only these credentials are accepted
+        :param keep: number of the most recent messages kept in memory
+        """
+        socketserver.ThreadingTCPServer.__init__(self, (host, port),
+                                                 SMTPHandler)
+        self._init_stats(behavior)
+        self.user = user
+        self.password = password
+        self.keep = keep
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_message(self, recipients, data):
+        with self._stats_lock:
+            self.stats["messages"] += 1
+            self.messages.append((recipients, data))
+            del self.messages[:-self.keep]
+
+
+def _error(code, error_code, message):
+    return code, [{"errorCode": error_code, "message": message}]
+
+
+NOT_FOUND = _error(404, "NOT_FOUND", "The requested resource does not exist")
+
+REFERENCE_RE = re.compile(r"@\{(\w+)\.(\w+)\}")
+
+
+class SFDCHandler(http_server.BaseHTTPRequestHandler):
+    """SalesForce REST API subset used by sfdc driver."""
+
+    protocol_version = "HTTP/1.1"
+
+    DATA_PATH_RE = re.compile(r"^/services/data/v\d+\.\d/(.*)$")
+
+    MAX_GRAPH_NODES = 500
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http_server.BaseHTTPRequestHandler.log_message(self, format,
+                                                           *args)
+
+    def setup(self):
+        http_server.BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def respond(self, code, body=None, content_type="application/json"):
+        if body is None:
+            data = b""
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        if data:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode("utf-8")
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def dispatch(self, method):
+        server = self.server
+        server.count("requests")
+        body = self.read_body()
+        server.behavior.delay()
+        if server.behavior.throttle():
+            server.count("throttled")
+            return self.respond(*_error(403, "REQUEST_LIMIT_EXCEEDED",
+                                        "TotalRequests Limit exceeded."))
+        if server.behavior.fail():
+            server.count("failed")
+            return self.respond(*_error(503, "SERVER_UNAVAILABLE",
+                                        "Simulated failure"))
+
+        path = self.path.split("?")[0]
+        if method == "POST" and path == "/services/oauth2/token":
+            return self.auth_rest(body)
+        if method == "POST" and path == "/services/Soap/u/36.0":
+            return self.auth_soap(body)
+        match = self.DATA_PATH_RE.match(path)
+        if not match:
+            return self.respond(*NOT_FOUND)
+
+        auth = self.headers.get("Authorization", "")
+        if not server.check_token(auth.replace("Bearer ", "", 1)):
+            server.count("invalid_sessions")
+            return self.respond(*_error(401, "INVALID_SESSION_ID",
+                                        "Session expired or invalid"))
+
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return self.respond(*_error(400, "JSON_PARSER_ERROR",
+                                        "Invalid JSON"))
+        if method == "POST" and match.group(1) == "composite/graph":
+            return self.respond(*self.composite_graph(data))
+        self.respond(*self.call(method, match.group(1), data))
+
+    def call(self, method, resource, data):
+        """Call sObject resource.
+
+        :param resource: path relative to API version, like sobjects/Case
+        :returns: tuple (HTTP code, response body)
+        """
+        prefix, _, path = resource.partition("/")
+        sobject, _, object_id = path.partition("/")
+        handler = getattr(self, "{}_{}".format(method.lower(), sobject),
+                          None)
+        if prefix != "sobjects" or not handler:
+            return NOT_FOUND
+        return handler(parse.unquote(object_id), data)
+
+    def composite_graph(self, data):
+        """Process graphs one by one, see Composite Graph API.
+
+        Subrequests of failed graph after the failed one are not
+        processed, but unlike real API, preceding ones are not rolled
+        back.
+        """
+        graphs = data.get("graphs") or []
+        nodes = sum(len(graph.get("compositeRequest", []))
+                    for graph in graphs)
+        if nodes > self.MAX_GRAPH_NODES:
+            return _error(400, "INVALID_REQUEST",
+                          "Graph exceeds the node limit")
+        self.server.count("composite_nodes", nodes)
+        results = []
+        for graph in graphs:
+            refs = {}
+            responses = []
+            successful = True
+            for request in graph.get("compositeRequest", []):
+                if successful:
+                    body = _resolve(request.get("body") or {}, refs)
+                    match = self.DATA_PATH_RE.match(request["url"])
+                    code, body = (match and self.call(
+                        request["method"], match.group(1), body) or
+                        NOT_FOUND)
+                    successful = code < 300
+                    refs[request["referenceId"]] = body
+                else:
+                    code, body = _error(
+                        400, "PROCESSING_HALTED", "Invalid reference "
+                        "specified. No value for {} found".format(
+                            request["referenceId"]))
+                responses.append({"body": body, "httpHeaders": {},
+                                  "httpStatusCode": code,
+                                  "referenceId": request["referenceId"]})
+            results.append({"graphId": graph.get("graphId"),
+                            "isSuccessful": successful,
+                            "graphResponse": {
+                                "compositeResponse": responses}})
+        return 200, {"graphs": results}
+
+    def auth_rest(self, body):
+        form = dict((key, values[0])
+                    for key, values in parse.parse_qs(body).items())
+        if not self.server.check_credentials(
+                form, ("username", "password", "client_id",
+                       "client_secret")):
+            return self.respond(400, {
+                "error": "invalid_grant",
+                "error_description": "authentication failure"})
+        self.respond(200, {"access_token": self.server.new_token(),
+                           "instance_url": self.server.url,
+                           "id": "{}/id/00D/005".format(self.server.url),
+                           "token_type": "Bearer",
+                           "issued_at": str(int(time.time() * 1000)),
+                           "signature": "fake"})
+
+    def auth_soap(self, body):
+        doc = minidom.parseString(body)
+        creds = {}
+        for name in ("username", "password", "organizationId"):
+            elements = doc.getElementsByTagName("urn:" + name)
+            if elements and elements[0].firstChild:
+                creds[name] = elements[0].firstChild.nodeValue
+        if not self.server.check_credentials(
+                creds, ("username", "password", "organizationId")):
+            return self.respond(
+                500, SOAP_FAULT.encode("utf-8"), "text/xml; charset=utf-8")
+        body = SOAP_LOGIN.format(
+            session_id=saxutils.escape(self.server.new_token()),
+            url=saxutils.escape(self.server.url))
+        self.respond(200, body.encode("utf-8"), "text/xml; charset=utf-8")
+
+    def post_Case(self, object_id, data):
+        if object_id:
+            return _error(405, "METHOD_NOT_ALLOWED",
+                          "HTTP Method 'POST' not allowed")
+        case_id, created = self.server.create_case(data)
+        if not created:
+            return _error(
+                400, "DUPLICATE_VALUE",
+                "duplicate value found: Alert_ID__c duplicates value on "
+                "record with id: {}".format(case_id))
+        return 201, {"id": case_id, "success": True, "errors": []}
+
+    def get_Case(self, object_id, data):
+        case = self.server.get_case(object_id)
+        if case is None:
+            return NOT_FOUND
+        return 200, case
+
+    def patch_Case(self, object_id, data):
+        field, _, value = object_id.partition("/")
+        if field == "Alert_ID__c" and value:
+            if "Alert_ID__c" in data:
+                return _error(400, "INVALID_FIELD",
+                              "External ID field is in the URL")
+            case_id, created = self.server.create_case(
+                dict(data, Alert_ID__c=value), upsert=True)
+            return (201 if created else 200), {
+                "id": case_id, "success": True, "errors": [],
+                "created": created}
+        if not self.server.update_case(object_id, data):
+            return NOT_FOUND
+        return 204, None
+
+    def post_FeedItem(self, object_id, data):
+        item_id = self.server.create_feeditem(data)
+        if not item_id:
+            return _error(400, "INVALID_CROSS_REFERENCE_KEY",
+                          "invalid cross reference id")
+        return 201, {"id": item_id, "success": True, "errors": []}
+
+
+def _resolve(value, refs):
+    """Substitute @{referenceId.field} references of composite request."""
+    if isinstance(value, dict):
+        return dict((key, _resolve(item, refs))
+                    for key, item in value.items())
+    if isinstance(value, list):
+        return [_resolve(item, refs) for item in value]
+    if isinstance(value, str):
+        return REFERENCE_RE.sub(
+            lambda m: str((refs.get(m.group(1)) or {}).get(m.group(2))),
+            value)
+    return value
+
+SOAP_LOGIN = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+ xmlns="urn:partner.soap.sforce.com"><soapenv:Body><loginResponse><result>
+<serverUrl>{url}/services/Soap/u/36.0</serverUrl>
+<sessionId>{session_id}</sessionId>
+</result></loginResponse></soapenv:Body></soapenv:Envelope>"""
+
+SOAP_FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body><soapenv:Fault><faultcode>INVALID_LOGIN</faultcode>
+<faultstring>INVALID_LOGIN: Invalid username, password, security token; or
+user locked out.</faultstring></soapenv:Fault></soapenv:Body>
+</soapenv:Envelope>"""
+
+
+class FakeSFDCServer(_Server, socketserver.ThreadingMixIn,
+                     http_server.HTTPServer):
+    """Threaded SalesForce server which keeps sObjects in memory."""
+
+    STATS = ("connections", "requests", "composite_nodes", "auths",
+             "invalid_sessions", "failed", "throttled", "cases",
+             "feeditems")
+
+    def __init__(self, host="127.0.0.1", port=0, behavior=None,
+                 token_ttl=None, credentials=None, verbose=False):
+        """Init server.
+
+        :param behavior: Behavior applied to every request
+        :param token_ttl: seconds after which access tokens are rejected
+                          with INVALID_SESSION_ID, tokens never expire if
+                          it is None
+        :param credentials: dict of expected username, password,
+                            client_id, client_secret and organizationId,
+                            missing ones are not checked
+        """
+        http_server.HTTPServer.__init__(self, (host, port), SFDCHandler)
+        self._init_stats(behavior)
+        self.token_ttl = token_ttl
+        self.credentials = credentials or {}
+        self.verbose = verbose
+        self.tokens = {}
+        self.cases = {}
+        self.feeditems = {}
+        self._alert_ids = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def check_credentials(self, creds, keys):
+        """Check given credentials against expected ones.
+
+        :param creds: dict of credentials sent by client
+        :param keys: names of credentials used by authentication method
+        """
+        return all(creds.get(key) == self.credentials[key]
+                   for key in keys if key in self.credentials)
+
+    def new_token(self):
+        token = "00D!fake.{:016x}".format(random.getrandbits(64))
+        with self._lock:
+            self.tokens[token] = time.time()
+        self.count("auths")
+        return token
+
+    def check_token(self, token):
+        with self._lock:
+            issued_at = self.tokens.get(token)
+        if issued_at is None:
+            return False
+        return not self.token_ttl or time.time() - issued_at < self.token_ttl
+
+    def expire_tokens(self):
+        """Make all issued access tokens invalid."""
+        with self._lock:
+            self.tokens.clear()
+
+    def _new_id(self, prefix):
+        return "{}{:015d}".format(prefix, next(self._ids))
+
+    def create_case(self, data, upsert=False):
+        """Create Case unless its Alert_ID__c is already used.
+
+        :param upsert: whether to update existing Case with the same
+                       Alert_ID__c
+        :returns: tuple (case id, whether it has been created)
+        """
+        alert_id = data.get("Alert_ID__c")
+        with self._lock:
+            if alert_id and alert_id in self._alert_ids:
+                case_id = self._alert_ids[alert_id]
+                if upsert:
+                    self.cases[case_id].update(data)
+                return case_id, False
+            case_id = self._new_id("500")
+            self.cases[case_id] = dict(data, Id=case_id,
+                                       Status=data.get("Status", "New"))
+            if alert_id:
+                self._alert_ids[alert_id] = case_id
+        self.count("cases")
+        return case_id, True
+
+    def get_case(self, case_id):
+        with self._lock:
+            case = self.cases.get(case_id)
+            return dict(case) if case else None
+
+    def update_case(self, case_id, data):
+        with self._lock:
+            if case_id not in self.cases:
+                return False
+            self.cases[case_id].update(data)
+            return True
+
+    def delete_case(self, case_id):
+        """Delete Case, like it is done by SalesForce user."""
+        with self._lock:
+            case = self.cases.pop(case_id)
+            self._alert_ids.pop(case.get("Alert_ID__c"), None)
+
+    def create_feeditem(self, data):
+        """Create FeedItem of existing Case.
+
+        :returns: id of FeedItem or None if parent does not exist
+        """
+        with self._lock:
+            if data.get("ParentId") not in self.cases:
+                return None
+            item_id = self._new_id("0D5")
+            self.feeditems[item_id] = dict(data, Id=item_id)
+        self.count("feeditems")
+        return item_id
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fake SMTP or SalesForce server.")
+    parser.add_argument("kind", choices=["smtp", "sfdc"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="mean seconds of processing")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of simulated failure")
+    parser.add_argument("--rate-limit", type=float,
+                        help="max number of messages or requests per second")
+    parser.add_argument("--token-ttl", type=float,
+                        help="seconds after which SFDC tokens expire")
+    for name in ("username", "password", "client-id", "client-secret"):
+        parser.add_argument("--" + name, help="expected credentials")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    behavior = Behavior(latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate,
+                        rate_limit=args.rate_limit)
+    if args.kind == "smtp":
+        server = FakeSMTPServer(args.host, args.port, behavior,
+                                user=args.username, password=args.password)
+    else:
+        creds = dict((key, value) for key, value in (
+            ("username", args.username), ("password", args.password),
+            ("client_id", args.client_id),
+            ("client_secret", args.client_secret)) if value)
+        server = FakeSFDCServer(args.host, args.port, behavior,
+                                token_ttl=args.token_ttl, credentials=creds,
+                                verbose=args.verbose)
+    sys.stderr.write("Fake {} server is listening on {}:{}\n".format(
+        args.kind, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stderr.write("Stats: {}\n".format(json.dumps(server.stats)))
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,16 +13,26 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from concurrent import futures
+import io
 import json
+import threading
 
 import mock
 
+from notify.api.v1 import api
+from notify import config
 from notify import driver
+from notify import registry
 from tests.unit import test
 
 
 class ApiTestCase(test.TestCase):
 
+    def setUp(self):
+        super(ApiTestCase, self).setUp()
+        mock.patch.object(api, "CACHE", registry.Registry()).start()
+
     def test_send_notification_request_without_data(self):
         code, resp = self.post("/api/v1/notify/foo")
         self.assertEqual(400, code)
@@ -54,7 +64,8 @@ class ApiTestCase(test.TestCase):
 
         self.assertEqual(200, code)
         expected = {"payload": self.payload,
-                    "total": 2, "errors": 0, "failed": 0, "passed": 2,
+                    "total": 2, "errors": 0, "failed": 0, "throttled": 0,
+                    "passed": 2,
                     "result": {"backend1": {"drvname": {"status": True}},
                                "backend2": {"drvname": {"status": True}}}}
         self.assertEqual(expected, resp)
@@ -70,7 +81,8 @@ class ApiTestCase(test.TestCase):
         self.assertEqual(200, code)
         expected = {
             "payload": self.payload,
-            "total": 1, "errors": 1, "failed": 0, "passed": 0,
+            "total": 1, "errors": 1, "failed": 0, "throttled": 0,
+            "passed": 0,
             "result": {"b1": {"foo": {"error": "Something has went wrong!"}}}}
         self.assertEqual(expected, resp)
 
@@ -86,6 +98,688 @@ class ApiTestCase(test.TestCase):
                                data=json.dumps(self.payload))
         self.assertEqual(200, code)
         expected = {"payload": self.payload,
-                    "total": 1, "errors": 1, "failed": 0, "passed": 0,
+                    "total": 1, "errors": 1, "failed": 0, "throttled": 0,
+                    "passed": 0,
                     "result": {"b1": {"bar": {"error": "Spam!"}}}}
         self.assertEqual(expected, resp)
+
+    @mock.patch("notify.api.v1.api.executor.get_settings")
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_timed_out(self, mock_get_driver, mock_config,
+                                         mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"slow": {"x": 1}},
+                                "b2": {"fast": {"x": 2}}}}
+        mock_get_settings.return_value = {"workers": 2,
+                                          "driver_timeout": 0.05,
+                                          "request_timeout": 5}
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def get_driver(name, conf):
+            drv = mock.Mock()
+            if name == "slow":
+                drv.notify.side_effect = lambda payload: release.wait(5)
+            else:
+                drv.notify.return_value = True
+            return drv
+
+        mock_get_driver.side_effect = get_driver
+        code, resp = self.post("/api/v1/notify/b1,b2",
+                               data=json.dumps(self.payload))
+        self.assertEqual(200, code)
+        expected = {"payload": self.payload,
+                    "total": 2, "errors": 1, "failed": 0, "throttled": 0,
+                    "passed": 1,
+                    "result": {"b1": {"slow": {"error":
+                                               "Driver has timed out"}},
+                               "b2": {"fast": {"status": True}}}}
+        self.assertEqual(expected, resp)
+
+    @mock.patch("notify.api.v1.api.get_job_queue")
+    @mock.patch("notify.api.v1.api.config")
+    def test_send_notification_async(self, mock_config, mock_get_job_queue):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {}, "b2": {}}}
+        mock_get_job_queue.return_value.put.return_value = "job_id"
+        code, resp = self.post("/api/v1/notify/b2,b1?async=1",
+                               data=json.dumps(self.payload))
+        self.assertEqual(202, code)
+        self.assertEqual({"job": "job_id"}, resp)
+        mock_get_job_queue.return_value.put.assert_called_once_with(
+            ["b1", "b2"], self.payload)
+
+        mock_get_job_queue.return_value = None
+        code, resp = self.post("/api/v1/notify/b1?async=true",
+                               data=json.dumps(self.payload))
+        self.assertEqual(400, code)
+        self.assertEqual({"error": "Async mode is disabled"}, resp)
+
+    @mock.patch("notify.api.v1.api.get_job_queue")
+    def test_get_job(self, mock_get_job_queue):
+        job = {"id": "foo", "status": "done", "result": {"total": 0}}
+        mock_get_job_queue.return_value.get.return_value = job
+        self.assertEqual((200, job), self.get("/api/v1/jobs/foo"))
+        mock_get_job_queue.return_value.get.assert_called_once_with("foo")
+
+        mock_get_job_queue.return_value.get.return_value = None
+        self.assertEqual((404, {"error": "Job not found"}),
+                         self.get("/api/v1/jobs/foo"))
+
+        mock_get_job_queue.return_value = None
+        self.assertEqual((404, {"error": "Job not found"}),
+                         self.get("/api/v1/jobs/foo"))
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.api.v1.api.jobs.JobQueue")
+    def test_get_job_queue(self, mock_job_queue, mock_config):
+        mock_config.get_config.return_value = {}
+        with mock.patch.object(api, "JOBS", None):
+            self.assertIsNone(api.get_job_queue())
+
+            mock_config.get_config.return_value = {
+                "jobs": {"path": "/foo/jobs.sqlite"}}
+            self.assertEqual(mock_job_queue.return_value, api.get_job_queue())
+            self.assertEqual(mock_job_queue.return_value, api.get_job_queue())
+        mock_job_queue.assert_called_once_with(
+            "/foo/jobs.sqlite", api._deliver_later, workers=2)
+        mock_job_queue.return_value.start.assert_called_once_with()
+
+    @mock.patch("notify.api.v1.api.deliver")
+    @mock.patch("notify.api.v1.api.config")
+    def test__deliver_later(self, mock_config, mock_deliver):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {}}}}
+        self.assertEqual(mock_deliver.return_value,
+                         api._deliver_later(["b1"], self.payload))
+        mock_deliver.assert_called_once_with(["b1"], self.payload,
+                                             {"b1": {"foo": {}}})
+        self.assertEqual({"error": "Unexpected backends: b2"},
+                         api._deliver_later(["b1", "b2"], self.payload))
+
+    @mock.patch("notify.api.v1.api.config")
+    def test_send_batch_notification_bad_request(self, mock_config):
+        mock_config.get_config.return_value = {"notify_backends": {"b1": {}}}
+        url = "/api/v1/notify/b1/batch"
+
+        code, resp = self.post("/api/v1/notify/foo/batch", data="[]")
+        self.assertEqual(400, code)
+        self.assertEqual({"error": "Unexpected backends: foo"}, resp)
+
+        code, resp = self.post(url, data="")
+        self.assertEqual((400, {"error": "Missed Payload"}), (code, resp))
+
+        code, resp = self.post(url, data="[{]")
+        self.assertEqual(400, code)
+        self.assertIn("Bad Batch:", resp["error"])
+
+        code, resp = self.post(url, data="{}\n{")
+        self.assertEqual(400, code)
+        self.assertIn("Bad Batch:", resp["error"])
+
+        code, resp = self.post(url, data=json.dumps([{}] * 1001))
+        self.assertEqual(400, code)
+        self.assertEqual({"error": "Batch is too large: 1001 > 1000"}, resp)
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_batch_notification(self, mock_get_driver, mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"batchdrv": {"x": 1}},
+                                "b2": {"batchdrv": {"x": 2}}}}
+        statuses = {1: [True, driver.ExplainedError("Spam!")],
+                    2: [False, ValueError()]}
+
+        def get_driver(name, conf):
+            drv = mock.Mock()
+            drv.notify_many.return_value = statuses[conf["x"]]
+            return drv
+
+        mock_get_driver.side_effect = get_driver
+        data = "\n".join(json.dumps(p) for p in
+                         (self.payload, {"region": "foo"}, self.payload))
+        code, resp = self.post("/api/v1/notify/b1,b2/batch", data=data)
+
+        self.assertEqual(200, code)
+        bad_item = resp["items"].pop(1)
+        self.assertIn("Bad Payload:", bad_item["error"])
+        expected = {
+            "total": 4, "passed": 1, "failed": 1, "errors": 2, "throttled": 0,
+            "items": [
+                {"total": 2, "passed": 1, "failed": 1, "errors": 0,
+                 "throttled": 0,
+                 "result": {"b1": {"batchdrv": {"status": True}},
+                            "b2": {"batchdrv": {"status": False}}}},
+                {"total": 2, "passed": 0, "failed": 0, "errors": 2,
+                 "throttled": 0,
+                 "result": {"b1": {"batchdrv": {"error": "Spam!"}},
+                            "b2": {"batchdrv": {
+                                "error": "Something has went wrong!"}}}}]}
+        self.assertEqual(expected, resp)
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_compact(self, mock_get_driver, mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {}}, "b2": {"bar": {}}}}
+        mock_get_driver.return_value.notify.return_value = True
+        data = json.dumps(self.payload)
+
+        for kwargs in ({"query_string": "compact=1"},
+                       {"headers": {"Prefer": "return=minimal"}}):
+            code, resp = self.post("/api/v1/notify/b1,b2", data=data,
+                                   **kwargs)
+            self.assertEqual(200, code)
+            self.assertEqual({"total": 2, "passed": 2, "failed": 0,
+                              "errors": 0, "throttled": 0}, resp)
+
+        mock_get_driver.return_value.notify.side_effect = [True, False]
+        code, resp = self.post("/api/v1/notify/b1,b2?compact=1", data=data)
+        self.assertEqual(200, code)
+        self.assertEqual(self.payload, resp["payload"])
+        self.assertEqual(2, len(resp["result"]))
+        self.assertEqual(1, resp["failed"])
+
+    def test__compact(self):
+        result = {"payload": self.payload, "result": {}, "total": 1,
+                  "passed": 1, "failed": 0, "errors": 0, "throttled": 0}
+        self.assertEqual({"total": 1, "passed": 1, "failed": 0,
+                          "errors": 0, "throttled": 0}, api._compact(result))
+        for counter in ("failed", "errors", "throttled"):
+            failed = dict(result, passed=0, **{counter: 1})
+            self.assertEqual(failed, api._compact(failed))
+        self.assertEqual({"error": "Missed Payload"},
+                         api._compact({"error": "Missed Payload"}))
+        self.assertEqual({"job": "42"}, api._compact({"job": "42"}))
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_batch_notification_compact(self, mock_get_driver,
+                                             mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {}}}}
+        mock_get_driver.return_value.notify_many.return_value = [True, False]
+        data = "\n".join([json.dumps(self.payload)] * 2)
+
+        code, resp = self.post("/api/v1/notify/b1/batch?compact=1",
+                               data=data)
+        self.assertEqual(200, code)
+        self.assertEqual([{"total": 1, "passed": 1, "failed": 0,
+                           "errors": 0, "throttled": 0},
+                          {"total": 1, "passed": 0, "failed": 1,
+                           "errors": 0, "throttled": 0,
+                           "result": {"b1": {"foo": {"status": False}}}}],
+                         resp["items"])
+
+    @mock.patch("notify.api.v1.api.config")
+    def test_send_stream_notification_no_backend(self, mock_config):
+        mock_config.get_config.return_value = {"notify_backends": {"b1": {}}}
+        code, resp = self.post("/api/v1/notify/foo/stream", data="{}")
+        self.assertEqual(400, code)
+        self.assertEqual({"error": "Unexpected backends: foo"}, resp)
+
+    @mock.patch("notify.api.v1.api.executor.get_settings")
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_stream_notification(self, mock_get_driver, mock_config,
+                                      mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        mock_get_settings.return_value = {
+            "workers": 4, "driver_timeout": 10, "request_timeout": 10,
+            "stream_in_flight": 2, "max_line_size": 1000}
+        mock_get_driver.return_value.notify.side_effect = [True, False, True]
+        lines = [json.dumps(self.payload), "", "{", json.dumps({"foo": 1}),
+                 json.dumps(dict(self.payload, description="x" * 1000)),
+                 json.dumps(self.payload), json.dumps(self.payload)]
+
+        rv = self.client.post("/api/v1/notify/b1/stream",
+                              data="\n".join(lines))
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual("application/x-ndjson", rv.mimetype)
+        items = [json.loads(line) for line in rv.data.decode().splitlines()]
+
+        self.assertEqual([1, 3, 4, 5, 6, 7],
+                         [item.get("line") for item in items[:-1]])
+        self.assertEqual({"line": 1, "total": 1, "passed": 1, "failed": 0,
+                          "errors": 0, "throttled": 0,
+                          "result": {"b1": {"foo": {"status": True}}}},
+                         items[0])
+        self.assertIn("Bad Payload:", items[1]["error"])
+        self.assertIn("Bad Payload:", items[2]["error"])
+        self.assertEqual({"line": 5, "error": "Line is too long"}, items[3])
+        self.assertEqual([False, True],
+                         [item["result"]["b1"]["foo"]["status"]
+                          for item in items[4:6]])
+        self.assertEqual({"lines": 7, "rejected": 3, "total": 3,
+                          "passed": 2, "failed": 1, "errors": 0,
+                          "throttled": 0}, items[-1])
+
+    def test__read_lines(self):
+        stream = io.BytesIO(b"foo\nbarbaz\n\nqux\nlonger_line\nend")
+        self.assertEqual([b"foo\n", None, b"\n", b"qux\n", None, b"end"],
+                         list(api._read_lines(stream, 5)))
+
+    @mock.patch("notify.api.v1.api.executor.get_settings")
+    @mock.patch("notify.api.v1.api.executor.get_stream_executor")
+    def test__stream_backpressure(self, mock_get_stream_executor,
+                                  mock_get_settings):
+        mock_get_settings.return_value = {"stream_in_flight": 2}
+        futures = [mock.Mock(**{"done.return_value": False,
+                                "result.return_value": api._new_result()})
+                   for i in range(3)]
+        pool = mock_get_stream_executor.return_value
+        pool.submit.side_effect = futures
+        lines = iter([json.dumps(self.payload).encode()] * 3)
+
+        stream = api._stream({"b1"}, lines, {"b1": {}})
+        self.assertEqual(1, json.loads(next(stream).decode())["line"])
+        # Third line is read only after result of the first one is sent
+        self.assertEqual(2, pool.submit.call_count)
+        self.assertEqual(1, len(list(lines)))
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.api.v1.api.dedup.Coalescer")
+    def test_get_coalescer(self, mock_coalescer, mock_config):
+        mock_config.get_config.return_value = {}
+        with mock.patch.object(api, "COALESCER", None):
+            self.assertIsNone(api.get_coalescer())
+
+            mock_config.get_config.return_value = {"dedup": {"window": 30}}
+            self.assertEqual(mock_coalescer.return_value,
+                             api.get_coalescer())
+            self.assertEqual(mock_coalescer.return_value,
+                             api.get_coalescer())
+        mock_coalescer.assert_called_once_with(30, api._deliver_later)
+
+    @mock.patch("notify.api.v1.api.deliver")
+    @mock.patch("notify.api.v1.api.get_coalescer")
+    @mock.patch("notify.api.v1.api.config")
+    def test_send_notification_deduplicated(self, mock_config,
+                                            mock_get_coalescer, mock_deliver):
+        mock_config.get_config.return_value = {"notify_backends": {"b1": {}}}
+        mock_deliver.return_value = {"passed": 1}
+        mock_get_coalescer.return_value.add.return_value = 0
+        code, resp = self.post("/api/v1/notify/b1",
+                               data=json.dumps(self.payload))
+        self.assertEqual((200, {"passed": 1}), (code, resp))
+
+        mock_get_coalescer.return_value.add.return_value = 3
+        code, resp = self.post("/api/v1/notify/b1",
+                               data=json.dumps(self.payload))
+        self.assertEqual(200, code)
+        self.assertEqual({"payload": self.payload, "deduplicated": 3,
+                          "result": {}, "total": 0, "passed": 0,
+                          "failed": 0, "errors": 0, "throttled": 0}, resp)
+        self.assertEqual(1, mock_deliver.call_count)
+        mock_get_coalescer.return_value.add.assert_called_with(
+            {"b1"}, self.payload)
+
+    @mock.patch("notify.api.v1.api.get_job_queue", return_value=None)
+    @mock.patch("notify.api.v1.api.get_coalescer")
+    @mock.patch("notify.api.v1.api.config")
+    def test_send_notification_async_disabled_not_deduplicated(
+            self, mock_config, mock_get_coalescer, mock_get_job_queue):
+        mock_config.get_config.return_value = {"notify_backends": {"b1": {}}}
+        code, resp = self.post("/api/v1/notify/b1?async=1",
+                               data=json.dumps(self.payload))
+        self.assertEqual((400, {"error": "Async mode is disabled"}),
+                         (code, resp))
+        self.assertFalse(mock_get_coalescer.return_value.add.called)
+
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.api.v1.api.ratelimit.Limiter")
+    def test_get_limiter(self, mock_limiter, mock_config):
+        mock_config.get_config.return_value = {}
+        with mock.patch.object(api, "LIMITER", None):
+            self.assertIsNone(api.get_limiter())
+
+            limits = {"b1": {"rate": 1}}
+            mock_config.get_config.return_value = {"rate_limits": limits}
+            self.assertEqual(mock_limiter.return_value, api.get_limiter())
+            self.assertEqual(mock_limiter.return_value, api.get_limiter())
+        mock_limiter.assert_called_once_with(limits, None)
+
+        mock_config.get_config.return_value = {
+            "rate_limits": limits, "rate_limit_store": {"path": "foo.db"}}
+        with mock.patch.object(api, "LIMITER", None):
+            api.get_limiter()
+        mock_limiter.assert_called_with(limits, "foo.db")
+
+    @mock.patch("notify.api.v1.api.get_limiter")
+    def test__notify_throttled(self, mock_get_limiter):
+        drv = mock.Mock()
+        drv.notify.return_value = True
+        limiter = mock_get_limiter.return_value
+        limiter.admit.return_value = "admitted"
+        self.assertEqual({"status": True},
+                         api._notify("b1", "foo", drv, None, self.payload))
+        drv.notify.assert_called_once_with("admitted")
+        limiter.admit.assert_called_once_with("b1", "foo", self.payload)
+
+        limiter.admit.return_value = None
+        self.assertEqual({"throttled": True},
+                         api._notify("b1", "foo", drv, None, self.payload))
+        self.assertEqual(1, drv.notify.call_count)
+
+    @mock.patch("notify.api.v1.api.get_limiter")
+    def test__notify_many_throttled(self, mock_get_limiter):
+        drv = mock.Mock()
+        drv.notify_many.return_value = [True, ValueError()]
+        mock_get_limiter.return_value.admit.side_effect = ["p1", None, "p3"]
+        self.assertEqual(
+            [{"status": True}, {"throttled": True},
+             {"error": "Something has went wrong!"}],
+            api._notify_many("b1", "foo", drv, None, ["x", "y", "z"]))
+        drv.notify_many.assert_called_once_with(["p1", "p3"])
+
+        mock_get_limiter.return_value.admit.side_effect = None
+        mock_get_limiter.return_value.admit.return_value = None
+        self.assertEqual([{"throttled": True}],
+                         api._notify_many("b1", "foo", drv, None, ["x"]))
+        self.assertEqual(1, drv.notify_many.call_count)
+
+    def test__merge_result(self):
+        result = api._new_result()
+        api._merge_result(result, "b1", "foo", {"throttled": True})
+        api._merge_result(result, "b1", "bar", {"status": False})
+        api._merge_result(result, "b2", "foo", {"status": True})
+        api._merge_result(result, "b2", "bar", {"error": "Spam!"})
+        self.assertEqual(
+            {"total": 4, "passed": 1, "failed": 1, "errors": 1,
+             "throttled": 1,
+             "result": {"b1": {"foo": {"throttled": True},
+                               "bar": {"status": False}},
+                        "b2": {"foo": {"status": True},
+                               "bar": {"error": "Spam!"}}}}, result)
+
+    @mock.patch("notify.api.v1.api.config")
+    def test__get_breaker(self, mock_config):
+        mock_config.get_config.return_value = {}
+        with mock.patch.object(api, "BREAKERS", {}):
+            self.assertIsNone(api._get_breaker("foo.hash"))
+            self.assertEqual({}, api.BREAKERS)
+
+            mock_config.get_config.return_value = {
+                "circuit_breaker": {"threshold": 2}}
+            circuit = api._get_breaker("foo.hash")
+            self.assertEqual(2, circuit.threshold)
+            self.assertIs(circuit, api._get_breaker("foo.hash"))
+            self.assertIsNot(circuit, api._get_breaker("bar.hash"))
+
+    def test__notify_with_circuit_breaker(self):
+        drv = mock.Mock()
+        circuit = mock.Mock()
+        circuit.allow.return_value = False
+        self.assertEqual(
+            {"error": "Driver is failing, circuit breaker is open"},
+            api._notify("b1", "foo", drv, circuit, self.payload))
+        self.assertFalse(drv.notify.called)
+        self.assertFalse(circuit.record.called)
+
+        circuit.allow.return_value = True
+        for status, success in ((True, True), (False, False),
+                                (ValueError(), False)):
+            drv.notify.side_effect = None
+            drv.notify.return_value = status
+            if isinstance(status, Exception):
+                drv.notify.side_effect = status
+            api._notify("b1", "foo", drv, circuit, self.payload)
+            circuit.record.assert_called_once_with(success)
+            circuit.record.reset_mock()
+
+    def test__notify_many_with_circuit_breaker(self):
+        drv = mock.Mock()
+        drv.notify_many.return_value = [True, False]
+        circuit = mock.Mock()
+        circuit.allow.return_value = True
+        self.assertEqual(
+            [{"status": True}, {"status": False}],
+            api._notify_many("b1", "foo", drv, circuit, ["x", "y"]))
+        self.assertEqual([mock.call(True), mock.call(False)],
+                         circuit.record.mock_calls)
+
+        circuit.reset_mock()
+        circuit.allow.return_value = False
+        error = {"error": "Driver is failing, circuit breaker is open"}
+        self.assertEqual(
+            [error, error],
+            api._notify_many("b1", "foo", drv, circuit, ["x", "y"]))
+        self.assertFalse(circuit.record.called)
+        self.assertEqual(1, drv.notify_many.call_count)
+
+    def test_get_breakers(self):
+        circuit = mock.Mock()
+        circuit.to_dict.return_value = {"state": "open", "failures": 5}
+        with mock.patch.object(api, "BREAKERS", {"foo.hash": circuit}):
+            self.assertEqual(
+                (200, {"breakers": {"foo.hash": {"state": "open",
+                                                 "failures": 5}}}),
+                self.get("/api/v1/breakers"))
+
+    @mock.patch("notify.api.v1.api.config")
+    def test_warm_up(self, mock_config):
+        mock_config.get_config.return_value = {"notify_backends": "foo"}
+        with mock.patch.object(api, "CACHE") as mock_cache:
+            api.warm_up()
+        mock_cache.warm_up.assert_called_once_with("foo")
+
+    def test__reload(self):
+        old = {"notify_backends": {"b1": {"foo": {}}},
+               "rate_limits": {"b1": {"rate": 1}}}
+        new = {"notify_backends": {"b1": {"foo": {}}, "b2": {"bar": {}}},
+               "rate_limits": {"b1": {"rate": 1}}}
+        mock_cache = mock.Mock()
+        mock_cache.warm_up.return_value = ["foo.hash", "bar.hash"]
+        breakers = {"foo.hash": "foo_cb", "old.hash": "old_cb"}
+        with mock.patch.multiple(api, CACHE=mock_cache, BREAKERS=breakers,
+                                 LIMITER="limiter"):
+            api._reload(old, new)
+            self.assertEqual("limiter", api.LIMITER)
+            self.assertEqual({"foo.hash": "foo_cb"}, api.BREAKERS)
+            mock_cache.warm_up.assert_called_once_with(new["notify_backends"])
+            mock_cache.prune.assert_called_once_with(["foo.hash", "bar.hash"])
+
+            new["rate_limit_store"] = {"path": "foo.db"}
+            api._reload(old, new)
+            self.assertIsNone(api.LIMITER)
+
+            api.LIMITER = "limiter"
+            new["rate_limits"] = {}
+            api._reload(old, new)
+            self.assertIsNone(api.LIMITER)
+
+    @mock.patch("notify.api.v1.api.retry.RetryStore")
+    @mock.patch("notify.api.v1.api.config")
+    def test_get_retry_store(self, mock_config, mock_store):
+        mock_config.get_config.return_value = {}
+        with mock.patch.object(api, "RETRIES", None):
+            self.assertIsNone(api.get_retry_store())
+
+            mock_config.get_config.return_value = {
+                "retry": {"path": "/foo/retry.sqlite", "max_attempts": 3}}
+            self.assertEqual(mock_store.return_value, api.get_retry_store())
+            self.assertEqual(mock_store.return_value, api.get_retry_store())
+        mock_store.assert_called_once_with(
+            "/foo/retry.sqlite", api._redeliver, max_attempts=3)
+        mock_store.return_value.start.assert_called_once_with()
+
+    @mock.patch("notify.api.v1.api.get_retry_store")
+    def test__notify_retries_failed(self, mock_get_retry_store):
+        store = mock_get_retry_store.return_value
+        drv = mock.Mock()
+        for status, expected in ((True, []),
+                                 (False, [mock.call("b1", "foo", "p", None)]),
+                                 (ValueError(), [mock.call(
+                                     "b1", "foo", "p",
+                                     "Something has went wrong!")])):
+            store.reset_mock()
+            drv.notify.side_effect = [status]
+            api._notify("b1", "foo", drv, None, "p")
+            self.assertEqual(expected, store.add.mock_calls)
+
+        store.reset_mock()
+        circuit = mock.Mock()
+        circuit.allow.return_value = False
+        api._notify("b1", "foo", drv, circuit, "p")
+        store.add.assert_called_once_with("b1", "foo", "p", api.CIRCUIT_OPEN)
+
+        store.reset_mock()
+        drv.notify_many.return_value = [True, False]
+        api._notify_many("b1", "foo", drv, None, ["p1", "p2"])
+        store.add.assert_called_once_with("b1", "foo", "p2", None)
+
+        mock_get_retry_store.return_value = None
+        drv.notify.side_effect = [False]
+        self.assertEqual({"status": False},
+                         api._notify("b1", "foo", drv, None, "p"))
+
+    @mock.patch("notify.api.v1.api.get_limiter", return_value=None)
+    @mock.patch("notify.api.v1.api.get_retry_store")
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test__redeliver(self, mock_get_driver, mock_config,
+                        mock_get_retry_store, mock_get_limiter):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        drv = mock_get_driver.return_value
+        drv.notify.side_effect = [True, False, ValueError()]
+        self.assertTrue(api._redeliver("b1", "foo", "p"))
+        self.assertFalse(api._redeliver("b1", "foo", "p"))
+        self.assertRaises(driver.ExplainedError,
+                          api._redeliver, "b1", "foo", "p")
+        self.assertRaises(driver.ExplainedError,
+                          api._redeliver, "b1", "bar", "p")
+        self.assertEqual([mock.call("p")] * 3, drv.notify.mock_calls)
+
+        mock_get_limiter.return_value = mock.Mock()
+        mock_get_limiter.return_value.admit.return_value = None
+        self.assertRaises(driver.ExplainedError,
+                          api._redeliver, "b1", "foo", "p")
+        self.assertEqual(3, drv.notify.call_count)
+        self.assertFalse(mock_get_retry_store.return_value.add.called)
+
+    @mock.patch("notify.api.v1.api.get_retry_store")
+    def test_get_retries(self, mock_get_retry_store):
+        store = mock_get_retry_store.return_value
+        store.stats.return_value = {"pending": 2, "dead": 1}
+        store.get_dead_letters.return_value = [{"driver": "foo"}]
+        self.assertEqual((200, {"pending": 2, "dead": 1,
+                                "dead_letters": [{"driver": "foo"}]}),
+                         self.get("/api/v1/retries"))
+
+        mock_get_retry_store.return_value = None
+        self.assertEqual((404, {"error": "Retries are disabled"}),
+                         self.get("/api/v1/retries"))
+
+    @mock.patch("notify.api.v1.api.metrics")
+    @mock.patch("notify.api.v1.api.get_limiter")
+    def test__notify_counts_outcomes(self, mock_get_limiter, mock_metrics):
+        mock_get_limiter.return_value = None
+        drv = mock.Mock()
+        drv.notify.side_effect = [True, False, ValueError(),
+                                  driver.ExplainedError()]
+        for i in range(4):
+            api._notify("b1", "foo", drv, None, "p")
+        circuit = mock.Mock()
+        circuit.allow.return_value = False
+        api._notify("b1", "foo", drv, circuit, "p")
+        mock_get_limiter.return_value = mock.Mock()
+        mock_get_limiter.return_value.admit.return_value = None
+        api._notify("b1", "foo", drv, None, "p")
+
+        self.assertEqual(
+            [mock.call(backend="b1", driver="foo", outcome=outcome)
+             for outcome in ("passed", "failed", "error", "explained_error",
+                             "circuit_open", "throttled")],
+            mock_metrics.DELIVERIES.inc.mock_calls)
+        self.assertEqual(
+            [mock.call(mock.ANY, backend="b1", driver="foo")] * 4,
+            mock_metrics.DELIVERY_DURATION.observe.mock_calls)
+
+    @mock.patch("notify.api.v1.api.metrics")
+    @mock.patch("notify.api.v1.api.get_limiter")
+    def test__notify_many_counts_outcomes(self, mock_get_limiter,
+                                          mock_metrics):
+        mock_get_limiter.return_value.admit.side_effect = ["p1", None, "p3"]
+        drv = mock.Mock()
+        drv.notify_many.return_value = [True, False]
+        api._notify_many("b1", "foo", drv, None, ["x", "y", "z"])
+        self.assertEqual(
+            [mock.call(1, backend="b1", driver="foo", outcome="throttled"),
+             mock.call(backend="b1", driver="foo", outcome="passed"),
+             mock.call(backend="b1", driver="foo", outcome="failed")],
+            mock_metrics.DELIVERIES.inc.mock_calls)
+        mock_metrics.DELIVERY_DURATION.observe.assert_called_once_with(
+            mock.ANY, backend="b1", driver="foo")
+
+    @mock.patch("notify.api.v1.api.metrics")
+    def test__complete(self, mock_metrics):
+        circuit = mock.Mock()
+        self.assertEqual({"status": True},
+                         api._complete("b1", "foo", circuit, True))
+        status = driver.Status(True, refused={"a@b": "550 No"})
+        self.assertEqual({"status": True, "refused": {"a@b": "550 No"}},
+                         api._complete("b1", "foo", circuit, status, 0.1))
+        self.assertEqual([mock.call(True), mock.call(True)],
+                         circuit.record.mock_calls)
+        self.assertEqual(
+            [mock.call(backend="b1", driver="foo", outcome="passed")] * 2,
+            mock_metrics.DELIVERIES.inc.mock_calls)
+
+    @mock.patch("notify.api.v1.api._get_breaker", return_value=None)
+    @mock.patch("notify.api.v1.api.get_limiter", return_value=None)
+    @mock.patch("notify.api.v1.api.get_retry_store")
+    @mock.patch("notify.api.v1.api.executor")
+    @mock.patch("notify.api.v1.api.CACHE")
+    def test__dispatch_timed_out_queued(self, mock_cache, mock_executor,
+                                        mock_get_retry_store, mock_limiter,
+                                        mock_get_breaker):
+        pool = futures.ThreadPoolExecutor(1)
+        self.addCleanup(pool.shutdown)
+        mock_executor.get_executor.return_value = pool
+        mock_executor.get_settings.return_value = {"driver_timeout": 0.05,
+                                                   "request_timeout": 5}
+        release = threading.Event()
+        self.addCleanup(release.set)
+        slow, queued = mock.Mock(), mock.Mock()
+        slow.notify.side_effect = lambda payload: release.wait(5)
+        queued.notify.return_value = False
+        mock_cache.get.side_effect = lambda name, conf: (
+            name, {"slow": slow, "queued": queued}[name])
+
+        self.assertEqual(
+            [("b1", "slow", None), ("b2", "queued", None)],
+            api._dispatch(["b1", "b2"], {"b1": {"slow": {}},
+                                         "b2": {"queued": {}}},
+                          api._notify, "p"))
+        release.set()
+        pool.shutdown(wait=True)
+        queued.notify.assert_called_once_with("p")
+        mock_get_retry_store.return_value.add.assert_called_once_with(
+            "b2", "queued", "p", None)
+
+    @mock.patch("notify.api.v1.api.LOG")
+    @mock.patch("notify.api.v1.api.get_retry_store")
+    @mock.patch("notify.api.v1.api.executor.get_executor")
+    def test__retry_later(self, mock_get_executor, mock_get_retry_store,
+                          mock_log):
+        submit = mock_get_executor.return_value.submit
+        api._retry_later("b1", "foo", "p", {"status": True})
+        self.assertFalse(submit.called)
+
+        api._retry_later("b1", "foo", "p", {"error": "Foo"})
+        call, args = submit.call_args[0][0], submit.call_args[0][1:]
+        self.assertEqual(("b1", "foo", "p", {"error": "Foo"}), args)
+        self.assertFalse(mock_get_retry_store.return_value.add.called)
+        call(*args)
+        mock_get_retry_store.return_value.add.assert_called_once_with(
+            "b1", "foo", "p", "Foo")
+
+        mock_get_retry_store.side_effect = ValueError("Broken")
+        self.assertIsNone(call(*args))
+        self.assertEqual(1, mock_log.error.call_count)
+
+    def test__reload_is_registered(self):
+        self.assertIn(api._reload, config.RELOAD_HOOKS)
@@ -21,6 +21,7 @@ from notify.drivers import dummy_err_explained
 from notify.drivers import dummy_fail
 from notify.drivers import dummy_pass
 from notify.drivers import dummy_random
+from notify.drivers import dummy_sleep
 from tests.unit import test
 
 
@@ -68,3 +69,46 @@ class DummyRandomDriverTestCase(test.TestCase):
 
         drv = dummy_random.Driver({"probability": 0.53})
         self.assertTrue(drv.notify(self.payload))
+
+
+class DummySleepDriverTestCase(test.TestCase):
+
+    @mock.patch("notify.drivers.dummy_sleep.random.random", return_value=0.5)
+    @mock.patch("notify.drivers.dummy_sleep.time.sleep")
+    def test_notify(self, mock_sleep, mock_random):
+        self.assertTrue(dummy_sleep.Driver({}).notify(self.payload))
+        mock_sleep.assert_called_once_with(0.1)
+
+        drv = dummy_sleep.Driver({"latency": 0.2, "probability": 0.4})
+        self.assertFalse(drv.notify(self.payload))
+        mock_sleep.assert_called_with(0.2)
+
+    @mock.patch("notify.drivers.dummy_sleep.random")
+    def test_get_latency(self, mock_random):
+        mock_random.uniform.return_value = 0.3
+        mock_random.gauss.return_value = -1
+        mock_random.lognormvariate.return_value = 2
+        mock_random.expovariate.return_value = 100
+        expected = {"constant": 0.5, "uniform": 0.3, "normal": 0,
+                    "lognormal": 1.0, "exponential": 10}
+        for distribution, latency in expected.items():
+            drv = dummy_sleep.Driver({"distribution": distribution,
+                                      "latency": 0.5, "jitter": 0.1,
+                                      "max_latency": 10})
+            self.assertEqual(latency, drv.get_latency())
+        mock_random.uniform.assert_called_once_with(0.4, 0.6)
+        mock_random.gauss.assert_called_once_with(0.5, 0.1)
+        mock_random.lognormvariate.assert_called_once_with(0, 0.1)
+        mock_random.expovariate.assert_called_once_with(2.0)
+
+        drv = dummy_sleep.Driver({"distribution": "exponential",
+                                  "latency": 0})
+        self.assertEqual(0, drv.get_latency())
+
+    def test_validate_config(self):
+        dummy_sleep.Driver.validate_config({"distribution": "lognormal",
+                                            "latency": 0.05, "jitter": 0.5})
+        for conf in ({"distribution": "foo"}, {"latency": -1},
+                     {"probability": 2}, {"foo": 1}):
+            self.assertRaises(ValueError,
+                              dummy_sleep.Driver.validate_config, conf)
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 import mock
 
 from notify import driver
@@ -41,20 +43,36 @@ class MailDriverTestCase(test.TestCase):
                 "what": "Foo subject",
                 "who": "John Doe"}
 
+    @mock.patch("notify.drivers.mail.SMTPPool")
+    def test_close(self, mock_pool):
+        self._driver().close()
+        mock_pool.return_value.close.assert_called_once_with()
+
+    @mock.patch("notify.drivers.mail.futures.ThreadPoolExecutor")
+    def test_get_async_executor(self, mock_executor):
+        drv = self._driver(pool_size=7)
+        mock_executor.assert_called_once_with(max_workers=7)
+        self.assertEqual(mock_executor.return_value,
+                         drv.get_async_executor())
+        drv.close()
+        mock_executor.return_value.shutdown.assert_called_once_with(
+            wait=False)
+
     def test_sanitize_name(self):
         drv = self._driver()
         self.assertEqual("foo123", drv._sanitize_name("foo123"))
         self.assertEqual("foo-12-3.bar",
                          drv._sanitize_name(" foo- 1+2_3 . bar "))
 
-    @mock.patch("notify.drivers.mail.smtplib")
+    @mock.patch("notify.drivers.mail.smtplib.SMTP")
     @mock.patch("notify.drivers.mail.mime_text.MIMEText")
     @mock.patch("notify.drivers.mail.LOG")
-    def test_notify(self, mock_log, mock_mimetext, mock_smtplib):
+    def test_notify(self, mock_log, mock_mimetext, mock_smtp_cls):
         mock_mimetext.return_value.as_string.return_value = "message body"
         mock_smtp = mock.Mock()
+        mock_smtp.has_extn.return_value = False
         mock_smtp.sendmail.return_value = {}
-        mock_smtplib.SMTP.return_value = mock_smtp
+        mock_smtp_cls.return_value = mock_smtp
         drv = self._driver()
         self.assertTrue(drv.notify(self._payload()))
 
@@ -64,20 +82,21 @@ class MailDriverTestCase(test.TestCase):
         self.assertEqual(calls,
                          mock_mimetext.return_value.__setitem__.mock_calls)
         mock_mimetext.assert_called_once_with("Message body", "plain")
-        mock_smtplib.SMTP.assert_called_once_with(host="localhost", port=None)
+        mock_smtp_cls.assert_called_once_with(host="localhost", port=None)
         mock_smtp.sendmail.assert_called_once_with(
             "fooenv42@foo_domain", ["foo@example.org"], "message body")
-        mock_smtp.quit.assert_called_once_with()
+        self.assertFalse(mock_smtp.quit.called)
         self.assertFalse(mock_log.error.called)
 
-    @mock.patch("notify.drivers.mail.smtplib")
+    @mock.patch("notify.drivers.mail.smtplib.SMTP")
     @mock.patch("notify.drivers.mail.mime_text.MIMEText")
     @mock.patch("notify.drivers.mail.LOG")
-    def test_notify_some_fails(self, mock_log, mock_mimetext, mock_smtplib):
+    def test_notify_some_fails(self, mock_log, mock_mimetext, mock_smtp_cls):
         mock_mimetext.return_value.as_string.return_value = "message body"
         mock_smtp = mock.Mock()
+        mock_smtp.has_extn.return_value = False
         mock_smtp.sendmail.return_value = {"foo": "error details"}
-        mock_smtplib.SMTP.return_value = mock_smtp
+        mock_smtp_cls.return_value = mock_smtp
         drv = self._driver()
         payload = self._payload()
         payload["affected_hosts"] = ["srv1", "srv2"]
@@ -89,9 +108,406 @@ class MailDriverTestCase(test.TestCase):
         self.assertEqual(calls,
                          mock_mimetext.return_value.__setitem__.mock_calls)
         mock_mimetext.assert_called_once_with("Message body", "plain")
-        mock_smtplib.SMTP.assert_called_once_with(host="localhost", port=None)
+        mock_smtp_cls.assert_called_once_with(host="localhost", port=None)
         mock_smtp.sendmail.assert_called_once_with(
             "fooenv42@foo_domain", ["foo@example.org"], "message body")
-        mock_smtp.quit.assert_called_once_with()
+        self.assertFalse(mock_smtp.quit.called)
         mock_log.error.assert_called_once_with(
-            "Fail to notify {} via email: {}", "foo", "error details")
+            "Fail to notify foo via email: error details")
+
+    @mock.patch("notify.drivers.mail.SMTPPool")
+    def test___init___pool(self, mock_pool):
+        self._driver()
+        mock_pool.assert_called_once_with(
+            "localhost", None, size=4, idle_timeout=60, max_messages=100,
+            starttls=False, user=None, password=None, pipelining=True)
+
+        mock_pool.reset_mock()
+        self._driver(smtp_host="mx", smtp_port=587, smtp_starttls=True,
+                     smtp_user="u", smtp_password="p", pool_size=2,
+                     pool_idle_timeout=5, pool_max_messages=10,
+                     smtp_pipelining=False)
+        mock_pool.assert_called_once_with(
+            "mx", 587, size=2, idle_timeout=5, max_messages=10,
+            starttls=True, user="u", password="p", pipelining=False)
+
+    def test___init___digest(self):
+        self.assertIsNone(self._driver()._digest)
+        drv = self._driver(digest={})
+        self.assertEqual((60, 100), (drv._digest.window,
+                                     drv._digest.max_items))
+        self.assertEqual({"CRITICAL", "DOWN"}, drv._bypass_severities)
+        drv = self._driver(digest={"window": 5, "max_items": 3,
+                                   "bypass_severities": ["DOWN"]})
+        self.assertEqual((5, 3), (drv._digest.window, drv._digest.max_items))
+        self.assertEqual({"DOWN"}, drv._bypass_severities)
+
+        for bad in ({"window": 0}, {"max_items": 0}, {"foo": 1},
+                    {"bypass_severities": ["SPAM"]}):
+            self.assertRaises(ValueError, mail.Driver.validate_config,
+                              {"sender_domain": "foo", "digest": bad})
+
+    @mock.patch("notify.drivers.mail.Driver._deliver",
+                side_effect=lambda messages: [True] * len(messages))
+    @mock.patch("notify.drivers.mail.Driver._make_message",
+                side_effect=lambda *args: args)
+    def test_notify_digest(self, mock_make_message, mock_deliver):
+        drv = self._driver(digest={"window": 60, "max_items": 3})
+        self.addCleanup(drv.close)
+        payloads = [dict(self._payload(), severity=severity, region=region)
+                    for severity, region in (("INFO", "r1"),
+                                             ("CRITICAL", "r1"),
+                                             ("WARNING", "r1"))]
+
+        statuses = [drv.notify(payload) for payload in payloads]
+        self.assertEqual([{"status": True, "queued": "digest"}, True,
+                          {"status": True, "queued": "digest"}],
+                         [status.to_dict() if status is not True else status
+                          for status in statuses])
+        mock_make_message.assert_called_once_with(
+            "r1", "John Doe: Foo subject", "Message body", "plain")
+        self.assertEqual(2, len(drv._digest._items))
+
+        mock_make_message.reset_mock()
+        self.assertTrue(drv.notify(dict(payloads[0], region="r0",
+                                        what="Bar", description="a\nb")))
+        self.assertEqual(0, len(drv._digest._items))
+        mock_make_message.assert_called_once_with(
+            "digest", "Digest of 3 alert(s): 1 WARNING, 2 INFO",
+            "r0 / INFO (1)\n"
+            "* John Doe: Bar\n"
+            "    a\n"
+            "    b\n\n"
+            "r1 / WARNING (1)\n"
+            "* John Doe: Foo subject\n"
+            "    Message body\n\n"
+            "r1 / INFO (1)\n"
+            "* John Doe: Foo subject\n"
+            "    Message body", "plain")
+
+    @mock.patch("notify.drivers.mail.Driver._deliver",
+                side_effect=lambda messages: [True] * len(messages))
+    @mock.patch("notify.drivers.mail.Driver._make_message",
+                side_effect=lambda *args: args)
+    def test_send_digest_single_region(self, mock_make_message, mock_deliver):
+        drv = self._driver()
+        drv.send_digest([self._payload()])
+        mock_make_message.assert_called_once_with(
+            "fooenv42", "Digest of 1 alert(s): 1 INFO",
+            "fooenv42 / INFO (1)\n* John Doe: Foo subject\n"
+            "    Message body", "plain")
+
+    @mock.patch("notify.drivers.mail.Driver._deliver",
+                side_effect=lambda messages: [True] * len(messages))
+    @mock.patch("notify.drivers.mail.Driver._make_message",
+                side_effect=lambda *args: args)
+    def test_close_flushes_digest(self, mock_make_message, mock_deliver):
+        drv = self._driver(digest={"window": 60})
+        drv.notify(self._payload())
+        self.assertFalse(mock_make_message.called)
+        drv.close()
+        self.assertEqual(1, mock_make_message.call_count)
+        self.assertTrue(drv._digest._stopped.is_set())
+
+    @mock.patch("notify.drivers.mail.LOG")
+    def test_notify_many_chunks(self, mock_log):
+        drv = self._driver(recipients=["a", "b", "c", "d", "e"],
+                           recipients_chunk_size=2, pool_size=3)
+        self.addCleanup(drv.close)
+        self.assertEqual([["a", "b"], ["c", "d"], ["e"]], drv._chunks)
+        refused = mail.smtplib.SMTPRecipientsRefused({"e": (550, b"No")})
+        results = {"a": [{}, {}, {}],
+                   "c": [{"d": (550, b"Unknown")},
+                         mail.smtplib.SMTPDataError(451, "Later"), {}],
+                   "e": [{}, refused, {}]}
+        drv._pool = mock.Mock()
+        drv._pool.send_many.side_effect = lambda messages: results[
+            messages[0][1][0]]
+        payloads = [self._payload(),
+                    dict(self._payload(), region="r2"),
+                    dict(self._payload(), severity="DOWN")]
+
+        statuses = drv.notify_many(payloads)
+        self.assertEqual(3, drv._pool.send_many.call_count)
+        for call in drv._pool.send_many.mock_calls:
+            messages = call[1][0]
+            self.assertEqual(["fooenv42@foo_domain", "r2@foo_domain",
+                              "fooenv42@foo_domain"],
+                             [sender for sender, rcpts, text in messages])
+            self.assertEqual(1, len(set(tuple(rcpts)
+                                        for sender, rcpts, text in messages)))
+
+        self.assertEqual({"status": True,
+                          "refused": {"d": "550 Unknown"}},
+                         statuses[0].to_dict())
+        self.assertEqual({"status": True,
+                          "refused": {"c": "SMTPDataError: (451, 'Later')",
+                                      "d": "SMTPDataError: (451, 'Later')",
+                                      "e": "550 No"}},
+                         statuses[1].to_dict())
+        self.assertIs(True, statuses[2])
+        self.assertEqual(4, mock_log.error.call_count)
+
+        results["a"] = [mail.socket.error("Down")]
+        results["c"] = [{"c": (550, "No"), "d": (550, "No")}]
+        results["e"] = [{"e": (550, "No")}]
+        self.assertRaises(mail.socket.error, drv.notify, self._payload())
+        results["a"] = [{"a": (550, "No"), "b": (550, "No")}]
+        results["e"] = [refused]
+        self.assertRaises(mail.smtplib.SMTPRecipientsRefused, drv.notify,
+                          self._payload())
+
+
+class SendmailTestCase(test.TestCase):
+
+    def _smtp(self, *replies):
+        smtp = mock.Mock()
+        smtp.has_extn.return_value = True
+        smtp.getreply.side_effect = list(replies)
+        return smtp
+
+    def test_sendmail(self):
+        smtp = mock.Mock()
+        smtp.has_extn.return_value = False
+        self.assertEqual(smtp.sendmail.return_value,
+                         mail.sendmail(smtp, "from", ["to"], "msg"))
+        smtp.sendmail.assert_called_once_with("from", ["to"], "msg")
+
+        smtp = self._smtp()
+        mail.sendmail(smtp, "from", ["to"], "msg", pipelining=False)
+        smtp.sendmail.assert_called_once_with("from", ["to"], "msg")
+
+    def test_sendmail_pipelined(self):
+        smtp = self._smtp((250, b"OK"), (250, b"OK"), (550, b"No"),
+                          (354, b"Go"), (250, b"Queued"))
+        self.assertEqual({"bad": (550, b"No")}, mail.sendmail(
+            smtp, "from@x", ["to@x", "bad"], "a\n.b"))
+        self.assertFalse(smtp.sendmail.called)
+        self.assertEqual(
+            [mock.call("mail FROM:<from@x>\r\nrcpt TO:<to@x>\r\n"
+                       "rcpt TO:<bad>\r\ndata\r\n"),
+             mock.call(b"a\r\n..b\r\n.\r\n")], smtp.send.mock_calls)
+
+    def test_sendmail_pipelined_refused(self):
+        smtp = self._smtp((250, b"OK"), (550, b"No"), (354, b"Go"),
+                          (554, b"No data"))
+        e = self.assertRaises(mail.smtplib.SMTPRecipientsRefused,
+                              mail.sendmail, smtp, "from", ["bad"], "msg")
+        self.assertEqual({"bad": (550, b"No")}, e.recipients)
+        smtp.send.assert_called_with(".\r\n")
+        smtp.rset.assert_called_once_with()
+
+        smtp = self._smtp((550, b"Bad sender"), (503, b"No"), (503, b"No"))
+        self.assertRaises(mail.smtplib.SMTPSenderRefused,
+                          mail.sendmail, smtp, "from", ["to"], "msg")
+        self.assertEqual(1, smtp.send.call_count)
+        smtp.rset.assert_called_once_with()
+
+        smtp = self._smtp((250, b"OK"), (250, b"OK"), (451, b"Later"))
+        self.assertRaises(mail.smtplib.SMTPDataError,
+                          mail.sendmail, smtp, "from", ["to"], "msg")
+        smtp.rset.assert_called_once_with()
+
+        smtp = self._smtp((250, b"OK"), (250, b"OK"), (354, b"Go"),
+                          (451, b"Later"))
+        self.assertRaises(mail.smtplib.SMTPDataError,
+                          mail.sendmail, smtp, "from", ["to"], "msg")
+        smtp.rset.assert_called_once_with()
+
+    def test_sendmail_pipelined_closed(self):
+        smtp = self._smtp((421, b"Closing"))
+        self.assertRaises(mail.smtplib.SMTPSenderRefused,
+                          mail.sendmail, smtp, "from", ["to"], "msg")
+        smtp.close.assert_called_once_with()
+        self.assertFalse(smtp.rset.called)
+
+        smtp = self._smtp((250, b"OK"), (250, b"OK"), (421, b"Closing"))
+        e = self.assertRaises(mail.smtplib.SMTPRecipientsRefused,
+                              mail.sendmail, smtp, "from", ["to", "x"],
+                              "msg")
+        self.assertEqual({"x": (421, b"Closing")}, e.recipients)
+        smtp.close.assert_called_once_with()
+
+
+class DigestTestCase(test.TestCase):
+
+    @mock.patch("notify.drivers.mail.time.time")
+    def test_flush(self, mock_time):
+        mock_time.return_value = 100
+        send = mock.Mock()
+        digest = mail.Digest(10, 5, send)
+        digest._start = mock.Mock()
+
+        digest.flush()
+        digest.add("a")
+        mock_time.return_value = 105
+        digest.add("b")
+        digest.flush()
+        self.assertFalse(send.called)
+
+        mock_time.return_value = 110
+        digest.flush()
+        send.assert_called_once_with(["a", "b"])
+
+        send.reset_mock()
+        digest.add("c")
+        mock_time.return_value = 119
+        digest.flush()
+        self.assertFalse(send.called)
+        digest.flush(force=True)
+        send.assert_called_once_with(["c"])
+
+    @mock.patch("notify.drivers.mail.metrics.MAIL_DIGEST_ITEMS")
+    @mock.patch("notify.drivers.mail.LOG")
+    def test_send_fails(self, mock_log, mock_counter):
+        digest = mail.Digest(10, 2, mock.Mock(side_effect=ValueError("x")))
+        digest._start = mock.Mock()
+        digest.add("a")
+        digest.add("b")
+        self.assertTrue(mock_log.error.called)
+        mock_counter.inc.assert_called_once_with(2, result="failed")
+        self.assertEqual([], digest._items)
+
+    def test_flusher(self):
+        sent = []
+        digest = mail.Digest(0.05, 100, sent.append)
+        self.addCleanup(digest.close)
+        digest.add("a")
+        for i in range(100):
+            if sent:
+                break
+            time.sleep(0.02)
+        self.assertEqual([["a"]], sent)
+
+
+@mock.patch("notify.drivers.mail.smtplib.SMTP")
+class SMTPPoolTestCase(test.TestCase):
+
+    def test_sendmail_reuses_connection(self, mock_smtp_cls):
+        mock_smtp_cls.return_value.has_extn.return_value = False
+        smtp = mock_smtp_cls.return_value
+        smtp.sendmail.return_value = {}
+        pool = mail.SMTPPool("foo_host", 25)
+        self.assertEqual({}, pool.sendmail("from", ["to"], "msg"))
+        self.assertEqual({}, pool.sendmail("from", ["to"], "msg"))
+        mock_smtp_cls.assert_called_once_with(host="foo_host", port=25)
+        self.assertEqual(2, smtp.sendmail.call_count)
+        self.assertFalse(smtp.noop.called)
+        self.assertFalse(smtp.quit.called)
+
+        pool.close()
+        smtp.quit.assert_called_once_with()
+
+    @mock.patch("notify.drivers.mail.metrics.SMTP_CONNECT_DURATION")
+    def test_sendmail_starttls_and_login(self, mock_histogram, mock_smtp_cls):
+        mock_smtp_cls.return_value.has_extn.return_value = False
+        smtp = mock_smtp_cls.return_value
+        pool = mail.SMTPPool("foo_host", starttls=True, user="foo",
+                             password="bar")
+        pool.sendmail("from", ["to"], "msg")
+        smtp.starttls.assert_called_once_with()
+        smtp.login.assert_called_once_with("foo", "bar")
+        mock_histogram.observe.assert_called_once_with(mock.ANY,
+                                                       host="foo_host")
+
+        smtp.login.side_effect = mail.smtplib.SMTPAuthenticationError(
+            535, "denied")
+        pool.close()
+        self.assertRaises(mail.smtplib.SMTPAuthenticationError,
+                          pool.sendmail, "from", ["to"], "msg")
+        self.assertEqual(2, smtp.quit.call_count)
+
+    def test_sendmail_recycles_connection(self, mock_smtp_cls):
+        mock_smtp_cls.return_value.has_extn.return_value = False
+        pool = mail.SMTPPool("foo_host", max_messages=2)
+        for i in range(5):
+            pool.sendmail("from", ["to"], "msg")
+        self.assertEqual(3, mock_smtp_cls.call_count)
+        self.assertEqual(2, mock_smtp_cls.return_value.quit.call_count)
+
+    @mock.patch("notify.drivers.mail.time.time")
+    def test_sendmail_checks_idle_connection(self, mock_time,
+                                             mock_smtp_cls):
+        smtp = mock_smtp_cls.return_value
+        smtp.has_extn.return_value = False
+        smtp.noop.return_value = (250, "OK")
+        pool = mail.SMTPPool("foo_host", idle_timeout=60)
+
+        mock_time.return_value = 100
+        pool.sendmail("from", ["to"], "msg")
+        mock_time.return_value = 110
+        pool.sendmail("from", ["to"], "msg")
+        smtp.noop.assert_called_once_with()
+        self.assertEqual(1, mock_smtp_cls.call_count)
+
+        smtp.noop.return_value = (421, "Closing")
+        mock_time.return_value = 120
+        pool.sendmail("from", ["to"], "msg")
+        smtp.close.assert_called_once_with()
+        self.assertEqual(2, mock_smtp_cls.call_count)
+
+        mock_time.return_value = 200
+        pool.sendmail("from", ["to"], "msg")
+        smtp.quit.assert_called_once_with()
+        self.assertEqual(3, mock_smtp_cls.call_count)
+
+    def test_sendmail_reconnects(self, mock_smtp_cls):
+        mock_smtp_cls.return_value.has_extn.return_value = False
+        smtp = mock_smtp_cls.return_value
+        pool = mail.SMTPPool("foo_host")
+        pool.sendmail("from", ["to"], "msg")
+
+        smtp.sendmail.side_effect = [
+            mail.smtplib.SMTPServerDisconnected(), {"bad": (550, "No")}]
+        self.assertEqual({"bad": (550, "No")},
+                         pool.sendmail("from", ["to", "bad"], "msg"))
+        self.assertEqual(2, mock_smtp_cls.call_count)
+        self.assertEqual(1, len(pool._idle))
+
+    def test_send_many(self, mock_smtp_cls):
+        smtp = mock_smtp_cls.return_value
+        smtp.has_extn.return_value = False
+        refused = mail.smtplib.SMTPRecipientsRefused({"to": (550, "No")})
+        error = mail.socket.error("Broken pipe")
+        smtp.sendmail.side_effect = [{}, refused, {"x": (550, "No")}, error,
+                                     {}]
+        pool = mail.SMTPPool("foo_host", max_messages=10)
+
+        self.assertEqual([{}, refused, {"x": (550, "No")}, error, {}],
+                         pool.send_many([("from", ["to"], "msg")] * 5))
+        self.assertEqual(2, mock_smtp_cls.call_count)
+        smtp.close.assert_called_once_with()
+        self.assertEqual(1, len(pool._idle))
+        self.assertEqual(1, pool._idle[0].messages)
+
+        pool = mail.SMTPPool("foo_host", max_messages=2)
+        smtp.sendmail.side_effect = None
+        smtp.sendmail.return_value = {}
+        mock_smtp_cls.reset_mock()
+        self.assertEqual([{}] * 5,
+                         pool.send_many([("from", ["to"], "msg")] * 5))
+        self.assertEqual(3, mock_smtp_cls.call_count)
+
+    def test_send_many_connect_fails(self, mock_smtp_cls):
+        error = mail.socket.error("Connection refused")
+        mock_smtp_cls.side_effect = error
+        pool = mail.SMTPPool("foo_host")
+        self.assertEqual([error] * 3,
+                         pool.send_many([("from", ["to"], "msg")] * 3))
+        self.assertEqual(1, mock_smtp_cls.call_count)
+
+    def test_sendmail_fails(self, mock_smtp_cls):
+        mock_smtp_cls.return_value.has_extn.return_value = False
+        smtp = mock_smtp_cls.return_value
+        pool = mail.SMTPPool("foo_host")
+
+        smtp.sendmail.side_effect = mail.smtplib.SMTPRecipientsRefused({})
+        self.assertRaises(mail.smtplib.SMTPRecipientsRefused,
+                          pool.sendmail, "from", ["to"], "msg")
+        self.assertEqual(1, len(pool._idle))
+
+        smtp.sendmail.side_effect = mail.socket.error
+        self.assertRaises(mail.socket.error,
+                          pool.sendmail, "from", ["to"], "msg")
+        self.assertEqual(0, len(pool._idle))
+        smtp.close.assert_called_once_with()
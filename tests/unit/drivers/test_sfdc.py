@@ -13,12 +13,31 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+import os
+import shutil
+import tempfile
+
 import mock
 
 from notify.drivers import sfdc
 from tests.unit import test
 
 
+class ModuleTestCase(test.TestCase):
+
+    def test_make_session(self):
+        session = sfdc.make_session(pool_size=3, retries=5,
+                                    backoff_factor=0.1)
+        adapter = session.get_adapter("https://foo.salesforce.com")
+        self.assertIs(adapter, session.get_adapter("http://foo"))
+        self.assertEqual(3, adapter._pool_maxsize)
+        self.assertEqual(5, adapter.max_retries.total)
+        self.assertEqual(0.1, adapter.max_retries.backoff_factor)
+        self.assertFalse(adapter.max_retries.is_retry("POST", 503))
+        self.assertTrue(adapter.max_retries.is_retry("GET", 503))
+
+
 class OAuth2TestCase(test.TestCase):
 
     SIMPLIFIED_SOAP_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
@@ -55,16 +74,16 @@ class OAuth2TestCase(test.TestCase):
         auth = sfdc.OAuth2("foo_id", "foo_secret", "foo_user", "foo_pass",
                            organizationId="foo_corp")
         mock_resp = mock.Mock(text=self.SIMPLIFIED_SOAP_RESPONSE)
-        mock_requests.post.return_value = mock_resp
+        mock_requests.Session.return_value.post.return_value = mock_resp
         self.assertEqual({"access_token": "FooSessionID",
                           "instance_url": "https://login.salesforce.com"},
                          auth.authenticate_soap())
         mock_resp.raise_for_status.assert_called_once_with()
         headers = {"SOAPAction": "login", "Charset": "UTF-8",
                    "Content-Type": "text/xml"}
-        mock_requests.post.assert_called_once_with(
+        mock_requests.Session.return_value.post.assert_called_once_with(
             "https://login.salesforce.com/services/Soap/u/36.0",
-            self.SOAP_REQUEST, headers=headers, verify=None)
+            self.SOAP_REQUEST, headers=headers, verify=None, timeout=None)
 
     @mock.patch("notify.drivers.sfdc.requests")
     @mock.patch("notify.drivers.sfdc.LOG")
@@ -72,15 +91,15 @@ class OAuth2TestCase(test.TestCase):
         auth = sfdc.OAuth2("foo_id", "foo_secret", "foo_user", "foo_pass")
         mock_resp = mock.Mock()
         mock_resp.json.return_value = "foo_json"
-        mock_requests.post.return_value = mock_resp
+        mock_requests.Session.return_value.post.return_value = mock_resp
         self.assertEqual("foo_json", auth.authenticate_rest())
         mock_resp.raise_for_status.assert_called_once_with()
         expected = {"username": "foo_user", "client_secret": "foo_secret",
                     "password": "foo_pass", "grant_type": "password",
                     "client_id": "foo_id"}
-        mock_requests.post.assert_called_once_with(
+        mock_requests.Session.return_value.post.assert_called_once_with(
             "https://login.salesforce.com/services/oauth2/token",
-            data=expected, verify=None)
+            data=expected, verify=None, timeout=None)
 
     def test_authenticate_switches_to_soap(self):
         auth = sfdc.OAuth2("foo_id", "foo_secret", "foo_user", "foo_pass",
@@ -100,6 +119,101 @@ class OAuth2TestCase(test.TestCase):
         self.assertFalse(auth.authenticate_soap.called)
 
 
+class CaseCacheTestCase(test.TestCase):
+
+    def test_get_and_set(self):
+        cache = sfdc.CaseCache(max_size=2)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "case_a", "New", "Subject A")
+        cache.set("b", "case_b", "Open", "Subject B")
+        self.assertEqual(("case_a", "New", "Subject A"), cache.get("a"))
+        cache.set("c", "case_c", "New", "Subject C")
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual("case_a", cache.get("a")[0])
+
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+
+    def test_get_expired(self):
+        cache = sfdc.CaseCache(ttl=-1)
+        cache.set("a", "case_a", "New", "Subject A")
+        self.assertIsNone(cache.get("a"))
+
+    def test_save_and_load(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "cases.json")
+
+        self.assertEqual(0, len(sfdc.CaseCache(path=path)))
+        cache = sfdc.CaseCache(path=path)
+        cache.set("a", "case_a", "New", "Subject A")
+        cache.set("b", "case_b", "Open", "Subject B")
+        cache.save()
+        self.assertEqual(0o600, os.stat(path).st_mode & 0o777)
+
+        other = sfdc.CaseCache(max_size=1, path=path)
+        self.assertEqual(1, len(other))
+        self.assertEqual(("case_b", "Open", "Subject B"), other.get("b"))
+
+        path = os.path.join(tmpdir, "expired.json")
+        expired = sfdc.CaseCache(ttl=-1, path=path)
+        expired.set("c", "case_c", "New", "Subject C")
+        expired.save()
+        self.assertEqual(0, len(sfdc.CaseCache(path=path)))
+
+    @mock.patch("notify.drivers.sfdc.CaseCache.save")
+    def test_set_saves_periodically(self, mock_save):
+        cache = sfdc.CaseCache(path="/nonexistent/cases.json")
+        cache.set("a", "case_a", "New", "Subject A")
+        self.assertFalse(mock_save.called)
+        cache._saved_at -= cache.SAVE_INTERVAL + 1
+        cache.set("b", "case_b", "New", "Subject B")
+        mock_save.assert_called_once_with()
+
+
+class TokenCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(TokenCacheTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_get_and_set(self):
+        cache = sfdc.TokenCache(self.tmpdir, "foo_key")
+        self.assertIsNone(cache.get())
+        cache.set({"access_token": "foo_token", "instance_url": "foo_url",
+                   "signature": "dummy"})
+        self.assertEqual(0o600, os.stat(cache.path).st_mode & 0o777)
+
+        other = sfdc.TokenCache(self.tmpdir, "foo_key")
+        self.assertEqual(cache.path, other.path)
+        cached = other.get()
+        self.assertEqual(["access_token", "expires_at", "instance_url"],
+                         sorted(cached))
+        self.assertEqual("foo_token", cached["access_token"])
+        self.assertEqual("foo_url", cached["instance_url"])
+        self.assertIsNone(sfdc.TokenCache(self.tmpdir, "bar_key").get())
+
+    def test_get_expired(self):
+        cache = sfdc.TokenCache(self.tmpdir, "foo_key", ttl=-1)
+        cache.set({"access_token": "foo_token", "instance_url": "foo_url"})
+        self.assertIsNone(cache.get())
+
+    def test_lock(self):
+        cache = sfdc.TokenCache(self.tmpdir, "foo_key")
+        with cache.lock():
+            self.assertTrue(os.path.exists(cache.lock_path))
+
+    def test_missing_directory(self):
+        directory = os.path.join(self.tmpdir, "foo", "bar")
+        cache = sfdc.TokenCache(directory, "foo_key")
+        self.assertTrue(os.path.isdir(directory))
+        with cache.lock():
+            cache.set({"access_token": "foo_token", "instance_url": "foo_url"})
+        self.assertEqual("foo_token", cache.get()["access_token"])
+
+
 class ClientTestCase(test.TestCase):
 
     def setUp(self):
@@ -116,26 +230,61 @@ class ClientTestCase(test.TestCase):
         self.assertEqual("foo_token", client.access_token)
         self.assertEqual("foo_url", client.instance_url)
 
+    @mock.patch("notify.drivers.sfdc.metrics.SFDC_AUTH")
+    def test_authenticate_once_per_stale_token(self, mock_counter):
+        client = sfdc.Client(self.auth)
+        client.authenticate()
+        client.authenticate()
+        self.assertEqual(1, self.auth.authenticate.call_count)
+
+        self.auth.authenticate.return_value = {"access_token": "new_token",
+                                               "instance_url": "foo_url"}
+        client.authenticate(stale_token="foo_token")
+        client.authenticate(stale_token="foo_token")
+        self.assertEqual(2, self.auth.authenticate.call_count)
+        self.assertEqual("new_token", client.access_token)
+        self.assertEqual([mock.call(reason="initial"),
+                          mock.call(reason="expired")],
+                         mock_counter.inc.mock_calls)
+
+    def test_authenticate_with_token_cache(self):
+        cache = mock.MagicMock()
+        cache.get.return_value = {"access_token": "cached_token",
+                                  "instance_url": "cached_url"}
+        client = sfdc.Client(self.auth, token_cache=cache)
+        client.authenticate()
+        self.assertEqual("cached_token", client.access_token)
+        self.assertEqual("cached_url", client.instance_url)
+        self.assertFalse(self.auth.authenticate.called)
+        self.assertFalse(cache.set.called)
+
+        client.authenticate(stale_token="cached_token")
+        self.assertEqual("foo_token", client.access_token)
+        cache.set.assert_called_once_with({"access_token": "foo_token",
+                                           "instance_url": "foo_url"})
+        self.assertEqual(2, cache.lock.return_value.__enter__.call_count)
+
     @mock.patch("notify.drivers.sfdc.requests")
     @mock.patch("notify.drivers.sfdc.LOG")
     def test__request(self, mock_log, mock_requests):
         mock_resp = mock.Mock(status_code=200, text="some data")
         mock_resp.json.return_value = {"json": 42}
-        mock_requests.request.return_value = mock_resp
+        mock_requests.Session.return_value.request.return_value = mock_resp
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar",
                                  headers={"Spam": "Quiz"}, foo=42)
         headers = {"Content-Type": "application/json",
                    "Authorization": "Bearer foo_token", "Spam": "Quiz"}
-        mock_requests.request.assert_called_once_with(
-            "POST", "foo_url/foo/bar", headers=headers, verify=None, foo=42)
+        mock_requests.Session.return_value.request.assert_called_once_with(
+            "POST", "foo_url/foo/bar", headers=headers, verify=None,
+            timeout=None, foo=42)
         self.assertEqual((200, {"json": 42}, None), result)
 
     @mock.patch("notify.drivers.sfdc.requests")
     @mock.patch("notify.drivers.sfdc.LOG")
     def test__request_raises(self, mock_log, mock_requests):
-        mock_requests.request.side_effect = ValueError
+        mock_requests.Session.return_value.request.side_effect = ValueError
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar",
@@ -147,7 +296,7 @@ class ClientTestCase(test.TestCase):
     def test__request_with_empty_response(self, mock_log, mock_requests):
         mock_resp = mock.Mock(status_code=200, text="")
         mock_resp.json.return_value = {"json": 42}
-        mock_requests.request.return_value = mock_resp
+        mock_requests.Session.return_value.request.return_value = mock_resp
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar",
@@ -159,7 +308,7 @@ class ClientTestCase(test.TestCase):
     def test__request_json_raises(self, mock_log, mock_requests):
         mock_resp = mock.Mock(status_code=200, text="some response body")
         mock_resp.json.side_effect = ValueError
-        mock_requests.request.return_value = mock_resp
+        mock_requests.Session.return_value.request.return_value = mock_resp
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar",
@@ -172,7 +321,7 @@ class ClientTestCase(test.TestCase):
         mock_resp = mock.Mock(status_code=400, text="some data")
         mock_resp.json.return_value = [{"errorCode": "FOO",
                                         "message": "Foo!"}]
-        mock_requests.request.return_value = mock_resp
+        mock_requests.Session.return_value.request.return_value = mock_resp
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar",
@@ -187,7 +336,7 @@ class ClientTestCase(test.TestCase):
         mock_resp = mock.Mock(status_code=400, text="some data")
         mock_resp.json.return_value = [{"errorCode": "INVALID_SESSION_ID",
                                         "message": "Foo!"}]
-        mock_requests.request.return_value = mock_resp
+        mock_requests.Session.return_value.request.return_value = mock_resp
 
         client = sfdc.Client(self.auth)
         result = client._request("POST", "/foo/bar", foo=42)
@@ -195,7 +344,13 @@ class ClientTestCase(test.TestCase):
                     [{"errorCode": "INVALID_SESSION_ID", "message": "Foo!"}],
                     ("INVALID_SESSION_ID", "Foo!"))
         self.assertEqual(expected, result)
-        self.assertEqual(4, len(mock_requests.request.mock_calls))
+        self.assertEqual(
+            4, len(mock_requests.Session.return_value.request.mock_calls))
+
+    def test_close(self):
+        session = mock.Mock()
+        sfdc.Client(self.auth, session=session).close()
+        session.close.assert_called_once_with()
 
     @mock.patch("notify.drivers.sfdc.json.dumps", return_value="json_data")
     def test_create_feeditem(self, mock_dumps):
@@ -233,9 +388,78 @@ class ClientTestCase(test.TestCase):
         client._request.assert_called_once_with(
             "GET", "/services/data/v36.0/sobjects/Case/42")
 
+    @mock.patch("notify.drivers.sfdc.json.dumps", return_value="json_data")
+    def test_composite_graph(self, mock_dumps):
+        client = sfdc.Client(self.auth, base_path="/services/data/v50.0")
+        client._request = mock.Mock(return_value="response")
+        self.assertEqual("response", client.composite_graph(["graph"]))
+        client._request.assert_called_once_with(
+            "POST", "/services/data/v50.0/composite/graph", data="json_data")
+        mock_dumps.assert_called_once_with({"graphs": ["graph"]})
+
 
 class DriverTestCase(test.TestCase):
 
+    @mock.patch("notify.drivers.sfdc.Client")
+    @mock.patch("notify.drivers.sfdc.OAuth2")
+    @mock.patch("notify.drivers.sfdc.make_session")
+    def test___init__(self, mock_make_session, mock_oauth, mock_client):
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec",
+                              "pool_size": 2, "read_timeout": 5})
+        session = mock_make_session.return_value
+        mock_make_session.assert_called_once_with(pool_size=2, retries=3)
+        mock_oauth.assert_called_once_with(
+            username="foo_user", password="foo_pass", client_id="c_id",
+            client_secret="c_sec", auth_url=None, organizationId=None,
+            session=session, timeout=(10, 5))
+        mock_client.assert_called_once_with(
+            mock_oauth.return_value, base_path="/services/data/v36.0",
+            session=session, timeout=(10, 5), token_cache=None)
+        self.assertEqual(mock_client.return_value, driver.client)
+        self.assertFalse(driver.composite)
+
+    @mock.patch("notify.drivers.sfdc.Client")
+    def test___init___composite(self, mock_client):
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec",
+                              "composite": True})
+        self.assertTrue(driver.composite)
+        self.assertEqual(25, driver.composite_batch_size)
+        self.assertEqual("/services/data/v50.0",
+                         mock_client.call_args[1]["base_path"])
+
+    @mock.patch("notify.drivers.sfdc.Client")
+    def test_close(self, mock_client):
+        sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                     "client_id": "c_id", "client_secret": "c_sec"}).close()
+        mock_client.return_value.close.assert_called_once_with()
+
+    @mock.patch("notify.drivers.sfdc.futures.ThreadPoolExecutor")
+    @mock.patch("notify.drivers.sfdc.Client")
+    def test_get_async_executor(self, mock_client, mock_executor):
+        drv = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                           "client_id": "c_id", "client_secret": "c_sec",
+                           "pool_size": 3})
+        mock_executor.assert_called_once_with(max_workers=3)
+        self.assertEqual(mock_executor.return_value,
+                         drv.get_async_executor())
+        drv.close()
+        mock_executor.return_value.shutdown.assert_called_once_with(
+            wait=False)
+
+    @mock.patch("notify.drivers.sfdc.Client")
+    @mock.patch("notify.drivers.sfdc.TokenCache")
+    def test___init___with_token_cache(self, mock_token_cache, mock_client):
+        sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                     "client_id": "c_id", "client_secret": "c_sec",
+                     "token_cache_dir": "/foo/dir"})
+        mock_token_cache.assert_called_once_with(
+            "/foo/dir", "https://login.salesforce.com|foo_user|c_id|",
+            ttl=3600)
+        self.assertEqual(mock_token_cache.return_value,
+                         mock_client.call_args[1]["token_cache"])
+
     @mock.patch("notify.drivers.sfdc.Client")
     @mock.patch("notify.drivers.sfdc.OAuth2")
     @mock.patch("notify.drivers.sfdc.json.dumps")
@@ -302,3 +526,122 @@ class DriverTestCase(test.TestCase):
         feeditem = {"Body": "json_data", "Visibility": "AllUsers",
                     "ParentId": "foo_id"}
         driver.client.create_feeditem.assert_called_once_with(feeditem)
+
+    def _driver_with_cached_case(self):
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec",
+                              "case_cache_size": 10})
+        driver.client = mock.Mock()
+        driver.client.create_feeditem.return_value = (201, {}, None)
+        driver.case_cache.set("farfaraway|Hooray!|John Doe", "foo_id",
+                              "Foo status", "Foo subject")
+        return driver
+
+    def test_notify_cached_case(self):
+        driver = self._driver_with_cached_case()
+        driver.client.update_case.return_value = (204, {}, None)
+
+        self.assertTrue(driver.notify(self.payload))
+        self.assertFalse(driver.client.create_case.called)
+        self.assertFalse(driver.client.get_case.called)
+        case = driver.client.update_case.call_args[1]["data"]
+        self.assertEqual("Foo subject", case["Subject"])
+        feeditem = driver.client.create_feeditem.call_args[0][0]
+        self.assertEqual("foo_id", feeditem["ParentId"])
+        self.assertEqual("Foo status", json.loads(feeditem["Body"])["Status"])
+
+    @mock.patch("notify.drivers.sfdc.LOG")
+    def test_notify_cached_case_not_found(self, mock_log):
+        driver = self._driver_with_cached_case()
+        driver.client.update_case.return_value = (404, [], None)
+        driver.client.create_case.return_value = (201, {"id": "bar_id"}, None)
+
+        self.assertTrue(driver.notify(self.payload))
+        driver.client.update_case.assert_called_once_with(
+            "foo_id", data=mock.ANY)
+        feeditem = driver.client.create_feeditem.call_args[0][0]
+        self.assertEqual("bar_id", feeditem["ParentId"])
+        self.assertEqual("New", json.loads(feeditem["Body"])["Status"])
+        self.assertEqual(
+            ("bar_id", "New", "farfaraway|Hooray!|John Doe"),
+            driver.case_cache.get("farfaraway|Hooray!|John Doe"))
+
+    def test_notify_cached_case_fails(self):
+        driver = self._driver_with_cached_case()
+        driver.client.update_case.return_value = (500, [], None)
+
+        self.assertFalse(driver.notify(self.payload))
+        self.assertFalse(driver.client.create_case.called)
+        self.assertFalse(driver.client.create_feeditem.called)
+
+    def test_notify_without_case_cache(self):
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec",
+                              "case_cache_size": 0})
+        self.assertIsNone(driver.case_cache)
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec"})
+        self.assertIsNone(driver.case_cache)
+
+    def _composite_driver(self, **config):
+        config.update(username="foo_user", password="foo_pass",
+                      client_id="c_id", client_secret="c_sec",
+                      composite=True)
+        driver = sfdc.Driver(config)
+        driver.client.composite_graph = mock.Mock()
+        return driver
+
+    def test_notify_composite(self):
+        driver = self._composite_driver()
+        driver.client.composite_graph.return_value = (
+            200, {"graphs": [{"graphId": "0", "isSuccessful": True}]}, None)
+
+        self.assertTrue(driver.notify(self.payload))
+
+        graph, = driver.client.composite_graph.call_args[0][0]
+        self.assertEqual("0", graph["graphId"])
+        case, item = graph["compositeRequest"]
+        self.assertEqual(
+            {"method": "PATCH", "referenceId": "case",
+             "url": "/services/data/v50.0/sobjects/Case/Alert_ID__c/"
+                    "farfaraway%7CHooray%21%7CJohn%20Doe",
+             "body": {"IsMosAlert__c": "true",
+                      "Alert_Priority__c": "060 Informational",
+                      "Description": "This is a test data.",
+                      "Alert_Host__c": "John Doe",
+                      "Alert_Service__c": "Hooray!",
+                      "Environment2__c": "farfaraway",
+                      "Subject": "farfaraway|Hooray!|John Doe"}}, case)
+        self.assertEqual("POST", item["method"])
+        self.assertEqual("/services/data/v50.0/sobjects/FeedItem",
+                         item["url"])
+        self.assertEqual("@{case.id}", item["body"]["ParentId"])
+        self.assertEqual({"Alert_Id": "farfaraway|Hooray!|John Doe",
+                          "Alert_Priority": "060 Informational",
+                          "Description": "This is a test data.",
+                          "Cloud_ID": "farfaraway"},
+                         json.loads(item["body"]["Body"]))
+
+    @mock.patch("notify.drivers.sfdc.LOG")
+    def test_notify_many_composite(self, mock_log):
+        driver = self._composite_driver(composite_batch_size=2)
+        driver.client.composite_graph.side_effect = [
+            (200, {"graphs": [{"graphId": "0", "isSuccessful": True},
+                              {"graphId": "1", "isSuccessful": False,
+                               "graphResponse": "details"}]}, None),
+            (None, None, None)]
+
+        self.assertEqual([True, False, False],
+                         driver.notify_many([self.payload] * 3))
+        self.assertEqual(
+            [2, 1], [len(call[0][0]) for call in
+                     driver.client.composite_graph.call_args_list])
+        self.assertEqual(2, mock_log.error.call_count)
+
+    def test_notify_many(self):
+        driver = sfdc.Driver({"username": "foo_user", "password": "foo_pass",
+                              "client_id": "c_id", "client_secret": "c_sec"})
+        driver.notify = mock.Mock(side_effect=[True, ValueError("foo")])
+        self.assertEqual([True, ValueError],
+                         [status if status is True else type(status)
+                          for status in driver.notify_many([{}, {}])])
@@ -0,0 +1,394 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import threading
+
+import mock
+import testtools
+
+from notify import breaker
+from notify import driver
+from notify import registry
+from tests.unit import test
+
+try:
+    import asyncio
+
+    from notify import asgi
+except (ImportError, SyntaxError):
+    asgi = None
+
+
+def _done(value=None):
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+@testtools.skipIf(asgi is None, "ASGI requires Python 3.5+")
+class AsgiTestCase(test.TestCase):
+
+    def setUp(self):
+        super(AsgiTestCase, self).setUp()
+        mock.patch("notify.asgi.api.CACHE", registry.Registry()).start()
+
+    def call(self, scope, messages):
+        sent = []
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(asgi.app(
+            scope, lambda: _done(messages.pop(0)),
+            lambda message: _done(sent.append(message))))
+        return sent
+
+    def request(self, method, path, body=b"", query=b"", headers=()):
+        scope = {"type": "http", "method": method, "path": path,
+                 "query_string": query, "headers": list(headers)}
+        start, body = self.call(scope, [{"type": "http.request",
+                                         "body": body[:5],
+                                         "more_body": True},
+                                        {"type": "http.request",
+                                         "body": body[5:]}])
+        self.assertEqual("http.response.start", start["type"])
+        self.assertIn((b"content-type", b"application/json"),
+                      start["headers"])
+        return start["status"], json.loads(body["body"].decode())
+
+    def make_driver(self, **kwargs):
+        drv = driver.Driver({})
+        drv.notify = mock.Mock(**kwargs)
+        return drv
+
+    def test_lifespan(self):
+        sent = self.call({"type": "lifespan"},
+                         [{"type": "lifespan.startup"},
+                          {"type": "lifespan.shutdown"}])
+        self.assertEqual([{"type": "lifespan.startup.complete"},
+                          {"type": "lifespan.shutdown.complete"}], sent)
+
+    def test_not_found(self):
+        self.assertEqual((404, {"error": "Not Found"}),
+                         self.request("GET", "/unexisting/path"))
+        self.assertEqual((405, {"error": "Method Not Allowed"}),
+                         self.request("GET", "/api/v1/notify/foo"))
+
+    def test_options(self):
+        start, body = self.call(
+            {"type": "http", "method": "OPTIONS", "path": "/api/v1/breakers"},
+            [])
+        self.assertEqual(200, start["status"])
+        self.assertIn((b"allow", b"GET, HEAD, OPTIONS"), start["headers"])
+        self.assertEqual(b"", body["body"])
+
+    def test_get_routing_map(self):
+        self.assertEqual(self.get("/"), self.request("GET", "/"))
+
+    @mock.patch("notify.asgi.main.get_metrics_dir", return_value=None)
+    def test_get_metrics(self, mock_get_metrics_dir):
+        self.request("GET", "/api/v1/breakers")
+        start, body = self.call({"type": "http", "method": "GET",
+                                 "path": "/metrics"},
+                                [{"type": "http.request"}])
+        self.assertEqual(200, start["status"])
+        self.assertIn((b"content-type", asgi.metrics.CONTENT_TYPE.encode()),
+                      start["headers"])
+        self.assertIn(b"notify_requests_total{route=\"/api/v1/breakers\","
+                      b"code=\"200\"}", body["body"])
+
+    def test_send_notification_bad_request(self):
+        self.assertEqual((400, {"error": "Missed Payload"}),
+                         self.request("POST", "/api/v1/notify/foo"))
+        code, resp = self.request("POST", "/api/v1/notify/foo", b"{\"a\": 1}")
+        self.assertEqual(400, code)
+        self.assertIn("Bad Payload", resp["error"])
+
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification(self, mock_get_driver, mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}},
+                                "b2": {"bar": {"x": 2}}}}
+        drivers = {"foo": self.make_driver(return_value=True),
+                   "bar": self.make_driver(side_effect=ValueError("Spam!"))}
+        mock_get_driver.side_effect = lambda name, conf: drivers[name]
+
+        code, resp = self.request("POST", "/api/v1/notify/b1,b2",
+                                  json.dumps(self.payload).encode())
+        self.assertEqual(200, code)
+        expected = {"payload": self.payload,
+                    "total": 2, "errors": 1, "failed": 0, "throttled": 0,
+                    "passed": 1,
+                    "result": {"b1": {"foo": {"status": True}},
+                               "b2": {"bar": {"error":
+                                              "Something has went wrong!"}}}}
+        self.assertEqual(expected, resp)
+        drivers["foo"].notify.assert_called_once_with(self.payload)
+
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_compact(self, mock_get_driver, mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        mock_get_driver.return_value = self.make_driver(
+            side_effect=[True, False])
+        body = json.dumps(self.payload).encode()
+
+        code, resp = self.request("POST", "/api/v1/notify/b1", body,
+                                  headers=[(b"prefer", b"return=minimal")])
+        self.assertEqual(200, code)
+        self.assertEqual({"total": 1, "passed": 1, "failed": 0, "errors": 0,
+                          "throttled": 0}, resp)
+
+        code, resp = self.request("POST", "/api/v1/notify/b1", body,
+                                  b"compact=1")
+        self.assertEqual(200, code)
+        self.assertEqual({"b1": {"foo": {"status": False}}}, resp["result"])
+        self.assertEqual(self.payload, resp["payload"])
+
+    @mock.patch("notify.tracing.get_settings",
+                return_value={"sample_rate": 0, "file": None, "inline": True})
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_trace(self, mock_get_driver, mock_config,
+                                     mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        mock_get_driver.return_value = self.make_driver(return_value=True)
+
+        code, resp = self.request("POST", "/api/v1/notify/b1",
+                                  json.dumps(self.payload).encode(),
+                                  query=b"trace=1")
+        self.assertEqual(200, code)
+        spans = dict((span["name"], span) for span in resp.pop("trace"))
+        self.assertEqual(["get_driver", "notify", "request",
+                          "validate_payload"], sorted(spans))
+        self.assertEqual(spans["request"]["id"],
+                         spans["notify"]["parent_id"])
+        self.assertEqual(1, resp["passed"])
+
+    @mock.patch("notify.asgi.executor.get_settings")
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_timed_out(self, mock_get_driver, mock_config,
+                                         mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"slow": {"x": 1}}}}
+        mock_get_settings.return_value = {"driver_timeout": 0.05,
+                                          "request_timeout": 5}
+        release = threading.Event()
+        self.addCleanup(release.set)
+        mock_get_driver.return_value = self.make_driver(
+            side_effect=lambda payload: release.wait(5))
+
+        code, resp = self.request("POST", "/api/v1/notify/b1",
+                                  json.dumps(self.payload).encode())
+        self.assertEqual(200, code)
+        self.assertEqual({"slow": {"error": "Driver has timed out"}},
+                         resp["result"]["b1"])
+
+    @mock.patch("notify.asgi.api.get_retry_store")
+    @mock.patch("notify.asgi.api._get_breaker")
+    @mock.patch("notify.asgi.executor.get_settings")
+    @mock.patch("notify.driver.get_driver")
+    def test_deliver_timed_out(self, mock_get_driver, mock_get_settings,
+                               mock_get_breaker, mock_get_retry_store):
+        mock_get_settings.return_value = {"driver_timeout": 0.05,
+                                          "request_timeout": 5, "workers": 4}
+        circuit = breaker.CircuitBreaker(threshold=1, reset_timeout=60)
+        mock_get_breaker.return_value = circuit
+        store = mock_get_retry_store.return_value
+        releases = [threading.Event(), threading.Event()]
+        for release in releases:
+            self.addCleanup(release.set)
+        outcomes = iter(zip(releases, [False, True]))
+
+        def notify(payload):
+            release, status = next(outcomes)
+            release.wait(5)
+            return status
+
+        drv = self.make_driver(side_effect=notify)
+        mock_get_driver.return_value = drv
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        def deliver():
+            return loop.run_until_complete(asgi.deliver(
+                {"b1"}, self.payload, {"b1": {"slow": {"x": 1}}}))["result"]
+
+        def run_until(predicate):
+            for i in range(500):
+                if predicate():
+                    return True
+                loop.run_until_complete(asyncio.sleep(0.01))
+            return False
+
+        # Outcome of timed out call is recorded when it is done
+        self.assertEqual({"b1": {"slow": {"error": "Driver has timed out"}}},
+                         deliver())
+        self.assertEqual("closed", circuit.state)
+        releases[0].set()
+        self.assertTrue(run_until(lambda: store.add.called))
+        store.add.assert_called_once_with("b1", "slow", self.payload, None)
+        self.assertEqual("open", circuit.state)
+
+        # Timed out probe keeps circuit half-open until it is done
+        circuit.opened_at -= 60
+        self.assertEqual({"b1": {"slow": {"error": "Driver has timed out"}}},
+                         deliver())
+        self.assertEqual("half-open", circuit.state)
+        self.assertEqual({"b1": {"slow": {"error": asgi.api.CIRCUIT_OPEN}}},
+                         deliver())
+        releases[1].set()
+        self.assertTrue(run_until(lambda: circuit.state == "closed"))
+        self.assertEqual([mock.call("b1", "slow", self.payload, None),
+                          mock.call("b1", "slow", self.payload,
+                                    asgi.api.CIRCUIT_OPEN)],
+                         store.add.mock_calls)
+        self.assertEqual(2, drv.notify.call_count)
+
+    @mock.patch("notify.asgi.api.get_retry_store")
+    @mock.patch("notify.api.v1.api.get_job_queue")
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_notification_blocking_calls(
+            self, mock_get_driver, mock_config, mock_get_job_queue,
+            mock_get_retry_store):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        threads = []
+
+        def blocking(value):
+            def call(*args):
+                threads.append(threading.current_thread())
+                return value
+            return call
+
+        mock_get_driver.side_effect = blocking(
+            self.make_driver(return_value=False))
+        mock_get_job_queue.return_value.put.side_effect = blocking("job_id")
+        mock_get_retry_store.return_value.add.side_effect = blocking(None)
+        body = json.dumps(self.payload).encode()
+
+        code, resp = self.request("POST", "/api/v1/notify/b1", body)
+        self.assertEqual({"foo": {"status": False}}, resp["result"]["b1"])
+        self.assertEqual((202, {"job": "job_id"}),
+                         self.request("POST", "/api/v1/notify/b1", body,
+                                      b"async=1"))
+        self.assertEqual(3, len(threads))
+        self.assertNotIn(threading.main_thread(), threads)
+        mock_get_driver.assert_called_once_with("foo", {"x": 1})
+
+    @mock.patch("notify.api.v1.api.get_job_queue")
+    @mock.patch("notify.asgi.config")
+    def test_send_notification_async(self, mock_config, mock_get_job_queue):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {}}}
+        mock_get_job_queue.return_value.put.return_value = "job_id"
+        self.assertEqual((202, {"job": "job_id"}),
+                         self.request("POST", "/api/v1/notify/b1",
+                                      json.dumps(self.payload).encode(),
+                                      b"async=1"))
+
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_batch_notification(self, mock_get_driver, mock_config):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        mock_get_driver.return_value = self.make_driver(
+            side_effect=[True, False])
+        data = "\n".join(json.dumps(p) for p in (self.payload, {"foo": 1},
+                                                 self.payload))
+
+        code, resp = self.request("POST", "/api/v1/notify/b1/batch",
+                                  data.encode())
+        self.assertEqual(200, code)
+        self.assertEqual({"total": 2, "passed": 1, "failed": 1, "errors": 0,
+                          "throttled": 0}, dict((k, v) for k, v in
+                                                resp.items() if k != "items"))
+        self.assertEqual({"b1": {"foo": {"status": True}}},
+                         resp["items"][0]["result"])
+        self.assertIn("Bad Payload", resp["items"][1]["error"])
+        self.assertEqual({"b1": {"foo": {"status": False}}},
+                         resp["items"][2]["result"])
+
+        code, resp = self.request("POST", "/api/v1/notify/b1/batch", b"[")
+        self.assertEqual(400, code)
+        self.assertIn("Bad Batch", resp["error"])
+
+    @mock.patch("notify.asgi.executor.get_settings")
+    @mock.patch("notify.asgi.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_send_stream_notification(self, mock_get_driver, mock_config,
+                                      mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"foo": {"x": 1}}}}
+        mock_get_settings.return_value = {
+            "workers": 4, "driver_timeout": 10, "request_timeout": 10,
+            "stream_in_flight": 2, "max_line_size": 150}
+        mock_get_driver.return_value = self.make_driver(
+            side_effect=[True, False])
+        data = "\n".join([json.dumps(self.payload), "{", "x" * 200,
+                          json.dumps(self.payload)]).encode()
+        scope = {"type": "http", "method": "POST",
+                 "path": "/api/v1/notify/b1/stream"}
+        messages = [{"type": "http.request", "body": data[i:i + 7],
+                     "more_body": i + 7 < len(data)}
+                    for i in range(0, len(data), 7)]
+
+        sent = self.call(scope, messages)
+        self.assertEqual(200, sent[0]["status"])
+        self.assertIn((b"content-type", b"application/x-ndjson"),
+                      sent[0]["headers"])
+        self.assertTrue(all(message["more_body"] for message in sent[1:-1]))
+        self.assertFalse(sent[-1].get("more_body", False))
+        items = [json.loads(message["body"].decode())
+                 for message in sent[1:]]
+        self.assertEqual({"b1": {"foo": {"status": True}}},
+                         items[0]["result"])
+        self.assertIn("Bad Payload", items[1]["error"])
+        self.assertEqual({"line": 3, "error": "Line is too long"}, items[2])
+        self.assertEqual({"b1": {"foo": {"status": False}}},
+                         items[3]["result"])
+        self.assertEqual({"lines": 4, "rejected": 2, "total": 2,
+                          "passed": 1, "failed": 1, "errors": 0,
+                          "throttled": 0}, items[4])
+
+        sent = self.call(dict(scope, path="/api/v1/notify/b2/stream"),
+                         [{"type": "http.request", "body": b"{}"}])
+        self.assertEqual(400, sent[0]["status"])
+
+    @mock.patch("notify.api.v1.api.get_job_queue")
+    def test_get_job(self, mock_get_job_queue):
+        mock_get_job_queue.return_value.get.return_value = {"id": "foo",
+                                                            "status": "done"}
+        self.assertEqual((200, {"id": "foo", "status": "done"}),
+                         self.request("GET", "/api/v1/jobs/foo"))
+        mock_get_job_queue.return_value.get.assert_called_once_with("foo")
+
+        mock_get_job_queue.return_value = None
+        self.assertEqual((404, {"error": "Job not found"}),
+                         self.request("GET", "/api/v1/jobs/foo"))
+
+    def test_get_breakers(self):
+        circuit = mock.Mock()
+        circuit.to_dict.return_value = {"state": "closed", "failures": 0}
+        with mock.patch.dict("notify.asgi.api.BREAKERS", {"k": circuit},
+                             clear=True):
+            self.assertEqual(
+                (200, {"breakers": {"k": {"state": "closed",
+                                          "failures": 0}}}),
+                self.request("GET", "/api/v1/breakers"))
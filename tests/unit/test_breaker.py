@@ -0,0 +1,78 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from notify import breaker
+from tests.unit import test
+
+
+@mock.patch("notify.breaker.time.time")
+class CircuitBreakerTestCase(test.TestCase):
+
+    def test_opens_after_threshold(self, mock_time):
+        mock_time.return_value = 100
+        circuit = breaker.CircuitBreaker(threshold=3, reset_timeout=10)
+        for i in range(2):
+            self.assertTrue(circuit.allow())
+            circuit.record(False)
+        circuit.record(True)
+        for i in range(3):
+            self.assertTrue(circuit.allow())
+            circuit.record(False)
+        self.assertFalse(circuit.allow())
+        self.assertEqual({"state": "open", "failures": 3, "retry_at": 110},
+                         circuit.to_dict())
+
+    def test_half_open(self, mock_time):
+        mock_time.return_value = 100
+        circuit = breaker.CircuitBreaker(threshold=1, reset_timeout=10)
+        circuit.record(False)
+        self.assertEqual("open", circuit.state)
+
+        mock_time.return_value = 110
+        self.assertTrue(circuit.allow())
+        self.assertEqual("half-open", circuit.state)
+        self.assertFalse(circuit.allow())
+        circuit.record(False)
+        self.assertEqual({"state": "open", "failures": 2, "retry_at": 120},
+                         circuit.to_dict())
+
+        mock_time.return_value = 120
+        self.assertTrue(circuit.allow())
+        circuit.record(True)
+        self.assertEqual({"state": "closed", "failures": 0},
+                         circuit.to_dict())
+        self.assertTrue(circuit.allow())
+
+    def test_half_open_probe_lost(self, mock_time):
+        mock_time.return_value = 100
+        circuit = breaker.CircuitBreaker(threshold=1, reset_timeout=10)
+        circuit.record(False)
+
+        mock_time.return_value = 110
+        self.assertTrue(circuit.allow())
+        mock_time.return_value = 119
+        self.assertFalse(circuit.allow())
+        mock_time.return_value = 120
+        self.assertFalse(circuit.allow())
+        self.assertEqual({"state": "open", "failures": 2, "retry_at": 130},
+                         circuit.to_dict())
+
+        mock_time.return_value = 130
+        self.assertTrue(circuit.allow())
+        self.assertEqual("half-open", circuit.state)
+        circuit.record(True)
+        self.assertEqual("closed", circuit.state)
@@ -0,0 +1,58 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+import mock
+
+from notify import codec
+from tests.unit import test
+
+
+class CodecTestCase(test.TestCase):
+
+    def setUp(self):
+        super(CodecTestCase, self).setUp()
+        self.addCleanup(codec.use, codec.NAME)
+
+    def test_name(self):
+        self.assertIn(codec.NAME, codec.CODECS)
+        if codec.orjson:
+            self.assertEqual("orjson", codec.NAME)
+
+    def test_codecs(self):
+        for name in codec.CODECS:
+            self._test_codec(name)
+
+    def _test_codec(self, name):
+        codec.use(name)
+        self.assertEqual(name, codec.NAME)
+
+        obj = {"what": u"Hooray! \u2603", "url": "http://x/y",
+               "hosts": ["h1", "h2"], "count": 3, "ratio": 0.5,
+               "ok": True, "none": None}
+        data = codec.dumps(obj)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(obj, json.loads(data.decode("utf-8")))
+        self.assertEqual(obj, codec.loads(data))
+        self.assertEqual(obj, codec.loads(data.decode("utf-8")))
+        self.assertEqual([1], codec.loads(b"[1]"))
+
+        for bad in (b"{", b"", b"[1,]", b"\xff"):
+            self.assertRaises(ValueError, codec.loads, bad)
+
+    def test_use_unknown(self):
+        with mock.patch.dict(codec.CODECS, clear=True):
+            self.assertRaises(KeyError, codec.use, "orjson")
@@ -13,6 +13,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+import os
+import shutil
+import tempfile
+
 import mock
 
 from notify import config
@@ -54,3 +59,76 @@ class ConfigTestCase(test.TestCase):
     def test_get_config_cached(self):
         with mock.patch.object(config, "CONF", 42):
             self.assertEqual(42, config.get_config())
+
+
+class ReloadTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ReloadTestCase, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "config.json")
+        mock.patch.dict("os.environ", {"NOTIFY_CONF": self.path}).start()
+        mock.patch.object(config, "CONF", {"flask": {},
+                                           "notify_backends": {}}).start()
+        self.hook = mock.Mock()
+        mock.patch.object(config, "RELOAD_HOOKS", [self.hook]).start()
+
+    def _write(self, cfg):
+        with open(self.path, "w") as f:
+            f.write(cfg if isinstance(cfg, str) else json.dumps(cfg))
+
+    def test_reload_config(self):
+        old = config.CONF
+        new = {"flask": {"PORT": 42}, "notify_backends": {"b": {}}}
+        self._write(new)
+        self.assertTrue(config.reload_config())
+        self.assertEqual(new, config.get_config())
+        self.hook.assert_called_once_with(old, new)
+
+        self.hook.side_effect = ValueError
+        self.assertTrue(config.reload_config())
+
+    def test_reload_config_keeps_current(self):
+        old = config.CONF
+        self.assertFalse(config.reload_config())
+        for cfg in ("{", {"flask": {}}, {"flask": {"PORT": "foo"},
+                                         "notify_backends": {}}):
+            self._write(cfg)
+            self.assertFalse(config.reload_config())
+        self.assertIs(old, config.get_config())
+        self.assertFalse(self.hook.called)
+
+    @mock.patch("notify.config.reload_config")
+    @mock.patch("notify.config.threading.Thread")
+    @mock.patch("notify.config.time.sleep")
+    def test_watch(self, mock_sleep, mock_thread, mock_reload_config):
+        config.watch(5)
+        run = mock_thread.call_args[1]["target"]
+        mock_thread.return_value.start.assert_called_once_with()
+
+        def stop():
+            raise KeyboardInterrupt()
+
+        changes = [lambda: None, lambda: self._write({}),
+                   lambda: None, lambda: os.utime(self.path, (1, 1)), stop]
+        mock_sleep.side_effect = lambda interval: changes.pop(0)()
+        self.assertRaises(KeyboardInterrupt, run)
+        self.assertEqual(2, mock_reload_config.call_count)
+        mock_sleep.assert_called_with(5)
+
+    @mock.patch("notify.config.reload_config")
+    @mock.patch("notify.config.threading.Thread")
+    @mock.patch("notify.config.signal.signal")
+    def test_handle_sighup(self, mock_signal, mock_thread,
+                           mock_reload_config):
+        self.assertTrue(config.handle_sighup())
+        signum, handler = mock_signal.call_args[0]
+        self.assertEqual(config.signal.SIGHUP, signum)
+        handler(signum, None)
+        mock_thread.assert_called_once_with(
+            target=mock_reload_config, name="notify-config-reload")
+        mock_thread.return_value.start.assert_called_once_with()
+
+        mock_signal.side_effect = ValueError
+        self.assertFalse(config.handle_sighup())
@@ -0,0 +1,104 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from notify import dedup
+from tests.unit import test
+
+
+@mock.patch("notify.dedup.time.time")
+class CoalescerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(CoalescerTestCase, self).setUp()
+        self.deliver = mock.Mock()
+        self.coalescer = dedup.Coalescer(60, self.deliver)
+        self.coalescer._start = mock.Mock()
+
+    def test_add(self, mock_time):
+        mock_time.return_value = 100
+        self.assertEqual(0, self.coalescer.add(["b"], self.payload))
+        self.coalescer._start.assert_called_once_with()
+        self.assertEqual(1, self.coalescer.add(["b"], self.payload))
+        self.assertEqual(2, self.coalescer.add(["b"], self.payload))
+
+        other = dict(self.payload, severity="CRITICAL")
+        self.assertEqual(0, self.coalescer.add(["b"], other))
+        self.assertEqual(0, self.coalescer.add(["a", "b"], self.payload))
+        self.assertEqual(1, self.coalescer.add(["b", "a"], self.payload))
+        self.assertFalse(self.deliver.called)
+
+    def test_flush_expired(self, mock_time):
+        mock_time.return_value = 100
+        self.coalescer.add(["b"], self.payload)
+        self.coalescer.add(["b"], dict(self.payload,
+                                       affected_hosts=["h2", "h1"]))
+        self.coalescer.add(["b"], dict(self.payload, affected_hosts=["h3"]))
+        self.coalescer.add(["c"], self.payload)
+
+        mock_time.return_value = 159
+        self.coalescer.flush_expired()
+        self.assertFalse(self.deliver.called)
+
+        mock_time.return_value = 160
+        self.coalescer.flush_expired()
+        description = ("This is a test data.\n\n"
+                       "Repeated 2 time(s) within 60 seconds")
+        self.deliver.assert_called_once_with(
+            ["b"], dict(self.payload, description=description,
+                        affected_hosts=["h1", "h2", "h3"]))
+        self.assertEqual({}, self.coalescer._entries)
+
+    def test_flush_expired_unhashable_hosts(self, mock_time):
+        mock_time.return_value = 100
+        self.coalescer.add(["b"], self.payload)
+        self.coalescer.add(["b"], dict(self.payload,
+                                       affected_hosts=[{"name": "h1"}, "h2"]))
+        self.coalescer.add(["b"], dict(self.payload,
+                                       affected_hosts=[{"name": "h1"}, 3]))
+
+        mock_time.return_value = 160
+        self.coalescer.flush_expired()
+        description = ("This is a test data.\n\n"
+                       "Repeated 2 time(s) within 60 seconds")
+        self.deliver.assert_called_once_with(
+            ["b"], dict(self.payload, description=description,
+                        affected_hosts=[{"name": "h1"}, "h2", 3]))
+
+    def test_add_after_window(self, mock_time):
+        mock_time.return_value = 100
+        self.coalescer.add(["b"], self.payload)
+        self.coalescer.add(["b"], self.payload)
+        mock_time.return_value = 200
+        self.assertEqual(0, self.coalescer.add(["b"], self.payload))
+        self.assertFalse(self.deliver.called)
+        self.assertEqual(1, self.coalescer.add(["b"], self.payload))
+
+        self.coalescer.flush_expired()
+        self.assertEqual(1, self.deliver.call_count)
+        self.assertEqual(1, self.deliver.call_args[0][1][
+            "description"].count("Repeated 1 time(s)"))
+        self.assertEqual([], self.coalescer._expired)
+        self.assertEqual(1, len(self.coalescer._entries))
+
+    def test_flush_error(self, mock_time):
+        mock_time.return_value = 100
+        self.deliver.side_effect = ValueError
+        self.coalescer.add(["b"], self.payload)
+        self.coalescer.add(["b"], self.payload)
+        mock_time.return_value = 200
+        self.coalescer.flush_expired()
+        self.assertEqual(1, self.deliver.call_count)
@@ -14,6 +14,7 @@
 #    under the License.
 
 import mock
+import testtools
 
 from notify import driver
 from tests.unit import test
@@ -21,8 +22,9 @@ from tests.unit import test
 
 class ModuleTestCase(test.TestCase):
 
+    @mock.patch("notify.driver.get_entry_points", return_value={})
     @mock.patch("notify.driver.importlib.import_module")
-    def test_get_driver(self, mock_import_module):
+    def test_get_driver(self, mock_import_module, mock_get_entry_points):
         foo, bar = mock.Mock(), mock.Mock()
         foo.Driver.return_value = "foo_driver"
         bar.Driver.return_value = "bar_driver"
@@ -54,6 +56,58 @@ class ModuleTestCase(test.TestCase):
         mock_import_module.side_effect = ImportError
         self.assertRaises(RuntimeError, driver.get_driver, "spam", {"arg": 1})
 
+    @mock.patch("notify.driver.importlib.import_module")
+    @mock.patch("notify.driver.get_entry_points")
+    def test_load_driver(self, mock_get_entry_points, mock_import_module):
+        entry_point = mock.Mock()
+        mock_get_entry_points.return_value = {"foo": entry_point}
+        self.assertEqual(entry_point.load.return_value,
+                         driver.load_driver("foo"))
+        self.assertFalse(mock_import_module.called)
+
+        self.assertEqual(mock_import_module.return_value.Driver,
+                         driver.load_driver("bar"))
+        mock_import_module.assert_called_once_with("notify.drivers.bar")
+
+    @mock.patch("notify.driver.importlib_metadata")
+    def test_get_entry_points(self, mock_importlib_metadata):
+        foo, bar = mock.Mock(), mock.Mock()
+        foo.name, bar.name = "foo", "bar"
+        entry_points = mock_importlib_metadata.entry_points.return_value
+        entry_points.select.return_value = [foo, bar]
+        with mock.patch.object(driver, "ENTRY_POINTS", None):
+            self.assertEqual({"foo": foo, "bar": bar},
+                             driver.get_entry_points())
+            driver.get_entry_points()
+        mock_importlib_metadata.entry_points.assert_called_once_with()
+        entry_points.select.assert_called_once_with(group="notify.drivers")
+
+    def test_get_validator(self):
+        schema = {"type": "object"}
+        validator = driver.get_validator(schema)
+        self.assertIs(schema, validator.schema)
+        self.assertIs(validator, driver.get_validator(schema))
+        self.assertIsNot(validator, driver.get_validator({"type": "object"}))
+        self.assertRaises(driver.jsonschema.SchemaError,
+                          driver.get_validator, {"type": 42})
+
+    def test_validate(self):
+        schema = {"type": "object", "required": ["foo"]}
+        self.assertIsNone(driver.validate({"foo": 1}, schema))
+        e = self.assertRaises(ValueError, driver.validate, {}, schema)
+        self.assertIn("'foo' is a required property", str(e))
+
+
+class StatusTestCase(test.TestCase):
+
+    def test_status(self):
+        status = driver.Status(True, refused={"a@b": "550 No"})
+        self.assertTrue(status)
+        self.assertEqual({"status": True, "refused": {"a@b": "550 No"}},
+                         status.to_dict())
+        self.assertFalse(driver.Status(False))
+        self.assertEqual({"status": False}, driver.Status(0).to_dict())
+
 
 class DriverTestCase(test.TestCase):
 
@@ -63,6 +117,50 @@ class DriverTestCase(test.TestCase):
         self.assertRaises(ValueError,
                           driver.Driver.validate_payload, self.payload)
 
+    @mock.patch("notify.driver.validate")
+    def test_validate_payload_fast_path(self, mock_validate):
+        driver.Driver.validate_payload(self.payload)
+        self.assertFalse(mock_validate.called)
+
+        self.payload["foo"] = "bar"
+        driver.Driver.validate_payload(self.payload)
+        mock_validate.assert_called_once_with(self.payload,
+                                              driver.Driver.PAYLOAD_SCHEMA)
+
+        class Custom(driver.Driver):
+            PAYLOAD_SCHEMA = {"type": "object"}
+
+        mock_validate.reset_mock()
+        Custom.validate_payload(self.payload)
+        mock_validate.assert_called_once_with(self.payload,
+                                              Custom.PAYLOAD_SCHEMA)
+
+    def test__is_valid_payload(self):
+        valid = [self.payload,
+                 dict(self.payload, affected_hosts=[]),
+                 dict(self.payload, affected_hosts=["a", 1]),
+                 dict(self.payload, severity="DOWN")]
+        invalid = [None, [], "foo",
+                   dict(self.payload, foo="bar"),
+                   dict(self.payload, severity="FOO"),
+                   dict(self.payload, severity=["INFO"]),
+                   dict(self.payload, region=42),
+                   dict(self.payload, description=None),
+                   dict(self.payload, affected_hosts="foo")]
+        for key in self.payload:
+            payload = dict(self.payload)
+            del payload[key]
+            invalid.append(payload)
+
+        for payload in valid:
+            self.assertTrue(driver._is_valid_payload(payload))
+            self.assertIsNone(driver.validate(payload,
+                                              driver.Driver.PAYLOAD_SCHEMA))
+        for payload in invalid:
+            self.assertFalse(driver._is_valid_payload(payload))
+            self.assertRaises(ValueError, driver.validate, payload,
+                              driver.Driver.PAYLOAD_SCHEMA)
+
     def test_validate_config(self):
         self.assertIsNone(driver.Driver.validate_config({}))
         for cfg in (None, [], 42, "foo"):
@@ -71,3 +169,30 @@ class DriverTestCase(test.TestCase):
     def test_notify(self):
         drv = driver.Driver({})
         self.assertRaises(NotImplementedError, drv.notify, self.payload)
+
+    def test_close(self):
+        self.assertIsNone(driver.Driver({}).close())
+
+    @testtools.skipIf(driver.asyncio is None, "asyncio is not available")
+    def test_notify_async(self):
+        drv = driver.Driver({})
+        drv.notify = mock.Mock(return_value=True)
+        self.assertEqual(driver.executor.get_executor(),
+                         drv.get_async_executor())
+
+        loop = driver.asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        driver.asyncio.set_event_loop(loop)
+        self.addCleanup(driver.asyncio.set_event_loop, None)
+        self.assertTrue(loop.run_until_complete(
+            drv.notify_async(self.payload)))
+        drv.notify.assert_called_once_with(self.payload)
+
+    def test_notify_many(self):
+        drv = driver.Driver({})
+        error = ValueError("foo")
+        drv.notify = mock.Mock(side_effect=[True, error, False])
+        self.assertEqual([True, error, False],
+                         drv.notify_many(["p1", "p2", "p3"]))
+        self.assertEqual([mock.call("p1"), mock.call("p2"), mock.call("p3")],
+                         drv.notify.mock_calls)
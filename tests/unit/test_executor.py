@@ -0,0 +1,59 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from notify import executor
+from tests.unit import test
+
+
+class ExecutorTestCase(test.TestCase):
+
+    @mock.patch("notify.executor.config")
+    def test_get_settings(self, mock_config):
+        mock_config.get_config.return_value = {}
+        self.assertEqual({"workers": 16, "driver_timeout": 30,
+                          "request_timeout": 60, "batch_size": 1000,
+                          "stream_in_flight": 32,
+                          "max_line_size": 1048576},
+                         executor.get_settings())
+
+        mock_config.get_config.return_value = {
+            "dispatch": {"workers": 4, "driver_timeout": 1.5}}
+        self.assertEqual({"workers": 4, "driver_timeout": 1.5,
+                          "request_timeout": 60, "batch_size": 1000,
+                          "stream_in_flight": 32,
+                          "max_line_size": 1048576},
+                         executor.get_settings())
+
+    @mock.patch("notify.executor.futures.ThreadPoolExecutor")
+    @mock.patch("notify.executor.get_settings")
+    def test_get_executor(self, mock_get_settings, mock_pool):
+        mock_get_settings.return_value = {"workers": 7}
+        with mock.patch.object(executor, "EXECUTOR", None):
+            pool = executor.get_executor()
+            self.assertEqual(mock_pool.return_value, pool)
+            self.assertEqual(pool, executor.get_executor())
+        mock_pool.assert_called_once_with(max_workers=7)
+
+    @mock.patch("notify.executor.futures.ThreadPoolExecutor")
+    @mock.patch("notify.executor.get_settings")
+    def test_get_stream_executor(self, mock_get_settings, mock_pool):
+        mock_get_settings.return_value = {"workers": 7}
+        with mock.patch.object(executor, "STREAM_EXECUTOR", None):
+            pool = executor.get_stream_executor()
+            self.assertEqual(mock_pool.return_value, pool)
+            self.assertEqual(pool, executor.get_stream_executor())
+        mock_pool.assert_called_once_with(max_workers=7)
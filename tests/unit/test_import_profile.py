@@ -0,0 +1,72 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+import mock
+
+from notify import import_profile
+from tests.unit import test
+
+
+class ImportProfileTestCase(test.TestCase):
+
+    def test_profile(self):
+        result = import_profile.profile(["dummy_pass", "dummy_fail"])
+        self.assertEqual(["modules", "seconds"], sorted(result))
+        self.assertGreater(result["modules"], 0)
+
+        result = import_profile.profile(["no_such_driver"])
+        self.assertIn("No module named", result["error"])
+
+    @mock.patch("notify.config.get_config")
+    def test_get_configured_drivers(self, mock_get_config):
+        mock_get_config.return_value = {"notify_backends": {
+            "b1": {"foo": {}, "bar": {}}, "b2": {"foo": {}}}}
+        self.assertEqual(["bar", "foo"],
+                         import_profile.get_configured_drivers())
+
+    @mock.patch("notify.driver.get_entry_points")
+    def test_get_all_drivers(self, mock_get_entry_points):
+        mock_get_entry_points.return_value = {"third_party": mock.Mock()}
+        names = import_profile.get_all_drivers()
+        self.assertIn("third_party", names)
+        self.assertIn("sfdc", names)
+        self.assertIn("dummy_pass", names)
+
+    @mock.patch("notify.import_profile.get_source")
+    @mock.patch("notify.import_profile.profile")
+    def test_main(self, mock_profile, mock_get_source):
+        mock_get_source.side_effect = lambda name: "mod." + name
+        results = {"foo": {"seconds": 0.1, "modules": 10},
+                   "bar": {"seconds": 0.3, "modules": 20}}
+        mock_profile.side_effect = lambda names: dict(
+            results[names[0]] if len(names) == 1 else
+            {"seconds": 0.35, "modules": 25})
+
+        with mock.patch("sys.stdout") as mock_stdout:
+            self.assertEqual(0, import_profile.main(
+                ["foo", "bar", "--json", "--budget", "0.5"]))
+        output = json.loads("".join(c[1][0] for c in
+                                    mock_stdout.write.mock_calls))
+        self.assertEqual(["bar", "foo", "total"],
+                         [r["driver"] for r in output])
+        self.assertEqual("mod.bar", output[0]["source"])
+
+        with mock.patch("sys.stdout"), mock.patch("sys.stderr") as stderr:
+            self.assertEqual(1, import_profile.main(
+                ["foo", "bar", "--budget", "0.2"]))
+        stderr.write.assert_called_once_with(
+            "Driver 'bar' is over budget: 0.300s > 0.2s\n")
@@ -0,0 +1,92 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from notify import jobs
+from tests.unit import test
+
+
+class JobQueueTestCase(test.TestCase):
+
+    def setUp(self):
+        super(JobQueueTestCase, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "jobs.sqlite")
+        self.handler = mock.Mock(return_value={"passed": 1})
+
+    def test_put_and_get(self):
+        queue = jobs.JobQueue(self.path, self.handler)
+        job_id = queue.put(["foo"], self.payload)
+        self.assertEqual({"id": job_id, "status": "queued"},
+                         queue.get(job_id))
+        self.assertIsNone(queue.get("unexisting"))
+
+    def test_process_one(self):
+        queue = jobs.JobQueue(self.path, self.handler)
+        self.assertFalse(queue.process_one())
+
+        first = queue.put(["foo"], self.payload)
+        second = queue.put(["bar", "spam"], self.payload)
+        self.assertTrue(queue.process_one())
+        self.handler.assert_called_once_with(["foo"], self.payload)
+        self.assertEqual({"id": first, "status": "done",
+                          "result": {"passed": 1}}, queue.get(first))
+        self.assertEqual("queued", queue.get(second)["status"])
+
+        self.handler.side_effect = ValueError
+        self.assertTrue(queue.process_one())
+        self.assertEqual({"id": second, "status": "done",
+                          "result": {"error": "Something has went wrong!"}},
+                         queue.get(second))
+        self.assertFalse(queue.process_one())
+
+    def test_claim_is_durable_and_exclusive(self):
+        job_id = jobs.JobQueue(self.path, self.handler).put(["foo"], {})
+        queue = jobs.JobQueue(self.path, self.handler)
+        self.assertEqual((job_id, ["foo"], {}), queue.claim())
+        self.assertEqual("running", queue.get(job_id)["status"])
+        self.assertIsNone(queue.claim())
+
+    def test_claim_requeues_stale_jobs(self):
+        queue = jobs.JobQueue(self.path, self.handler, stale_after=-1)
+        job_id = queue.put(["foo"], {})
+        self.assertEqual(job_id, queue.claim()[0])
+        self.assertEqual(job_id, queue.claim()[0])
+
+    def test_start(self):
+        queue = jobs.JobQueue(self.path, self.handler, workers=1,
+                              poll_interval=0.01)
+        job_id = queue.put(["foo"], self.payload)
+        queue.start()
+        self.addCleanup(queue.stop)
+        queue.start()
+        self.assertEqual(1, len(queue._threads))
+        for i in range(500):
+            if queue.get(job_id)["status"] == "done":
+                break
+            queue._wakeup.wait(0.01)
+        self.assertEqual("done", queue.get(job_id)["status"])
+
+    def test_stop(self):
+        queue = jobs.JobQueue(self.path, self.handler, workers=2)
+        queue.start()
+        queue.stop()
+        self.assertEqual([], queue._threads)
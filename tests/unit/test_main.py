@@ -13,9 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+
 import mock
 
 from notify import main
+from notify import metrics
 from tests.unit import test
 
 
@@ -40,7 +43,76 @@ class MainTestCase(test.TestCase):
     def test_api_map(self):
         code, resp = self.get("/")
         self.assertEqual(200, code)
-        self.assertEqual(1, len(resp))
+        self.assertEqual(7, len(resp))
         self.assertIn({"endpoint": "notify.send_notification",
                        "methods": ["OPTIONS", "POST"],
                        "uri": "/api/v1/notify/<backends>"}, resp)
+        self.assertIn({"endpoint": "notify.send_batch_notification",
+                       "methods": ["OPTIONS", "POST"],
+                       "uri": "/api/v1/notify/<backends>/batch"}, resp)
+        self.assertIn({"endpoint": "notify.send_stream_notification",
+                       "methods": ["OPTIONS", "POST"],
+                       "uri": "/api/v1/notify/<backends>/stream"}, resp)
+        self.assertIn({"endpoint": "notify.get_breakers",
+                       "methods": ["GET", "HEAD", "OPTIONS"],
+                       "uri": "/api/v1/breakers"}, resp)
+        self.assertIn({"endpoint": "get_metrics",
+                       "methods": ["GET", "HEAD", "OPTIONS"],
+                       "uri": "/metrics"}, resp)
+        self.assertIn({"endpoint": "notify.get_retries",
+                       "methods": ["GET", "HEAD", "OPTIONS"],
+                       "uri": "/api/v1/retries"}, resp)
+        self.assertIn({"endpoint": "notify.get_job",
+                       "methods": ["GET", "HEAD", "OPTIONS"],
+                       "uri": "/api/v1/jobs/<job_id>"}, resp)
+
+    @mock.patch("notify.main.get_metrics_dir", return_value=None)
+    def test_get_metrics(self, mock_get_metrics_dir):
+        self.get("/api/v1/breakers")
+        self.get("/unexisting")
+        rv = self.client.get("/metrics")
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual(metrics.CONTENT_TYPE, rv.headers["Content-Type"])
+        text = rv.data.decode()
+        self.assertIn("# TYPE notify_requests_total counter", text)
+        self.assertIn("notify_requests_total{route=\"/api/v1/breakers\","
+                      "code=\"200\"}", text)
+        self.assertIn("notify_requests_total{route=\"unmatched\","
+                      "code=\"404\"}", text)
+        self.assertIn("notify_request_duration_seconds_count{"
+                      "route=\"/api/v1/breakers\"}", text)
+
+    @mock.patch("notify.tracing.get_settings",
+                return_value={"sample_rate": 0, "file": None, "inline": True})
+    @mock.patch("notify.api.v1.api.config")
+    @mock.patch("notify.driver.get_driver")
+    def test_trace(self, mock_get_driver, mock_config, mock_get_settings):
+        mock_config.get_config.return_value = {
+            "notify_backends": {"b1": {"drvname": {"conf": 42}}}}
+        mock_get_driver.return_value.notify.return_value = True
+
+        rv = self.client.post("/api/v1/notify/b1?trace=1",
+                              data=json.dumps(self.payload),
+                              headers={"X-Request-Id": "req42"})
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual("req42", rv.headers["X-Request-Id"])
+        resp = json.loads(rv.data.decode())
+        self.assertEqual(1, resp["passed"])
+        spans = dict((span["name"], span) for span in resp["trace"])
+        self.assertEqual(["get_driver", "notify", "request",
+                          "validate_payload"], sorted(spans))
+        self.assertEqual({"backend": "b1", "driver": "drvname",
+                          "status": True}, spans["notify"]["attrs"])
+        self.assertEqual(spans["request"]["id"],
+                         spans["notify"]["parent_id"])
+        self.assertEqual(200, spans["request"]["attrs"]["code"])
+
+        rv = self.client.post("/api/v1/notify/b1",
+                              data=json.dumps(self.payload))
+        self.assertNotIn("trace", json.loads(rv.data.decode()))
+
+        mock_get_settings.return_value["inline"] = False
+        rv = self.client.post("/api/v1/notify/b1?trace=1",
+                              data=json.dumps(self.payload))
+        self.assertNotIn("trace", json.loads(rv.data.decode()))
+        self.assertEqual(32, len(rv.headers["X-Request-Id"]))
@@ -0,0 +1,106 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from notify import metrics
+from tests.unit import test
+
+
+class MetricsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        mock.patch.object(metrics, "METRICS", []).start()
+        self.counter = metrics.Counter("foo_total", "Foo help.", ["a", "b"])
+        self.histogram = metrics.Histogram("bar_seconds", "Bar help.", ["a"],
+                                           buckets=(0.1, 1))
+
+    def test_counter(self):
+        self.counter.inc(a="x", b=1)
+        self.counter.inc(2, a="x", b=1)
+        self.counter.inc(a="y", b=2)
+        self.assertEqual({("x", "1"): 3, ("y", "2"): 1},
+                         self.counter.collect())
+        self.assertRaises(KeyError, self.counter.inc, a="x")
+
+    def test_histogram(self):
+        for value in (0.05, 0.1, 0.5, 5):
+            self.histogram.observe(value, a="x")
+        self.assertEqual({("x",): [[2, 1, 1], 5.65]},
+                         self.histogram.collect())
+        self.assertEqual(
+            [("bar_seconds_bucket", (("a", "x"), ("le", "0.1")), 2),
+             ("bar_seconds_bucket", (("a", "x"), ("le", "1")), 3),
+             ("bar_seconds_bucket", (("a", "x"), ("le", "+Inf")), 4),
+             ("bar_seconds_sum", (("a", "x"),), 5.65),
+             ("bar_seconds_count", (("a", "x"),), 4)],
+            list(self.histogram.samples((("a", "x"),), [[2, 1, 1], 5.65])))
+
+    def test_render(self):
+        self.counter.inc(a="x\"y", b="z")
+        self.histogram.observe(0.5, a="x")
+        self.assertEqual(
+            "# HELP foo_total Foo help.\n"
+            "# TYPE foo_total counter\n"
+            "foo_total{a=\"x\\\"y\",b=\"z\"} 1\n"
+            "# HELP bar_seconds Bar help.\n"
+            "# TYPE bar_seconds histogram\n"
+            "bar_seconds_bucket{a=\"x\",le=\"0.1\"} 0\n"
+            "bar_seconds_bucket{a=\"x\",le=\"1\"} 1\n"
+            "bar_seconds_bucket{a=\"x\",le=\"+Inf\"} 1\n"
+            "bar_seconds_sum{a=\"x\"} 0.5\n"
+            "bar_seconds_count{a=\"x\"} 1\n",
+            metrics.get_text())
+
+    def test_dump_and_aggregate(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        other = {"foo_total": {json.dumps(["x", "1"]): 5},
+                 "bar_seconds": {json.dumps(["x"]): [[1, 0, 0], 0.05]},
+                 "removed_total": {json.dumps([]): 1}}
+        with open(os.path.join(tmpdir, "metrics-1.json"), "w") as f:
+            json.dump(other, f)
+        with open(os.path.join(tmpdir, "metrics-2.json"), "w") as f:
+            f.write("{broken")
+
+        self.counter.inc(a="x", b=1)
+        self.counter.inc(a="y", b=1)
+        self.histogram.observe(0.5, a="x")
+        text = metrics.get_text(tmpdir)
+
+        self.assertTrue(os.path.exists(
+            os.path.join(tmpdir, "metrics-{}.json".format(os.getpid()))))
+        self.assertEqual(
+            {"foo_total": {json.dumps(["x", "1"]): 6,
+                           json.dumps(["y", "1"]): 1},
+             "bar_seconds": {json.dumps(["x"]): [[1, 1, 0], 0.55]}},
+            metrics.aggregate(tmpdir))
+        self.assertIn("foo_total{a=\"x\",b=\"1\"} 6\n", text)
+        self.assertIn("bar_seconds_count{a=\"x\"} 2\n", text)
+
+    @mock.patch("notify.metrics.threading.Thread")
+    @mock.patch("notify.metrics.os.makedirs")
+    def test_start(self, mock_makedirs, mock_thread):
+        self.assertEqual(mock_thread.return_value,
+                         metrics.start("/foo/metrics", 3))
+        mock_makedirs.assert_called_once_with("/foo/metrics")
+        mock_thread.return_value.start.assert_called_once_with()
+        self.assertTrue(mock_thread.return_value.daemon)
@@ -0,0 +1,179 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import jsonschema
+import mock
+
+from notify import ratelimit
+from tests.unit import test
+
+
+@mock.patch("notify.ratelimit.time")
+class TokenBucketTestCase(test.TestCase):
+
+    def test_acquire(self, mock_time):
+        mock_time.time.return_value = 100
+        bucket = ratelimit.TokenBucket(2, burst=3)
+        self.assertEqual([True, True, True, False],
+                         [bucket.acquire() for i in range(4)])
+
+        mock_time.time.return_value = 100.5
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire())
+
+        mock_time.time.return_value = 110
+        self.assertEqual([True, True, True, False],
+                         [bucket.acquire() for i in range(4)])
+        self.assertFalse(mock_time.sleep.called)
+
+    def test_acquire_waits(self, mock_time):
+        now = [100]
+        mock_time.time.side_effect = lambda: now[0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        mock_time.sleep.side_effect = sleep
+        bucket = ratelimit.TokenBucket(4)
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire(timeout=0.2))
+        self.assertTrue(bucket.acquire(timeout=0.25))
+        mock_time.sleep.assert_called_once_with(0.25)
+
+
+@mock.patch("notify.ratelimit.time")
+class SharedTokenBucketTestCase(test.TestCase):
+
+    def setUp(self):
+        super(SharedTokenBucketTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, "limits.db")
+
+    def test_acquire(self, mock_time):
+        mock_time.time.return_value = 100
+        bucket = ratelimit.SharedTokenBucket(self.path, "b1", 2, burst=3)
+        other = ratelimit.SharedTokenBucket(self.path, "b1", 2, burst=3)
+        self.assertEqual([True, True, True, False],
+                         [bucket.acquire(), other.acquire(),
+                          bucket.acquire(), other.acquire()])
+        self.assertTrue(ratelimit.SharedTokenBucket(self.path, "b2",
+                                                    2).acquire())
+
+        mock_time.time.return_value = 100.5
+        self.assertTrue(other.acquire())
+        self.assertFalse(bucket.acquire())
+
+        mock_time.time.return_value = 110
+        self.assertEqual([True, True, True, False],
+                         [bucket.acquire() for i in range(4)])
+        self.assertFalse(mock_time.sleep.called)
+
+    @mock.patch("notify.ratelimit.LOG")
+    def test_acquire_failed(self, mock_log, mock_time):
+        mock_time.time.return_value = 100
+        bucket = ratelimit.SharedTokenBucket(self.path, "b1", 1)
+        bucket._connect = mock.Mock(side_effect=sqlite3.OperationalError)
+        self.assertTrue(bucket.acquire())
+        self.assertTrue(bucket.acquire())
+        self.assertEqual(2, mock_log.error.call_count)
+
+
+class LimitTestCase(test.TestCase):
+
+    def _limit(self, **kwargs):
+        limit = ratelimit.Limit(1, **kwargs)
+        limit.bucket = mock.Mock()
+        return limit
+
+    def test_admit_queue(self):
+        limit = self._limit(max_wait=3)
+        limit.bucket.acquire.return_value = True
+        self.assertEqual(self.payload, limit.admit(self.payload))
+        limit.bucket.acquire.return_value = False
+        self.assertIsNone(limit.admit(self.payload))
+        limit.bucket.acquire.assert_called_with(3)
+
+    def test_admit_drop(self):
+        limit = self._limit(policy="drop", min_severity="WARNING")
+        limit.bucket.acquire.return_value = True
+        self.assertEqual(self.payload, limit.admit(self.payload))
+        limit.bucket.acquire.return_value = False
+        self.assertIsNone(limit.admit(self.payload))
+        for severity in ("WARNING", "CRITICAL", "DOWN"):
+            payload = dict(self.payload, severity=severity)
+            self.assertEqual(payload, limit.admit(payload))
+
+    def test_admit_summarize(self):
+        limit = self._limit(policy="summarize")
+        limit.bucket.acquire.return_value = False
+        for severity in ("INFO", "CRITICAL", "INFO"):
+            self.assertIsNone(limit.admit(dict(self.payload,
+                                               severity=severity)))
+
+        limit.bucket.acquire.return_value = True
+        description = ("This is a test data.\n\n3 alert(s) have been "
+                       "throttled by rate limit: 2 INFO, 1 CRITICAL")
+        self.assertEqual(dict(self.payload, description=description),
+                         limit.admit(self.payload))
+        self.assertEqual(self.payload, limit.admit(self.payload))
+
+
+class LimiterTestCase(test.TestCase):
+
+    def test_admit(self):
+        limiter = ratelimit.Limiter({"b1": {"rate": 1},
+                                     "b1.foo": {"rate": 2, "burst": 5}})
+        self.assertEqual(2, limiter.limits["b1.foo"].bucket.rate)
+        limiter.limits = {"b1": mock.Mock(), "b1.foo": mock.Mock()}
+        limiter.limits["b1.foo"].admit.return_value = "foo_payload"
+        limiter.limits["b1"].admit.return_value = "b1_payload"
+
+        self.assertEqual("b1_payload", limiter.admit("b1", "foo", "payload"))
+        limiter.limits["b1.foo"].admit.assert_called_once_with("payload")
+        limiter.limits["b1"].admit.assert_called_once_with("foo_payload")
+
+        self.assertEqual("b1_payload", limiter.admit("b1", "bar", "payload"))
+        self.assertEqual("payload", limiter.admit("b2", "foo", "payload"))
+
+        limiter.limits["b1.foo"].admit.return_value = None
+        self.assertIsNone(limiter.admit("b1", "foo", "payload"))
+        self.assertEqual(2, limiter.limits["b1"].admit.call_count)
+
+    def test_shared(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "limits.db")
+        limiter = ratelimit.Limiter({"b1": {"rate": 1, "burst": 2}}, path)
+        bucket = limiter.limits["b1"].bucket
+        self.assertIsInstance(bucket, ratelimit.SharedTokenBucket)
+        self.assertEqual((path, "b1", 1, 2),
+                         (bucket.path, bucket.key, bucket.rate, bucket.burst))
+        self.assertIsInstance(ratelimit.Limiter({"b1": {"rate": 1}}).limits[
+            "b1"].bucket, ratelimit.TokenBucket)
+
+    def test_limit_schema(self):
+        jsonschema.validate({"rate": 0.5, "burst": 10, "policy": "drop",
+                             "min_severity": "DOWN"}, ratelimit.LIMIT_SCHEMA)
+        for limit in ({}, {"rate": 0}, {"rate": 1, "policy": "foo"},
+                      {"rate": 1, "foo": "bar"}):
+            self.assertRaises(jsonschema.ValidationError,
+                              jsonschema.validate, limit,
+                              ratelimit.LIMIT_SCHEMA)
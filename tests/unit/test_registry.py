@@ -0,0 +1,147 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from notify import registry
+from tests.unit import test
+
+
+class ModuleTestCase(test.TestCase):
+
+    def test_make_key(self):
+        key = registry.make_key("foo", {"a": 1, "b": {"c": [1, 2]}})
+        self.assertTrue(key.startswith("foo."))
+        self.assertEqual(36, len(key))
+        self.assertEqual(
+            key, registry.make_key("foo", {"b": {"c": [1, 2]}, "a": 1}))
+        self.assertNotEqual(key,
+                            registry.make_key("bar", {"a": 1,
+                                                      "b": {"c": [1, 2]}}))
+        self.assertNotEqual(registry.make_key("foo", {"a": {"b": 1, "c": 2}}),
+                            registry.make_key("foo", {"a": {"b": 1},
+                                                      "c": 2}))
+
+
+@mock.patch("notify.registry.driver.get_driver")
+class RegistryTestCase(test.TestCase):
+
+    def test_get(self, mock_get_driver):
+        mock_get_driver.side_effect = lambda name, conf: mock.Mock()
+        cache = registry.Registry()
+        key, foo = cache.get("foo", {"x": 1})
+        self.assertEqual(registry.make_key("foo", {"x": 1}), key)
+        self.assertEqual((key, foo), cache.get("foo", {"x": 1}))
+        mock_get_driver.assert_called_once_with("foo", {"x": 1})
+
+        bar_key, bar = cache.get("foo", {"x": 2})
+        self.assertNotEqual(foo, bar)
+        self.assertEqual([key, bar_key], cache.keys())
+        self.assertIn(key, cache)
+        self.assertEqual(2, len(cache))
+
+    def test_lookup(self, mock_get_driver):
+        cache = registry.Registry()
+        key = registry.make_key("foo", {"x": 1})
+        self.assertEqual((key, None), cache.lookup("foo", {"x": 1}))
+        self.assertFalse(mock_get_driver.called)
+        self.assertEqual(0, len(cache))
+
+        cache.get("foo", {"x": 1})
+        self.assertEqual((key, mock_get_driver.return_value),
+                         cache.lookup("foo", {"x": 1}))
+        mock_get_driver.assert_called_once_with("foo", {"x": 1})
+
+    @mock.patch("notify.registry.metrics.DRIVER_CACHE")
+    def test_get_counts_hits(self, mock_counter, mock_get_driver):
+        cache = registry.Registry()
+        cache.get("foo", {"x": 1})
+        cache.get("foo", {"x": 1})
+        self.assertEqual([mock.call(result="miss"), mock.call(result="hit")],
+                         mock_counter.inc.mock_calls)
+
+    def test_get_evicts_lru(self, mock_get_driver):
+        mock_get_driver.side_effect = lambda name, conf: mock.Mock()
+        cache = registry.Registry(max_size=2, close_delay=0)
+        key1, drv1 = cache.get("foo", {"x": 1})
+        key2, drv2 = cache.get("foo", {"x": 2})
+        cache.get("foo", {"x": 1})
+        key3, drv3 = cache.get("foo", {"x": 3})
+        self.assertEqual([key1, key3], cache.keys())
+        drv2.close.assert_called_once_with()
+        self.assertFalse(drv1.close.called)
+
+    @mock.patch("notify.registry.time.time")
+    def test_get_evicts_expired(self, mock_time, mock_get_driver):
+        mock_get_driver.side_effect = lambda name, conf: mock.Mock()
+        cache = registry.Registry(ttl=10, close_delay=0)
+        mock_time.return_value = 100
+        key1, drv1 = cache.get("foo", {"x": 1})
+        mock_time.return_value = 105
+        key2, drv2 = cache.get("foo", {"x": 2})
+        mock_time.return_value = 112
+        key3, drv3 = cache.get("foo", {"x": 3})
+        self.assertEqual([key2, key3], cache.keys())
+        drv1.close.assert_called_once_with()
+
+    def test_get_raises(self, mock_get_driver):
+        mock_get_driver.side_effect = RuntimeError
+        cache = registry.Registry()
+        self.assertRaises(RuntimeError, cache.get, "foo", {})
+        self.assertEqual(0, len(cache))
+
+    def test_prune_and_clear(self, mock_get_driver):
+        mock_get_driver.side_effect = lambda name, conf: mock.Mock()
+        cache = registry.Registry(close_delay=0)
+        key1, drv1 = cache.get("foo", {"x": 1})
+        key2, drv2 = cache.get("foo", {"x": 2})
+        drv2.close.side_effect = ValueError
+        cache.prune([key1])
+        self.assertEqual([key1], cache.keys())
+        drv2.close.assert_called_once_with()
+        cache.clear()
+        self.assertEqual([], cache.keys())
+        drv1.close.assert_called_once_with()
+
+    @mock.patch("notify.registry.threading.Timer")
+    def test_close_delay(self, mock_timer, mock_get_driver):
+        mock_get_driver.side_effect = lambda name, conf: mock.Mock()
+        cache = registry.Registry(max_size=1)
+        key1, drv1 = cache.get("foo", {"x": 1})
+        cache.get("foo", {"x": 2})
+        cache.prune([])
+        self.assertFalse(drv1.close.called)
+        self.assertEqual(
+            [mock.call(60, cache._close_now, [[drv1]]),
+             mock.call(60, cache._close_now, [[mock.ANY]])],
+            [call for call in mock_timer.mock_calls if call[0] == ""])
+        self.assertEqual(2, mock_timer.return_value.start.call_count)
+        self.assertTrue(mock_timer.return_value.daemon)
+
+        mock_timer.mock_calls[0][1][1](*mock_timer.mock_calls[0][1][2])
+        drv1.close.assert_called_once_with()
+
+    def test_warm_up(self, mock_get_driver):
+        def get_driver(name, conf):
+            if name == "bad":
+                raise RuntimeError()
+            return mock.Mock()
+
+        mock_get_driver.side_effect = get_driver
+        cache = registry.Registry()
+        keys = cache.warm_up({"b1": {"foo": {}, "bad": {}},
+                              "b2": {"foo": {}}})
+        self.assertEqual([registry.make_key("foo", {})] * 2, keys)
+        self.assertEqual([registry.make_key("foo", {})], cache.keys())
@@ -0,0 +1,146 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import time
+
+import mock
+
+from notify import retry
+from tests.unit import test
+
+
+class ModuleTestCase(test.TestCase):
+
+    @mock.patch("notify.retry.random.uniform", side_effect=lambda a, b: b)
+    def test_get_delay(self, mock_uniform):
+        self.assertEqual([10, 20, 40, 80, 100, 100],
+                         [retry.get_delay(attempts, 10, 100)
+                          for attempts in range(1, 7)])
+        self.assertEqual(100, retry.get_delay(10 ** 6, 10, 100))
+        mock_uniform.assert_called_with(0, 100)
+
+
+class RetryStoreTestCase(test.TestCase):
+
+    def setUp(self):
+        super(RetryStoreTestCase, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, "retry.sqlite")
+        self.handler = mock.Mock(return_value=True)
+
+    def _store(self, **kwargs):
+        kwargs.setdefault("base_delay", 0)
+        kwargs.setdefault("max_delay", 0)
+        return retry.RetryStore(self.path, self.handler, **kwargs)
+
+    def test_add_and_flush(self):
+        store = self._store(flush_size=2)
+        store.add("b1", "foo", self.payload, "Spam!")
+        self.assertEqual({"pending": 1, "dead": 0}, store.stats())
+        self.assertEqual([], self._store().lease_due())
+
+        store.add("b2", "bar", self.payload)
+        self.assertEqual([(1, "b1", "foo", self.payload, 1),
+                          (2, "b2", "bar", self.payload, 1)],
+                         self._store().lease_due())
+
+    def test_flush_drops_oldest(self):
+        store = self._store(max_size=2)
+        for name in ("foo", "bar", "spam"):
+            store.add("b1", name, self.payload)
+        store.flush()
+        self.assertEqual(["bar", "spam"],
+                         [row[2] for row in store.lease_due()])
+        store.flush()
+
+    def test_lease_due_is_exclusive(self):
+        store = self._store()
+        store.add("b1", "foo", self.payload)
+        store.flush()
+        self.assertEqual(1, len(store.lease_due()))
+        self.assertEqual([], self._store().lease_due())
+        self.assertEqual([], self._store(lease=-1).lease_due())
+
+        store = self._store(lease=-1)
+        store.add("b1", "foo", self.payload)
+        store.flush()
+        self.assertEqual(1, len(store.lease_due()))
+        self.assertEqual(1, len(store.lease_due()))
+
+    def test_process_due(self):
+        store = self._store(max_attempts=3)
+        for name in ("ok", "fail", "error"):
+            store.add("b1", name, self.payload)
+        store.flush()
+        outcomes = {"ok": True, "fail": False, "error": ZeroDivisionError()}
+
+        def handler(backend, name, payload):
+            if isinstance(outcomes[name], Exception):
+                raise outcomes[name]
+            return outcomes[name]
+
+        self.handler.side_effect = handler
+
+        self.assertEqual(3, store.process_due())
+        self.assertEqual({"pending": 2, "dead": 0}, store.stats())
+        self.assertEqual(2, store.process_due())
+        self.assertEqual({"pending": 0, "dead": 2}, store.stats())
+        self.assertEqual(0, store.process_due())
+
+        dead = store.get_dead_letters()
+        self.assertEqual([("error", 3, "ZeroDivisionError: "),
+                          ("fail", 3, "Delivery has failed")],
+                         [(d["driver"], d["attempts"], d["error"])
+                          for d in dead])
+        self.assertEqual(self.payload, dead[0]["payload"])
+        self.assertEqual(5, self.handler.call_count)
+
+    def test_process_due_backs_off(self):
+        store = self._store(base_delay=100, max_delay=100)
+        store.add("b1", "foo", self.payload)
+        store.flush()
+        self.assertEqual(0, store.process_due())
+
+    def test_dead_letters_are_bounded(self):
+        store = self._store(max_attempts=2, max_dead_letters=1)
+        self.handler.return_value = False
+        store.add("b1", "foo", self.payload)
+        store.add("b1", "bar", self.payload)
+        store.flush()
+        self.assertEqual(2, store.process_due())
+        self.assertEqual(["bar"],
+                         [d["driver"] for d in store.get_dead_letters()])
+
+    def test_start(self):
+        store = self._store(flush_interval=0.01, poll_interval=0.01)
+        store.start()
+        self.addCleanup(store.stop)
+        store.start()
+        store.add("b1", "foo", self.payload)
+        for i in range(500):
+            if self.handler.called:
+                break
+            time.sleep(0.01)
+        self.handler.assert_called_once_with("b1", "foo", self.payload)
+
+    def test_stop_flushes(self):
+        store = self._store()
+        store.add("b1", "foo", self.payload)
+        store.stop()
+        self.assertEqual(1, len(self._store().lease_due()))
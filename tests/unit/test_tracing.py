@@ -0,0 +1,124 @@
+# Copyright 2016: Mirantis Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+
+from notify import tracing
+from tests.unit import test
+
+
+class TracingTestCase(test.TestCase):
+
+    def setUp(self):
+        super(TracingTestCase, self).setUp()
+        self.settings = {"sample_rate": 0, "file": None, "inline": True}
+        mock.patch("notify.tracing.get_settings",
+                   return_value=self.settings).start()
+
+    def test_start_trace(self):
+        root = tracing.start_trace("request", request_id="abc-1")
+        self.assertEqual("abc-1", tracing.get_request_id())
+        self.assertFalse(root.trace.sampled)
+        self.assertIs(tracing.NOOP_SPAN, tracing.span("foo"))
+        self.assertIsNone(tracing.finish_trace(root))
+        self.assertIsNone(tracing.get_request_id())
+
+    def test_start_trace_bad_request_id(self):
+        root = tracing.start_trace("request", request_id="a b\nc")
+        self.addCleanup(tracing.finish_trace, root)
+        self.assertEqual(32, len(root.trace.request_id))
+
+    @mock.patch("notify.tracing.random.random", return_value=0.3)
+    def test_start_trace_sample_rate(self, mock_random):
+        self.settings["sample_rate"] = 0.5
+        self.assertTrue(tracing.start_trace("request").trace.sampled)
+        self.settings["sample_rate"] = 0.2
+        self.assertFalse(tracing.start_trace("request").trace.sampled)
+        tracing.finish_trace(tracing.start_trace("request"))
+
+    def test_spans(self):
+        root = tracing.start_trace("request", sampled=True, path="/foo")
+        with tracing.span("outer", a=1) as outer:
+            with tracing.span("inner") as inner:
+                inner.set(b=2)
+            self.assertRaises(ValueError, self._fail)
+        spans = tracing.finish_trace(root, code=200)
+
+        self.assertEqual(["request", "outer", "inner", "failing"],
+                         [span["name"] for span in spans])
+        self.assertEqual([None, root.id, outer.id, outer.id],
+                         [span["parent_id"] for span in spans])
+        self.assertEqual({"path": "/foo", "code": 200}, spans[0]["attrs"])
+        self.assertEqual({"a": 1}, spans[1]["attrs"])
+        self.assertEqual({"b": 2}, spans[2]["attrs"])
+        self.assertEqual("ValueError: bar", spans[3]["error"])
+        for span in spans:
+            self.assertGreaterEqual(span["duration"], 0)
+
+    def _fail(self):
+        with tracing.span("failing"):
+            raise ValueError("bar")
+
+    def test_wrap(self):
+        self.assertIs(len, tracing.wrap(len))
+        root = tracing.start_trace("request", sampled=True)
+
+        def call():
+            with tracing.span("in_thread"):
+                pass
+        thread = threading.Thread(target=tracing.wrap(call))
+        thread.start()
+        thread.join()
+        spans = tracing.finish_trace(root)
+        self.assertEqual(["request", "in_thread"],
+                         [span["name"] for span in spans])
+        self.assertEqual(root.id, spans[1]["parent_id"])
+
+    def test_finish_trace_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.settings["file"] = os.path.join(tmpdir, "traces.jsonl")
+        for i in range(2):
+            root = tracing.start_trace("request", request_id=str(i),
+                                       sampled=True)
+            tracing.finish_trace(root)
+
+        with open(self.settings["file"]) as traces:
+            records = [json.loads(line) for line in traces]
+        self.assertEqual(["0", "1"],
+                         [record["request_id"] for record in records])
+        self.assertEqual("request", records[0]["spans"][0]["name"])
+
+    def test_request_id_filter(self):
+        log_filter = tracing.RequestIdFilter()
+        record = logging.LogRecord("foo", logging.INFO, __file__, 1,
+                                   "message %s", ("x",), None)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual("-", record.request_id)
+        self.assertEqual("message x", record.getMessage())
+
+        root = tracing.start_trace("request", request_id="abc")
+        self.addCleanup(tracing.finish_trace, root)
+        log_filter.filter(record)
+        log_filter.filter(record)
+        self.assertEqual("abc", record.request_id)
+        self.assertEqual("[req-abc] message x", record.getMessage())